@@ -0,0 +1,196 @@
+import asyncio
+import lzma
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, closing
+from functools import partial
+from zipfile import BadZipFile
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.parser import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_XML_PARSER, ZIP_READERS, CSVWriter,
+    ParserError, XMLBuffer, ZIPParserError, encode_result, init_worker,
+    list_archives, parse_xml_file, plan_chunks)
+from ngenix_demo_task.records import Records
+
+DEFAULT_READERS = 4
+
+
+def _read_content(xml_file):
+    if isinstance(xml_file, XMLBuffer):
+        return bytes(xml_file.data)
+    return xml_file.read()
+
+
+def read_chunk(chunk, zip_reader='zipfile'):
+    '''Прочитать и распаковать файлы части zip архива.
+
+    :param ArchiveChunk chunk: читаемая часть архива.
+    :param str zip_reader: способ чтения архива (см. parse_archive).
+
+    :returns: list пар (имя файла, содержимое).
+    :raises: ParserError.
+    '''
+    read = ZIP_READERS[zip_reader]
+    try:
+        with closing(read(chunk.path, chunk.start, chunk.stop)) as members:
+            return [(file, _read_content(x)) for file, x in members]
+    except (BadZipFile, zlib.error, EOFError, lzma.LZMAError):
+        raise ZIPParserError('ZIP file {} is corrupted'.format(chunk.path))
+    except IOError as error:
+        raise ParserError(str(error))
+
+
+def parse_members(path, members, xml_parser=DEFAULT_XML_PARSER, encode=False,
+                  store=None, validate=None):
+    '''Разобрать прочитанные файлы части zip архива.
+
+    :param str path: путь до zip архива.
+    :param list members: пары (имя файла, содержимое), см. read_chunk.
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param bool encode: закодировать результат в csv (см. encode_result).
+    :param store: функция сохранения результата (см. parse_chunk).
+    :param validate: функция проверки документа (см. parse_archive).
+
+    :returns: Records, закодированный результат или результат store.
+    :raises: ParserError.
+    '''
+    records = Records()
+    for file, content in members:
+        if '.xml' not in file:
+            raise ZIPParserError('ZIP file {} is corrupted'.format(path))
+        parse_xml_file(XMLBuffer(file, content), xml_parser, records)
+        if validate is not None:
+            validate(records.ids[-1], records.levels[-1])
+    if store is not None:
+        return store(records)
+    if encode:
+        return encode_result(records)
+    return records
+
+
+async def _process(loop, chunk, readers, parsers, options):
+    members = await loop.run_in_executor(
+        readers, read_chunk, chunk, options['zip_reader']
+    )
+    task = partial(parse_members, chunk.path, members,
+                   options['xml_parser'], options['encode'], options['store'],
+                   options['validate'])
+    if not metrics.enabled():
+        return await loop.run_in_executor(parsers, task)
+    result, snapshot = await loop.run_in_executor(
+        parsers, metrics.profiled, task
+    )
+    metrics.merge(snapshot)
+    return result
+
+
+async def _produce(loop, queue, slots, chunks, readers, process):
+    try:
+        while True:
+            # Задача создается только при свободном месте в окне, иначе
+            # вместе с ожидающей в очереди в работе оказалось бы больше
+            # window частей.
+            await slots.acquire()
+            chunk = await loop.run_in_executor(readers, next, chunks, None)
+            if chunk is None:
+                slots.release()
+                return
+            await queue.put(asyncio.ensure_future(process(chunk)))
+    finally:
+        await queue.put(None)
+
+
+async def _consume(loop, queue, slots, writers, output):
+    while True:
+        task = await queue.get()
+        if task is None:
+            return
+        result = await task
+        await loop.run_in_executor(writers, output.write, result)
+        slots.release()
+
+
+async def _run(loop, archive_paths, output, window, readers, parsers,
+               writers, options):
+    # Части планируются по мере обработки: центральный каталог следующего
+    # архива читается, когда в окне освобождается место.
+    chunks = plan_chunks(archive_paths, options['chunk_size'])
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(window)
+
+    def process(chunk):
+        return _process(loop, chunk, readers, parsers, options)
+
+    producer = asyncio.ensure_future(
+        _produce(loop, queue, slots, chunks, readers, process)
+    )
+    try:
+        await _consume(loop, queue, slots, writers, output)
+        await producer
+    finally:
+        tasks = [producer]
+        while not queue.empty():
+            task = queue.get_nowait()
+            if task is not None:
+                tasks.append(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def do_task_two_async(path, writer=CSVWriter, window=None,
+                      xml_parser=DEFAULT_XML_PARSER, workers=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE,
+                      readers=DEFAULT_READERS, zip_reader='zipfile'):
+    '''Обработать содержимое папки с zip архивами согласно заданию №2,
+    совмещая чтение, разбор и запись результатов.
+
+    Обработка каждой части архива (см. plan_chunks) проходит три стадии:
+    чтение и распаковка файлов в пуле потоков, разбор в пуле процессов и
+    запись результата в отдельном потоке. Стадии разных частей выполняются
+    одновременно, поэтому медленный диск не простаивает процессоры и
+    наоборот. Одновременно в работе находится не более window частей:
+    когда запись отстает, чтение новых частей приостанавливается.
+    Результаты записываются в порядке архивов и файлов в них.
+
+    :param str path: путь до папки с архивами.
+    :param writer: класс записи результатов (см. do_task_two).
+    :param int window: максимальное количество частей архивов в работе
+                       (По умолчанию: удвоенное количество процессов).
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param int workers: количество процессов (По умолчанию: количество
+                        процессоров).
+    :param int chunk_size: желаемый размер части архива в байтах.
+    :param int readers: количество потоков чтения архивов.
+    :param str zip_reader: способ чтения архивов (см. parse_archive).
+
+    :raises: ParserError.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    archive_paths = list_archives(path)
+    with ExitStack() as stack:
+        loop = asyncio.new_event_loop()
+        stack.callback(loop.close)
+        output = stack.enter_context(writer(path))
+        readers_pool = stack.enter_context(ThreadPoolExecutor(readers))
+        parsers_pool = stack.enter_context(
+            ProcessPoolExecutor(workers, initializer=init_worker)
+        )
+        writers_pool = stack.enter_context(ThreadPoolExecutor(1))
+        options = {
+            'xml_parser': xml_parser,
+            'chunk_size': chunk_size,
+            'encode': output.encoded,
+            'store': output.store,
+            'validate': output.validate,
+            'zip_reader': zip_reader,
+        }
+        loop.run_until_complete(_run(
+            loop, archive_paths, output, window, readers_pool, parsers_pool,
+            writers_pool, options
+        ))
@@ -0,0 +1,327 @@
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import time
+from datetime import datetime
+from functools import partial
+from random import Random
+from zipfile import ZipFile
+
+from lxml import etree
+
+from ngenix_demo_task.generator import (
+    RENDERERS, archive_name, do_task_one, generate_data, generate_zip)
+from ngenix_demo_task.parser import (
+    XML_PARSERS, do_task_two, parse_archive, parse_xml_file)
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+DEFAULT_SIZES = ((10, 100), (50, 100), (10, 1000))
+
+
+class BenchmarkError(Exception):
+    '''Ошибка выполнения замеров производительности.'''
+    pass
+
+
+def parse_sizes(text):
+    '''Разобрать список размеров наборов архивов вида 10x100,50x1000.
+
+    :param str text: размеры через запятую в формате
+                     <количество архивов>x<количество документов>.
+
+    :returns: tuple пар (количество архивов, количество документов).
+    :raises: BenchmarkError.
+    '''
+    sizes = []
+    for item in text.split(','):
+        try:
+            archives, documents = (int(x) for x in item.lower().split('x'))
+        except ValueError:
+            raise BenchmarkError('Bad corpus size {}'.format(item))
+        if archives < 1 or documents < 1:
+            raise BenchmarkError('Bad corpus size {}'.format(item))
+        sizes.append((archives, documents))
+    return tuple(sizes)
+
+
+def peak_rss():
+    '''Получить пиковое потребление памяти процессом и его дочерними
+    процессами.
+
+    Значения накапливаются за все время работы процесса, поэтому каждый
+    замер выполняется в отдельном процессе (см. run_isolated).
+
+    :returns: tuple (пик процесса, пик дочерних процессов) в килобайтах.
+    '''
+    if resource is None:
+        return None, None
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_maxrss, children_usage.ru_maxrss
+
+
+def _run_measured(task, connection):
+    '''Выполнить замер в дочернем процессе и передать результат.'''
+    try:
+        started = time.perf_counter()
+        task()
+        seconds = time.perf_counter() - started
+        connection.send((None, seconds) + peak_rss())
+    except Exception as error:
+        connection.send((error, None, None, None))
+    finally:
+        connection.close()
+
+
+def run_isolated(task):
+    '''Выполнить функцию в новом процессе и замерить время ее выполнения и
+    пиковое потребление памяти.
+
+    Процесс запускается методом spawn, поэтому не наследует память
+    родителя, и пик отражает только этот замер (вместе с самим
+    интерпретатором), а не максимум по всем предыдущим.
+
+    :param task: замеряемая функция без аргументов, передаваемая в процесс
+                 через pickle.
+
+    :returns: tuple (время в секундах, пик процесса, пик дочерних
+              процессов), память в килобайтах.
+    :raises: BenchmarkError.
+    '''
+    context = mp.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_measured, args=(task, sender))
+    process.start()
+    sender.close()
+    try:
+        error, *result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise BenchmarkError(
+            'Benchmark process exited with code {}'.format(process.exitcode)
+        )
+    finally:
+        receiver.close()
+        process.join()
+    if error is not None:
+        raise error
+    return tuple(result)
+
+
+def measure(name, variant, size, documents, size_bytes, task):
+    '''Замерить время выполнения функции в отдельном процессе (см.
+    run_isolated) и сформировать запись результата.
+
+    :param str name: наименование замера.
+    :param str variant: вариант реализации.
+    :param str size: размер набора архивов.
+    :param int documents: количество обработанных документов.
+    :param int size_bytes: объем обработанных данных в байтах.
+    :param task: замеряемая функция без аргументов.
+
+    :returns: dict с результатом замера.
+    :raises: BenchmarkError.
+    '''
+    seconds, rss, children_rss = run_isolated(task)
+    return {
+        'benchmark': name,
+        'variant': variant,
+        'size': size,
+        'documents': documents,
+        'bytes': size_bytes,
+        'seconds': seconds,
+        'docs_per_sec': documents / seconds if seconds else None,
+        'mb_per_sec': size_bytes / seconds / 2 ** 20 if seconds else None,
+        'peak_rss_kb': rss,
+        'children_peak_rss_kb': children_rss,
+    }
+
+
+def _with_bytes(result, size_bytes):
+    result['bytes'] = size_bytes
+    if result['seconds']:
+        result['mb_per_sec'] = size_bytes / result['seconds'] / 2 ** 20
+    return result
+
+
+def _render_all(render, data):
+    for item in data:
+        render(*item)
+
+
+def _parse_all(contents, xml_parser):
+    for content in contents:
+        xml_file = io.BytesIO(content)
+        xml_file.name = 'benchmark'
+        parse_xml_file(xml_file, xml_parser)
+
+
+def _parse_archives(paths, xml_parser):
+    for path in paths:
+        parse_archive(path, xml_parser)
+
+
+def _corpus_size(paths):
+    documents, size_bytes = 0, 0
+    for path in paths:
+        with ZipFile(path, 'r') as archive:
+            for info in archive.infolist():
+                documents += 1
+                size_bytes += info.file_size
+    return documents, size_bytes
+
+
+def _read_members(path):
+    with ZipFile(path, 'r') as archive:
+        return [archive.read(x) for x in archive.namelist()]
+
+
+def bench_size(path, archives, documents, workers=None, seed=0):
+    '''Выполнить замеры на наборе архивов заданного размера.
+
+    :param str path: путь до папки, в которой создается набор архивов.
+    :param int archives: количество архивов.
+    :param int documents: количество документов в архиве.
+    :param int workers: количество процессов.
+    :param int seed: начальное значение генератора случайных чисел.
+
+    :returns: list с результатами замеров.
+    '''
+    size = '{}x{}'.format(archives, documents)
+    corpus = os.path.join(path, size)
+    os.makedirs(corpus, exist_ok=True)
+    results = []
+    rng = Random(seed)
+    data = [generate_data(rng=rng) for _ in range(documents)]
+    for renderer in sorted(RENDERERS):
+        render = RENDERERS[renderer]
+        size_bytes = sum(len(render(*x).encode()) for x in data)
+        results.append(measure(
+            'render_xml', renderer, size, documents, size_bytes,
+            partial(_render_all, render, data)
+        ))
+    zip_path = os.path.join(corpus, 'generate_zip.zip')
+    for renderer in sorted(RENDERERS):
+        result = measure(
+            'generate_zip', renderer, size, documents, 0,
+            partial(generate_zip, zip_path, documents, renderer=renderer,
+                    seed=seed)
+        )
+        results.append(_with_bytes(result, os.path.getsize(zip_path)))
+    os.remove(zip_path)
+    # do_task_one не перезаписывает архивы, оставшиеся от прошлого запуска с
+    # keep.
+    for archive_number in range(archives):
+        old_path = os.path.join(corpus, archive_name(archive_number, archives))
+        if os.path.exists(old_path):
+            os.remove(old_path)
+    result = measure(
+        'do_task_one', 'pool', size, archives * documents, 0,
+        partial(do_task_one, corpus, archives, workers=workers,
+                documents=documents, seed=seed)
+    )
+    paths = sorted(
+        os.path.join(corpus, x) for x in os.listdir(corpus)
+        if x.endswith('.zip')
+    )
+    results.append(
+        _with_bytes(result, sum(os.path.getsize(x) for x in paths))
+    )
+    total_documents, total_bytes = _corpus_size(paths)
+    contents = _read_members(paths[0])
+    for xml_parser in sorted(XML_PARSERS):
+        results.append(measure(
+            'parse_xml_file', xml_parser, size, len(contents),
+            sum(len(x) for x in contents),
+            partial(_parse_all, contents, xml_parser)
+        ))
+        results.append(measure(
+            'parse_archive', xml_parser, size, total_documents, total_bytes,
+            partial(_parse_archives, paths, xml_parser)
+        ))
+        results.append(measure(
+            'do_task_two', xml_parser, size, total_documents, total_bytes,
+            partial(do_task_two, corpus, workers=workers,
+                    xml_parser=xml_parser)
+        ))
+    return results
+
+
+def run_benchmarks(path, sizes=DEFAULT_SIZES, workers=None, seed=0,
+                   keep=False):
+    '''Выполнить замеры производительности генератора и парсера.
+
+    Для каждого размера набора архивов генерируется воспроизводимый набор
+    данных, на котором замеряется время render_xml, generate_zip,
+    do_task_one, parse_xml_file, parse_archive и do_task_two.
+
+    :param str path: путь до папки для создания наборов архивов.
+    :param sizes: iterable пар (количество архивов, количество документов).
+    :param int workers: количество процессов.
+    :param int seed: начальное значение генератора случайных чисел.
+    :param bool keep: не удалять наборы архивов после замеров.
+
+    :returns: dict с описанием окружения и результатами замеров.
+    :raises: BenchmarkError.
+    '''
+    results = []
+    try:
+        for archives, documents in sizes:
+            results += bench_size(path, archives, documents, workers, seed)
+            if not keep:
+                size = '{}x{}'.format(archives, documents)
+                shutil.rmtree(os.path.join(path, size))
+    except OSError as error:
+        raise BenchmarkError(str(error))
+    return {
+        'created': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'lxml': '.'.join(str(x) for x in etree.LXML_VERSION),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': workers,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def save_results(path, report):
+    '''Сохранить результаты замеров в JSON файл.
+
+    :param str path: путь до JSON файла.
+    :param dict report: результаты run_benchmarks.
+
+    :raises: BenchmarkError.
+    '''
+    try:
+        with open(path, 'w') as json_file:
+            json.dump(report, json_file, indent=2, sort_keys=True)
+    except IOError as error:
+        raise BenchmarkError(str(error))
+
+
+def format_results(report):
+    '''Сформировать текстовую таблицу результатов замеров.
+
+    :param dict report: результаты run_benchmarks.
+
+    :returns: str с таблицей.
+    '''
+    header = ('benchmark', 'variant', 'size', 'docs/sec', 'MB/sec',
+              'peak RSS, KB')
+    lines = ['{:<16}{:<10}{:<12}{:>12}{:>10}{:>14}'.format(*header)]
+    for result in report['results']:
+        rss = max(result['peak_rss_kb'] or 0,
+                  result['children_peak_rss_kb'] or 0)
+        lines.append('{:<16}{:<10}{:<12}{:>12.0f}{:>10.2f}{:>14}'.format(
+            result['benchmark'], result['variant'], result['size'],
+            result['docs_per_sec'] or 0, result['mb_per_sec'] or 0, rss
+        ))
+    return '\n'.join(lines)
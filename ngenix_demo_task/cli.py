@@ -1,28 +1,169 @@
 import os
+import time
+from functools import partial
 
 import click
 from click.exceptions import ClickException
 
-from ngenix_demo_task.generator import GeneratorError, do_task_one
-from ngenix_demo_task.parser import ParserError, do_task_two
+from ngenix_demo_task import metrics
+from ngenix_demo_task.aio import do_task_two_async
+from ngenix_demo_task.bench import (
+    BenchmarkError, format_results, parse_sizes, run_benchmarks, save_results)
+from ngenix_demo_task.cluster import (
+    DEFAULT_PORT, DEFAULT_RETRIES, ClusterError, do_task_two_cluster,
+    parse_address, run_worker)
+from ngenix_demo_task.generator import (
+    COMPRESSIONS, DEFAULT_BUFFER_SIZE, MAX_OBJECTS, OBJECTS_DISTRIBUTIONS,
+    RENDERERS, GeneratorError, do_task_one, do_task_one_stream)
+from ngenix_demo_task.manifest import do_task_two_incremental
+from ngenix_demo_task.parser import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_XML_PARSER, DUPLICATES, OBJECTS_HEADER,
+    ON_ERROR, VARS_HEADER, XML_PARSERS, ZIP_READERS, CSVWriter, ParserError,
+    do_task_two)
+from ngenix_demo_task.records import encode_csv
+from ngenix_demo_task.shards import ShardedCSVWriter
+from ngenix_demo_task.sorting import (
+    DEFAULT_SORT_MEMORY, SortedCSVWriter, lookup)
+from ngenix_demo_task.stats import (
+    DEFAULT_NAMES_CAPACITY, DEFAULT_TOP, collect_stats, format_stats,
+    save_stats)
+from ngenix_demo_task.stream import do_task_two_stream
+from ngenix_demo_task.watch import watch_folder
+from ngenix_demo_task.writers import DEFAULT_BATCH_SIZE, WRITERS
+
+
+class ByteSize(click.ParamType):
+    '''Размер в байтах с необязательным суффиксом K, M или G.'''
+
+    name = 'size'
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        text = value.strip().upper()
+        multiplier = self.multipliers.get(text[-1:], 1)
+        if multiplier != 1:
+            text = text[:-1]
+        try:
+            size = int(text) * multiplier
+        except ValueError:
+            self.fail('{} is not a valid size'.format(value), param, ctx)
+        if size <= 0:
+            self.fail('size must be positive', param, ctx)
+        return size
+
+
+def _report_metrics(output, started):
+    wall = time.perf_counter() - started
+    snapshot = metrics.snapshot()
+    click.echo(metrics.format_table(snapshot, wall), err=True)
+    if output is not None:
+        try:
+            metrics.save(output, snapshot, wall)
+        except metrics.MetricsError as error:
+            raise ClickException(error)
 
 
 @click.group()
 @click.help_option(
     help='Отобразить эту справочную информацию и завершить работу'
 )
-def main(**kwargs):
+@click.option('--profile', is_flag=True,
+              help='Собрать время этапов обработки и счетчики документов, '
+                   'байт и ошибок по всем процессам и вывести их по '
+                   'завершении команды')
+@click.option('--profile-output', default=None,
+              help='Файл для сохранения метрик: в формате Prometheus '
+                   'textfile, если имя оканчивается на .prom, иначе в JSON')
+@click.pass_context
+def main(ctx, **kwargs):
     '''Тестовое задание для компании Ngenix.'''
-    pass
+    if kwargs['profile'] or kwargs['profile_output']:
+        metrics.enable()
+        metrics.reset()
+        ctx.call_on_close(partial(
+            _report_metrics, kwargs['profile_output'], time.perf_counter()
+        ))
 
 
 @main.command()
 @click.option('-o', '--output', default=os.getcwd(),
-              help='Папка для создания файлов (По умолчанию: текущая папка')
+              help='Папка для создания файлов, либо - для записи архива в '
+                   'стандартный вывод (По умолчанию: текущая папка')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Количество процессов (По умолчанию: количество '
+                   'процессоров)')
+@click.option('--renderer', type=click.Choice(sorted(RENDERERS)),
+              default='template',
+              help='Способ формирования xml документов (По умолчанию: '
+                   'template)')
+@click.option('-n', '--archives', type=click.IntRange(min=0), default=None,
+              help='Количество архивов (По умолчанию: 50, при записи в '
+                   'стандартный вывод: 1)')
+@click.option('-d', '--documents', type=click.IntRange(min=0), default=100,
+              help='Количество xml документов в архиве (По умолчанию: 100)')
+@click.option('--min-objects', type=click.IntRange(1, MAX_OBJECTS),
+              default=1,
+              help='Минимальное количество объектов в документе '
+                   '(По умолчанию: 1)')
+@click.option('--max-objects', type=click.IntRange(1, MAX_OBJECTS),
+              default=MAX_OBJECTS,
+              help='Максимальное количество объектов в документе, не '
+                   'больше {0} (По умолчанию: {0})'.format(MAX_OBJECTS))
+@click.option('--objects-distribution',
+              type=click.Choice(sorted(OBJECTS_DISTRIBUTIONS)),
+              default='uniform',
+              help='Распределение количества объектов в документе: '
+                   'uniform - равномерное, triangular - треугольное с '
+                   'модой в --max-objects (По умолчанию: uniform)')
+@click.option('--min-level', type=int, default=1,
+              help='Минимальное значение level (По умолчанию: 1)')
+@click.option('--max-level', type=int, default=100,
+              help='Максимальное значение level (По умолчанию: 100)')
+@click.option('--compression', type=click.Choice(sorted(COMPRESSIONS)),
+              default='stored',
+              help='Метод сжатия архивов (По умолчанию: stored)')
+@click.option('--compresslevel', type=int, default=None,
+              help='Уровень сжатия архивов: 0-9 для deflated, 1-9 для '
+                   'bzip2')
+@click.option('--seed', type=int, default=None,
+              help='Начальное значение генератора случайных чисел для '
+                   'воспроизводимой генерации')
+@click.option('--buffer-size', type=ByteSize(), default=DEFAULT_BUFFER_SIZE,
+              help='Размер буфера записи архива, например 256K или 4M '
+                   '(По умолчанию: 1M)')
 def generate(**kwargs):
     '''Сгенерировать набор zip архивов.'''
+    data_options = {
+        'min_objects': kwargs['min_objects'],
+        'max_objects': kwargs['max_objects'],
+        'min_level': kwargs['min_level'],
+        'max_level': kwargs['max_level'],
+        'distribution': kwargs['objects_distribution'],
+    }
+    options = {
+        'renderer': kwargs['renderer'],
+        'documents': kwargs['documents'],
+        'compression': kwargs['compression'],
+        'compresslevel': kwargs['compresslevel'],
+        'data_options': data_options,
+        'seed': kwargs['seed'],
+        'buffer_size': kwargs['buffer_size'],
+    }
     try:
-        do_task_one(kwargs['output'])
+        if kwargs['output'] == '-':
+            if kwargs['archives'] not in (None, 1):
+                raise click.UsageError(
+                    'Only one archive can be written to standard output'
+                )
+            with click.open_file('-', 'wb') as stream:
+                do_task_one_stream(stream, **options)
+        else:
+            quantity = kwargs['archives']
+            do_task_one(kwargs['output'],
+                        quantity=50 if quantity is None else quantity,
+                        workers=kwargs['workers'], **options)
     except GeneratorError as error:
         raise ClickException(error)
 
@@ -31,12 +172,336 @@ def generate(**kwargs):
 @click.option('-o', '--output', default=os.getcwd(),
               help='Папка для чтения и создания файлов (По умолчанию:'
                    'текущая папка')
+@click.option('--window', type=click.IntRange(min=1), default=None,
+              help='Максимальное количество архивов в обработке '
+                   'одновременно (По умолчанию: удвоенное количество '
+                   'процессоров)')
+@click.option('--xml-parser', type=click.Choice(sorted(XML_PARSERS)),
+              default=DEFAULT_XML_PARSER,
+              help='Способ разбора xml документов (По умолчанию: {})'.format(
+                  DEFAULT_XML_PARSER))
+@click.option('--zip-reader', type=click.Choice(sorted(ZIP_READERS)),
+              default='zipfile',
+              help='Способ чтения архивов: zipfile или mmap - отображение '
+                   'архива в память (По умолчанию: zipfile)')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Количество процессов (По умолчанию: количество '
+                   'процессоров)')
+@click.option('--chunk-size', type=ByteSize(), default=DEFAULT_CHUNK_SIZE,
+              help='Размер части архива после распаковки, передаваемой '
+                   'процессу, например 512K или 4M (По умолчанию: 1M)')
+@click.option('--incremental', is_flag=True,
+              help='Разбирать только новые и измененные с прошлого запуска '
+                   'архивы')
+@click.option('--watch', is_flag=True,
+              help='Непрерывно обрабатывать новые архивы, появляющиеся в '
+                   'папке (завершение по SIGTERM)')
+@click.option('--poll-interval', type=click.FloatRange(min=0.01),
+              default=1.0,
+              help='Интервал опроса папки в режиме --watch в секундах '
+                   '(По умолчанию: 1)')
+@click.option('--polling', is_flag=True,
+              help='Использовать в режиме --watch опрос папки вместо '
+                   'inotify')
+@click.option('-f', '--format', 'output_format',
+              type=click.Choice(sorted(WRITERS)), default='csv',
+              help='Формат результатов (По умолчанию: csv)')
+@click.option('--batch-size', type=click.IntRange(min=1),
+              default=DEFAULT_BATCH_SIZE,
+              help='Количество строк в пакете для форматов parquet и arrow '
+                   '(По умолчанию: {})'.format(DEFAULT_BATCH_SIZE))
+@click.option('--engine', type=click.Choice(['async', 'pool']),
+              default='pool',
+              help='Способ обработки: pool - пул процессов, async - '
+                   'одновременные чтение, разбор и запись на asyncio '
+                   '(По умолчанию: pool)')
+@click.option('--on-error', type=click.Choice(ON_ERROR), default='raise',
+              help='Действие при ошибке разбора: raise - прервать '
+                   'обработку, skip - пропустить документ или архив и '
+                   'записать его в rejects.csv, quarantine - также '
+                   'поместить его в папку карантина (По умолчанию: raise)')
+@click.option('--quarantine', default=None,
+              help='Папка карантина для --on-error quarantine (По '
+                   'умолчанию: папка quarantine внутри папки с архивами)')
+@click.option('--duplicates', type=click.Choice(DUPLICATES),
+              default='allow',
+              help='Проверка уникальности id во всех архивах: allow - не '
+                   'проверять, report - записать повторные id в '
+                   'duplicates.csv, drop - также исключить документы с '
+                   'повторными id (По умолчанию: allow)')
+@click.option('--shards', type=click.IntRange(min=1), default=None,
+              help='Записать каждую таблицу в указанное количество файлов '
+                   'частей по хешу id, дописываемых процессами пула '
+                   'параллельно')
+@click.option('--parts-manifest/--no-parts-manifest', default=True,
+              help='Сохранить список файлов частей в parts.json '
+                   '(По умолчанию: сохранять)')
+@click.option('--sorted', 'sort', is_flag=True,
+              help='Отсортировать csv файлы по id и сохранить индекс для '
+                   'команды lookup')
+@click.option('--sort-memory', type=ByteSize(), default=DEFAULT_SORT_MEMORY,
+              help='Объем памяти для сортировки, например 256M '
+                   '(По умолчанию: 64M)')
+@click.argument('source', required=False)
 def parse(**kwargs):
-    '''Сгенерировать csv файлы из zip архивов.'''
+    '''Сгенерировать csv файлы из zip архивов.
+
+    Если передан SOURCE, разбирается только этот zip архив, а результаты
+    сохраняются в папку output; с SOURCE равным - архив читается из
+    стандартного ввода, например из канала.
+    '''
+    writer = WRITERS[kwargs['output_format']]
+    if writer is not CSVWriter:
+        writer = partial(writer, batch_size=kwargs['batch_size'])
+    if kwargs['shards'] is not None:
+        if kwargs['output_format'] != 'csv':
+            raise click.UsageError('--shards supports only csv format')
+        writer = partial(ShardedCSVWriter, shards=kwargs['shards'],
+                         manifest=kwargs['parts_manifest'])
+    if kwargs['sort']:
+        if kwargs['output_format'] != 'csv' or kwargs['shards'] is not None:
+            raise click.UsageError(
+                '--sorted supports only csv format without --shards'
+            )
+        writer = partial(SortedCSVWriter, memory=kwargs['sort_memory'])
+    if kwargs['sort'] and (kwargs['incremental'] or kwargs['watch']):
+        raise click.UsageError(
+            '--sorted is not supported with --incremental and --watch'
+        )
+    if kwargs['shards'] is not None and (kwargs['incremental'] or
+                                         kwargs['watch']):
+        raise click.UsageError(
+            '--shards is not supported with --incremental and --watch'
+        )
+    if kwargs['output_format'] != 'csv' and (kwargs['incremental'] or
+                                             kwargs['watch']):
+        raise click.UsageError(
+            '--incremental and --watch support only csv format'
+        )
+    if kwargs['engine'] != 'pool' and (kwargs['incremental'] or
+                                       kwargs['watch']):
+        raise click.UsageError(
+            '--incremental and --watch support only pool engine'
+        )
+    if kwargs['on_error'] != 'raise' and (kwargs['incremental'] or
+                                          kwargs['watch'] or
+                                          kwargs['engine'] != 'pool'):
+        raise click.UsageError(
+            '--on-error is not supported with --incremental, --watch and '
+            'async engine'
+        )
+    if kwargs['duplicates'] != 'allow' and (kwargs['incremental'] or
+                                            kwargs['watch'] or
+                                            kwargs['engine'] != 'pool' or
+                                            kwargs['shards'] is not None):
+        raise click.UsageError(
+            '--duplicates is not supported with --incremental, --watch, '
+            '--shards and async engine'
+        )
+    if kwargs['source'] is not None and (kwargs['incremental'] or
+                                         kwargs['watch'] or
+                                         kwargs['engine'] != 'pool' or
+                                         kwargs['on_error'] != 'raise' or
+                                         kwargs['duplicates'] != 'allow'):
+        raise click.UsageError(
+            'SOURCE is not supported with --incremental, --watch, '
+            '--on-error, --duplicates and async engine'
+        )
+    task = partial(do_task_two, writer=writer)
+    if kwargs['on_error'] != 'raise' or kwargs['duplicates'] != 'allow':
+        task = partial(do_task_two, writer=writer,
+                       on_error=kwargs['on_error'],
+                       quarantine=kwargs['quarantine'],
+                       duplicates=kwargs['duplicates'])
+    if kwargs['engine'] == 'async':
+        task = partial(do_task_two_async, writer=writer)
+    if kwargs['source'] is not None:
+        task = partial(do_task_two_stream, source=kwargs['source'],
+                       writer=writer)
+    if kwargs['incremental']:
+        task = do_task_two_incremental
+    if kwargs['watch']:
+        task = partial(
+            watch_folder, interval=kwargs['poll_interval'],
+            polling=kwargs['polling'],
+            log=partial(click.echo, err=True)
+        )
     try:
-        do_task_two(kwargs['output'])
+        rejected = task(kwargs['output'], window=kwargs['window'],
+                        xml_parser=kwargs['xml_parser'],
+                        workers=kwargs['workers'],
+                        chunk_size=kwargs['chunk_size'],
+                        zip_reader=kwargs['zip_reader'])
+    except ParserError as error:
+        raise ClickException(error)
+    if not rejected:
+        return
+    duplicates = rejected.pop('duplicate', 0)
+    if duplicates:
+        click.echo('Duplicate ids: {} (see duplicates.csv)'.format(
+            duplicates), err=True)
+    if kwargs['on_error'] != 'raise' and rejected:
+        click.echo('Rejected: {} (see rejects.csv)'.format(', '.join(
+            '{}={}'.format(kind, count)
+            for kind, count in sorted(rejected.items())
+        )), err=True)
+
+
+@main.command()
+@click.option('-o', '--output', default=os.getcwd(),
+              help='Папка с архивами (По умолчанию: текущая папка')
+@click.option('--window', type=click.IntRange(min=1), default=None,
+              help='Максимальное количество архивов в обработке '
+                   'одновременно (По умолчанию: удвоенное количество '
+                   'процессоров)')
+@click.option('--xml-parser', type=click.Choice(sorted(XML_PARSERS)),
+              default=DEFAULT_XML_PARSER,
+              help='Способ разбора xml документов (По умолчанию: {})'.format(
+                  DEFAULT_XML_PARSER))
+@click.option('--zip-reader', type=click.Choice(sorted(ZIP_READERS)),
+              default='zipfile',
+              help='Способ чтения архивов: zipfile или mmap - отображение '
+                   'архива в память (По умолчанию: zipfile)')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Количество процессов (По умолчанию: количество '
+                   'процессоров)')
+@click.option('--chunk-size', type=ByteSize(), default=DEFAULT_CHUNK_SIZE,
+              help='Размер части архива после распаковки, передаваемой '
+                   'процессу, например 512K или 4M (По умолчанию: 1M)')
+@click.option('--on-error', type=click.Choice(ON_ERROR), default='raise',
+              help='Действие при ошибке разбора: raise - прервать '
+                   'обработку, skip - пропустить документ или архив и '
+                   'записать его в rejects.csv, quarantine - также '
+                   'поместить его в папку карантина (По умолчанию: raise)')
+@click.option('--quarantine', default=None,
+              help='Папка карантина для --on-error quarantine (По '
+                   'умолчанию: папка quarantine внутри папки с архивами)')
+@click.option('--top', type=click.IntRange(min=0), default=DEFAULT_TOP,
+              help='Количество самых частых наименований объектов '
+                   '(По умолчанию: {})'.format(DEFAULT_TOP))
+@click.option('--names-capacity', type=click.IntRange(min=1),
+              default=DEFAULT_NAMES_CAPACITY,
+              help='Количество наименований объектов, подсчитываемых в '
+                   'каждом процессе (По умолчанию: {})'.format(
+                       DEFAULT_NAMES_CAPACITY))
+@click.option('--report', default=None,
+              help='Сохранить статистику в JSON файл')
+def stats(**kwargs):
+    '''Вывести статистику документов zip архивов без сохранения csv
+    файлов.'''
+    try:
+        result, rejected = collect_stats(
+            kwargs['output'], on_error=kwargs['on_error'],
+            quarantine=kwargs['quarantine'],
+            capacity=kwargs['names_capacity'], window=kwargs['window'],
+            xml_parser=kwargs['xml_parser'], workers=kwargs['workers'],
+            chunk_size=kwargs['chunk_size'], zip_reader=kwargs['zip_reader']
+        )
+        if kwargs['report'] is not None:
+            save_stats(kwargs['report'], result, kwargs['top'])
+    except ParserError as error:
+        raise ClickException(error)
+    click.echo(format_stats(result, kwargs['top']))
+    if rejected:
+        click.echo('Rejected: {} (see rejects.csv)'.format(', '.join(
+            '{}={}'.format(kind, count)
+            for kind, count in sorted(rejected.items())
+        )), err=True)
+
+
+def _parse_address(ctx, param, value):
+    try:
+        return parse_address(value)
+    except ClusterError as error:
+        raise click.BadParameter(str(error))
+
+
+@main.command()
+@click.option('-o', '--output', default=os.getcwd(),
+              help='Папка с архивами, доступная обработчикам по тому же '
+                   'пути (По умолчанию: текущая папка')
+@click.option('--bind', default='127.0.0.1:{}'.format(DEFAULT_PORT),
+              callback=_parse_address,
+              help='Адрес для подключения обработчиков в формате host:port '
+                   '(По умолчанию: 127.0.0.1:{})'.format(DEFAULT_PORT))
+@click.option('--tasks', type=click.IntRange(min=1), default=None,
+              help='Количество заданий (По умолчанию: по заданию на архив)')
+@click.option('--retries', type=click.IntRange(min=0),
+              default=DEFAULT_RETRIES,
+              help='Количество повторных выдач задания после ошибки '
+                   '(По умолчанию: {})'.format(DEFAULT_RETRIES))
+@click.option('--timeout', type=click.FloatRange(min=0.01), default=None,
+              help='Максимальное время ожидания сообщения от обработчика в '
+                   'секундах (По умолчанию: без ограничения)')
+def coordinator(**kwargs):
+    '''Сгенерировать csv файлы из zip архивов, распределяя архивы между
+    подключающимися обработчиками (см. команду worker).'''
+    try:
+        documents = do_task_two_cluster(
+            kwargs['output'], kwargs['bind'], tasks=kwargs['tasks'],
+            retries=kwargs['retries'], timeout=kwargs['timeout'],
+            log=partial(click.echo, err=True)
+        )
+    except ParserError as error:
+        raise ClickException(error)
+    click.echo('Processed {} documents'.format(documents), err=True)
+
+
+@main.command()
+@click.option('--connect', default='127.0.0.1:{}'.format(DEFAULT_PORT),
+              callback=_parse_address,
+              help='Адрес координатора в формате host:port '
+                   '(По умолчанию: 127.0.0.1:{})'.format(DEFAULT_PORT))
+@click.option('--name', default=None,
+              help='Имя обработчика в сообщениях координатора (По '
+                   'умолчанию: имя машины и номер процесса)')
+@click.option('--window', type=click.IntRange(min=1), default=None,
+              help='Максимальное количество архивов в обработке '
+                   'одновременно (По умолчанию: удвоенное количество '
+                   'процессоров)')
+@click.option('--xml-parser', type=click.Choice(sorted(XML_PARSERS)),
+              default=DEFAULT_XML_PARSER,
+              help='Способ разбора xml документов (По умолчанию: {})'.format(
+                  DEFAULT_XML_PARSER))
+@click.option('--zip-reader', type=click.Choice(sorted(ZIP_READERS)),
+              default='zipfile',
+              help='Способ чтения архивов: zipfile или mmap - отображение '
+                   'архива в память (По умолчанию: zipfile)')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Количество процессов (По умолчанию: количество '
+                   'процессоров)')
+@click.option('--chunk-size', type=ByteSize(), default=DEFAULT_CHUNK_SIZE,
+              help='Размер части архива после распаковки, передаваемой '
+                   'процессу, например 512K или 4M (По умолчанию: 1M)')
+def worker(**kwargs):
+    '''Выполнять задания координатора (см. команду coordinator).'''
+    try:
+        completed = run_worker(
+            kwargs['connect'], name=kwargs['name'], window=kwargs['window'],
+            xml_parser=kwargs['xml_parser'], workers=kwargs['workers'],
+            chunk_size=kwargs['chunk_size'], zip_reader=kwargs['zip_reader']
+        )
+    except ParserError as error:
+        raise ClickException(error)
+    click.echo('Completed {} tasks'.format(completed), err=True)
+
+
+@main.command(name='lookup')
+@click.option('-o', '--output', default=os.getcwd(),
+              help='Папка с результатами parse --sorted (По умолчанию: '
+                   'текущая папка')
+@click.argument('id')
+def lookup_id(**kwargs):
+    '''Вывести строки vars.csv и objects.csv документа с заданным ID.'''
+    try:
+        result = lookup(kwargs['output'], kwargs['id'])
     except ParserError as error:
         raise ClickException(error)
+    if not result['vars'] and not result['objects']:
+        raise ClickException('Id {} not found'.format(kwargs['id']))
+    click.echo(encode_csv(
+        [VARS_HEADER] + result['vars'] + [OBJECTS_HEADER] + result['objects']
+    ).decode('utf-8'), nl=False)
 
 
 @main.command()
@@ -50,3 +515,42 @@ def cycle(**kwargs):
         do_task_two(kwargs['output'])
     except (GeneratorError, ParserError) as error:
         raise ClickException(error)
+
+
+def _parse_sizes(ctx, param, value):
+    try:
+        return parse_sizes(value)
+    except BenchmarkError as error:
+        raise click.BadParameter(str(error))
+
+
+@main.command()
+@click.option('-o', '--output', default=os.getcwd(),
+              help='Папка для создания наборов архивов и отчета '
+                   '(По умолчанию: текущая папка')
+@click.option('--sizes', default='10x100,50x100,10x1000',
+              callback=_parse_sizes,
+              help='Размеры наборов архивов в формате '
+                   '<архивы>x<документы> через запятую (По умолчанию: '
+                   '10x100,50x100,10x1000)')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Количество процессов (По умолчанию: количество '
+                   'процессоров)')
+@click.option('--seed', type=int, default=0,
+              help='Начальное значение генератора случайных чисел '
+                   '(По умолчанию: 0)')
+@click.option('--report', default='bench.json',
+              help='Имя JSON файла с результатами в папке output '
+                   '(По умолчанию: bench.json)')
+@click.option('--keep', is_flag=True,
+              help='Не удалять наборы архивов после замеров')
+def bench(**kwargs):
+    '''Замерить производительность генерации и разбора архивов.'''
+    try:
+        report = run_benchmarks(kwargs['output'], kwargs['sizes'],
+                                workers=kwargs['workers'],
+                                seed=kwargs['seed'], keep=kwargs['keep'])
+        save_results(os.path.join(kwargs['output'], kwargs['report']), report)
+    except (BenchmarkError, GeneratorError, ParserError) as error:
+        raise ClickException(error)
+    click.echo(format_results(report))
@@ -0,0 +1,452 @@
+import json
+import multiprocessing as mp
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+from ngenix_demo_task.manifest import OUTPUTS
+from ngenix_demo_task.parser import (
+    ParserError, encode_csv, init_worker, list_archives, parse_archives)
+
+DEFAULT_PORT = 7733
+DEFAULT_RETRIES = 2
+
+# Сообщение: длина заголовка и длина данных (uint32 little-endian),
+# заголовок в JSON и данные.
+_FRAME = struct.Struct('<2L')
+
+
+class ClusterError(ParserError):
+    '''Ошибка обмена сообщениями между координатором и обработчиками.'''
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    '''Получить адрес из строки вида host:port или port.
+
+    :returns: tuple (host, port).
+    :raises: ClusterError.
+    '''
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ClusterError('{} is not a valid address'.format(address))
+    return host or default_host, port
+
+
+def send_message(sock, message, payload=b''):
+    '''Отправить сообщение.
+
+    :param socket.socket sock: соединение.
+    :param dict message: заголовок сообщения.
+    :param bytes payload: данные сообщения.
+    '''
+    header = json.dumps(message).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(header), len(payload)) + header)
+    if payload:
+        sock.sendall(payload)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ClusterError('Connection closed')
+    return data
+
+
+def receive_message(stream):
+    '''Получить сообщение.
+
+    :param stream: двоичный file-like объект соединения.
+
+    :returns: tuple (заголовок, данные).
+    :raises: ClusterError.
+    '''
+    header_size, payload_size = _FRAME.unpack(
+        _read_exactly(stream, _FRAME.size)
+    )
+    try:
+        message = json.loads(_read_exactly(stream, header_size).decode())
+    except ValueError:
+        raise ClusterError('Bad message header')
+    return message, _read_exactly(stream, payload_size)
+
+
+def split_archives(archive_paths, count=None):
+    '''Разделить архивы на задания для обработчиков.
+
+    Архивы распределяются по заданиям подряд, так чтобы суммарный размер
+    архивов заданий был примерно одинаковым; результаты заданий,
+    объединенные по порядку, следуют в порядке архивов.
+
+    :param list archive_paths: пути до zip архивов.
+    :param int count: количество заданий (По умолчанию: по заданию на
+                      архив).
+
+    :returns: list непустых list путей до архивов.
+    '''
+    if count is None or count >= len(archive_paths):
+        return [[x] for x in archive_paths]
+    sizes = [os.path.getsize(x) for x in archive_paths]
+    total = sum(sizes)
+    tasks = [[] for _ in range(count)]
+    done = 0
+    for path, size in zip(archive_paths, sizes):
+        # Архив попадает в задание, на которое приходится его середина.
+        middle = (2 * done + size) * count // (2 * total) if total else 0
+        index = min(middle, count - 1)
+        # Оставшимся заданиям должно хватить архивов.
+        left = len(archive_paths) - sum(map(len, tasks))
+        index = max(index, count - left)
+        tasks[index].append(path)
+        done += size
+    return [x for x in tasks if x]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    '''Обслуживание соединения одного обработчика.'''
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        stream = self.request.makefile('rb')
+        self.request.settimeout(coordinator.timeout)
+        try:
+            message, _ = receive_message(stream)
+        except (ClusterError, OSError):
+            return
+        if not isinstance(message, dict):
+            return
+        worker = message.get('worker', '{}:{}'.format(*self.client_address))
+        with coordinator.connection(self.request):
+            while True:
+                task = coordinator.take()
+                if task is None:
+                    self._send(message={'type': 'done'})
+                    return
+                try:
+                    self._run(coordinator, stream, task, worker)
+                except (ParserError, OSError) as error:
+                    coordinator.fail(task, worker, str(error))
+                    return
+                except Exception as error:
+                    # Некорректное сообщение обработчика не должно оставить
+                    # задание невыполненным: координатор ждал бы его вечно.
+                    coordinator.fail(task, worker, 'Bad message: {!r}'.format(
+                        error))
+                    return
+
+    def _send(self, **kwargs):
+        try:
+            send_message(self.request, **kwargs)
+        except OSError:
+            pass
+
+    def _run(self, coordinator, stream, task, worker):
+        send_message(self.request, {
+            'type': 'task', 'task': task,
+            'archives': coordinator.tasks[task],
+        })
+        with coordinator.open_parts(task) as parts:
+            while True:
+                message, payload = receive_message(stream)
+                if message.get('task') != task:
+                    raise ClusterError('Unexpected task {}'.format(
+                        message.get('task')))
+                if message['type'] == 'data':
+                    parts[message['table']].write(payload)
+                elif message['type'] == 'result':
+                    documents = message['documents']
+                    if type(documents) is not int:
+                        raise ClusterError('Bad documents count {!r}'.format(
+                            documents))
+                    coordinator.complete(task, worker, documents)
+                    return
+                elif message['type'] == 'error':
+                    coordinator.fail(task, worker, message['message'])
+                    return
+                else:
+                    raise ClusterError('Unexpected message {}'.format(
+                        message['type']))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Parts:
+    '''Файлы строк таблиц, полученных от обработчика для задания.'''
+
+    def __init__(self, folder, task):
+        self.files = {}
+        try:
+            for filename, header, table in OUTPUTS:
+                self.files[table] = open(
+                    os.path.join(folder, '{:05d}.{}'.format(task, filename)),
+                    'wb'
+                )
+        except IOError as error:
+            self.close()
+            raise ParserError(str(error))
+
+    def __enter__(self):
+        return self.files
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for part in self.files.values():
+            part.close()
+
+
+class Coordinator:
+    '''Координатор обработки архивов несколькими обработчиками (см.
+    run_worker), в том числе на разных машинах с общей папкой архивов.
+
+    Архивы делятся на задания (см. split_archives), которые выдаются
+    подключившимся обработчикам по одному. Обработчик разбирает архивы
+    задания в своем пуле процессов и передает строки таблиц координатору,
+    который сохраняет их во временные файлы задания. Задание, которое
+    обработчик не смог выполнить или не завершил из-за разрыва соединения
+    или истечения timeout, выдается повторно, не более retries раз. Когда
+    все задания выполнены, файлы заданий объединяются по порядку в
+    vars.csv и objects.csv, поэтому результаты совпадают с do_task_two.
+
+    :param str path: путь до папки с архивами.
+    :param tuple address: адрес (host, port) для подключения обработчиков;
+                          с портом 0 порт выбирается системой.
+    :param int tasks: количество заданий (см. split_archives).
+    :param int retries: количество повторных выдач задания.
+    :param float timeout: максимальное время ожидания сообщения от
+                          обработчика в секундах (По умолчанию: без
+                          ограничения).
+    :param log: функция для вывода сообщений.
+    '''
+
+    def __init__(self, path, address=('127.0.0.1', DEFAULT_PORT), tasks=None,
+                 retries=DEFAULT_RETRIES, timeout=None, log=None):
+        self.path = path
+        archive_paths = [os.path.abspath(x) for x in list_archives(path)]
+        self.tasks = split_archives(archive_paths, tasks)
+        self.retries = retries
+        self.timeout = timeout
+        self.log = log or (lambda message: None)
+        self.condition = threading.Condition()
+        self.pending = deque(range(len(self.tasks)))
+        self.attempts = [0] * len(self.tasks)
+        self.done = set()
+        self.documents = 0
+        self.error = None
+        self.connections = set()
+        self.folder = None
+        self.server = _Server(address, _Handler, bind_and_activate=False)
+        self.server.coordinator = self
+
+    @property
+    def address(self):
+        '''Адрес, на котором координатор ожидает обработчиков.'''
+        return self.server.server_address[:2]
+
+    def __enter__(self):
+        try:
+            self.folder = tempfile.mkdtemp(prefix='.cluster-', dir=self.path)
+            self.server.server_bind()
+            self.server.server_activate()
+        except OSError as error:
+            self.close()
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Закрыть соединения и удалить временные файлы.'''
+        self.server.server_close()
+        with self.condition:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+    @contextmanager
+    def connection(self, sock):
+        '''Учитывать соединение обработчика на время его обслуживания, чтобы
+        закрыть его при завершении работы.'''
+        with self.condition:
+            self.connections.add(sock)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.connections.discard(sock)
+
+    def open_parts(self, task):
+        '''Открыть на запись временные файлы задания.'''
+        return _Parts(self.folder, task)
+
+    def take(self):
+        '''Получить номер следующего задания, ожидая, пока выполняемые
+        задания завершатся или будут возвращены.
+
+        :returns: int или None, если заданий больше нет.
+        '''
+        with self.condition:
+            while True:
+                if self.error or len(self.done) == len(self.tasks):
+                    return None
+                if self.pending:
+                    return self.pending.popleft()
+                self.condition.wait()
+
+    def complete(self, task, worker, documents):
+        '''Отметить задание выполненным.'''
+        with self.condition:
+            self.done.add(task)
+            self.documents += documents
+            self.log('Task {} done by {}: {} documents ({}/{})'.format(
+                task, worker, documents, len(self.done), len(self.tasks)))
+            self.condition.notify_all()
+
+    def fail(self, task, worker, message):
+        '''Вернуть задание для повторной выдачи или прервать обработку,
+        если попытки исчерпаны.'''
+        with self.condition:
+            self.attempts[task] += 1
+            if self.attempts[task] > self.retries:
+                self.error = ParserError(
+                    'Task {} failed after {} attempts: {}'.format(
+                        task, self.attempts[task], message)
+                )
+            else:
+                self.log('Task {} failed on {}, retrying: {}'.format(
+                    task, worker, message))
+                self.pending.append(task)
+            self.condition.notify_all()
+
+    def run(self):
+        '''Выдавать задания обработчикам до выполнения всех заданий и
+        записать результаты.
+
+        :returns: количество документов.
+        :raises: ParserError.
+        '''
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        try:
+            with self.condition:
+                while not self.error and len(self.done) < len(self.tasks):
+                    self.condition.wait()
+        finally:
+            self.server.shutdown()
+            thread.join()
+        if self.error:
+            raise self.error
+        self.merge()
+        return self.documents
+
+    def merge(self):
+        '''Объединить файлы заданий в vars.csv и objects.csv.
+
+        :raises: ParserError.
+        '''
+        try:
+            for filename, header, table in OUTPUTS:
+                with open(os.path.join(self.path, filename), 'wb') as output:
+                    output.write(encode_csv([header]))
+                    for task in range(len(self.tasks)):
+                        part_path = os.path.join(
+                            self.folder, '{:05d}.{}'.format(task, filename)
+                        )
+                        with open(part_path, 'rb') as part:
+                            shutil.copyfileobj(part, output)
+        except IOError as error:
+            raise ParserError(str(error))
+
+
+def do_task_two_cluster(path, address=('127.0.0.1', DEFAULT_PORT),
+                        tasks=None, retries=DEFAULT_RETRIES, timeout=None,
+                        log=None):
+    '''Обработать содержимое папки с zip архивами согласно заданию №2
+    обработчиками, подключающимися к координатору (см. Coordinator).
+
+    :returns: количество документов.
+    :raises: ParserError.
+    '''
+    with Coordinator(path, address, tasks, retries, timeout, log) as cluster:
+        if log is not None:
+            log('Waiting for workers on {}:{} ({} tasks)'.format(
+                *cluster.address, len(cluster.tasks)))
+        return cluster.run()
+
+
+def run_worker(address, name=None, **options):
+    '''Выполнять задания координатора, пока они не закончатся.
+
+    Архивы заданий разбираются в пуле процессов (см. parse_archives),
+    который создается один раз на время соединения, а строки таблиц
+    передаются координатору по мере разбора частей архивов.
+    Ошибки разбора передаются координатору, который решает, выдать ли
+    задание повторно.
+
+    :param tuple address: адрес (host, port) координатора.
+    :param str name: имя обработчика в сообщениях координатора (По
+                     умолчанию: имя машины и pid процесса).
+    :param options: параметры обработки архивов (см. parse_archives).
+
+    :returns: количество выполненных заданий.
+    :raises: ParserError.
+    '''
+    if name is None:
+        name = '{}:{}'.format(socket.gethostname(), os.getpid())
+    workers = options.get('workers') or os.cpu_count() or 1
+    completed = 0
+    try:
+        with ExitStack() as stack:
+            sock = stack.enter_context(socket.create_connection(address))
+            pool = stack.enter_context(
+                mp.Pool(workers, initializer=init_worker)
+            )
+            stream = sock.makefile('rb')
+            send_message(sock, {'type': 'ready', 'worker': name})
+            while True:
+                message, _ = receive_message(stream)
+                if message['type'] == 'done':
+                    return completed
+                task = message['task']
+                try:
+                    documents = 0
+                    results = parse_archives(message['archives'],
+                                             encode=True, pool=pool,
+                                             **options)
+                    for chunk, result in results:
+                        for filename, header, table in OUTPUTS:
+                            send_message(sock, {
+                                'type': 'data', 'task': task, 'table': table,
+                            }, result[table].data)
+                        documents += result['vars'].rows
+                except ParserError as error:
+                    send_message(sock, {
+                        'type': 'error', 'task': task, 'message': str(error),
+                    })
+                    continue
+                send_message(sock, {
+                    'type': 'result', 'task': task, 'documents': documents,
+                })
+                completed += 1
+    except OSError as error:
+        raise ClusterError('Coordinator {}:{} is unavailable: {}'.format(
+            address[0], address[1], error))
@@ -1,11 +1,21 @@
+import lzma
+import multiprocessing as mp
 import os.path
-from datetime import datetime
-from random import randint
+import random
+import re
+import time
+import zlib
+from contextlib import ExitStack
+from functools import partial
+from random import Random, randint
 from uuid import uuid4
-from zipfile import ZipFile
+from zipfile import (
+    ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile, ZipInfo)
 
 from lxml import etree
 
+from ngenix_demo_task import metrics
+
 
 class GeneratorError(Exception):
     '''Ошибка работы генератора.'''
@@ -17,15 +27,66 @@ class XMLGeneratorError(GeneratorError):
     pass
 
 
-def generate_data():
+# Разбор отклоняет документы с большим количеством объектов (см.
+# parser._build_result).
+MAX_OBJECTS = 10
+
+
+def _uniform_count(low, high, rng):
+    '''Случайное количество из отрезка [low, high] с равномерным
+    распределением.'''
+    return rng.randint(low, high)
+
+
+def _triangular_count(low, high, rng):
+    '''Случайное количество из отрезка [low, high] с треугольным
+    распределением и модой в high: чем больше количество объектов, тем чаще
+    оно встречается, поэтому в среднем объектов в документе больше, чем при
+    равномерном распределении.
+    '''
+    return int(rng.triangular(low, high + 1, high + 1))
+
+
+OBJECTS_DISTRIBUTIONS = {
+    'uniform': _uniform_count,
+    'triangular': _triangular_count,
+}
+
+
+def generate_data(min_objects=1, max_objects=10, min_level=1, max_level=100,
+                  distribution='uniform', rng=None):
     '''Сгенерировать набор данных для заполения xml документа.
 
+    Без генератора случайных чисел id и наименования объектов получаются из
+    uuid4. С генератором random.Random все значения документа вычисляются
+    по одному вызову getrandbits, поэтому генерация воспроизводима и не
+    требует обращения к системному источнику энтропии за каждым значением.
+
+    :param int min_objects: минимальное количество объектов в документе.
+    :param int max_objects: максимальное количество объектов в документе.
+    :param int min_level: минимальное значение level.
+    :param int max_level: максимальное значение level.
+    :param str distribution: распределение количества объектов в документе
+                             (см. OBJECTS_DISTRIBUTIONS).
+    :param random.Random rng: генератор случайных чисел.
+
     :returns: tuple с набором данных.
 
     '''
-    id = uuid4().hex
-    level = randint(1, 100)
-    objects = tuple(uuid4().hex for _ in range(randint(1, 10)))
+    if rng is None:
+        level = randint(min_level, max_level)
+        count = OBJECTS_DISTRIBUTIONS[distribution](
+            min_objects, max_objects, random
+        )
+        id = uuid4().hex
+        objects = tuple(uuid4().hex for _ in range(count))
+        return id, level, objects
+    level = rng.randint(min_level, max_level)
+    count = OBJECTS_DISTRIBUTIONS[distribution](min_objects, max_objects, rng)
+    width = 32 * (count + 1)
+    digits = '{:0{}x}'.format(rng.getrandbits(4 * width), width)
+    id = digits[:32]
+    objects = tuple(digits[x:x + 32] for x in range(32, width, 32))
     return id, level, objects
 
 
@@ -67,31 +128,348 @@ def render_xml(id, level, objects):
     return etree.tostring(xroot, encoding='unicode')
 
 
-def generate_zip(path, xml_documents_quantity=100):
+_ATTRIBUTE_ESCAPES = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    '\t': '&#9;',
+    '\n': '&#10;',
+    '\r': '&#13;',
+})
+
+_INVALID_XML_CHARS = re.compile(
+    '[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]'
+)
+
+_DOCUMENT_TEMPLATE = (
+    '<root><var name="id" value="{}"/><var name="level" value="{}"/>'
+    '<objects><object name="{}"/></objects></root>'
+)
+
+_OBJECTS_SEPARATOR = '"/><object name="'
+
+
+def _escape_attribute(value):
+    '''Экранировать значение атрибута так же, как это делает lxml.
+
+    :param value: значение атрибута.
+
+    :returns: str с экранированным значением.
+    :raises: ValueError, если значение недопустимо в xml документе.
+    '''
+    value = str(value)
+    if value.isalnum():
+        return value
+    if _INVALID_XML_CHARS.search(value):
+        raise ValueError('All strings must be XML compatible: Unicode or '
+                         'ASCII, no NULL bytes or control characters')
+    return value.translate(_ATTRIBUTE_ESCAPES)
+
+
+def render_xml_template(id, level, objects):
+    '''Сгенерировать содержимое xml документа по набору данных подстановкой в
+    шаблон.
+
+    Результат совпадает с результатом render_xml побайтно, но документ
+    формируется без построения дерева элементов.
+
+    :param id: значение параметра id подставляемого в документ.
+    :param level: значение параметра level подставляемого в документ.
+    :param objects: iterable наименований объектов подставляемых в документ.
+
+    '''
+    if not objects:
+        raise XMLGeneratorError('Document must have at least one object')
+    names = _OBJECTS_SEPARATOR.join(_escape_attribute(x) for x in objects)
+    return _DOCUMENT_TEMPLATE.format(
+        _escape_attribute(id), _escape_attribute(level), names
+    )
+
+
+RENDERERS = {
+    'lxml': render_xml,
+    'template': render_xml_template,
+}
+
+
+COMPRESSIONS = {
+    'stored': ZIP_STORED,
+    'deflated': ZIP_DEFLATED,
+    'bzip2': ZIP_BZIP2,
+    'lzma': ZIP_LZMA,
+}
+
+# Допустимые уровни сжатия методов. Для stored и lzma zipfile уровень
+# сжатия не поддерживает.
+COMPRESSLEVELS = {
+    'deflated': range(0, 10),
+    'bzip2': range(1, 10),
+}
+
+
+SEEDED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+class StreamWriter:
+    '''Последовательная запись в файл или канал через буфер.
+
+    Объект не поддерживает seek, поэтому zipfile записывает архив в
+    потоковом режиме: crc и размеры каждого файла записываются после его
+    данных, и возвращаться к уже записанному заголовку не нужно. Благодаря
+    этому архив можно записывать в канал, а данные передаются в файл
+    крупными блоками по buffer_size байт.
+
+    :param stream: двоичный file-like объект для записи.
+    :param int buffer_size: размер буфера в байтах.
+    '''
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.written = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.written += len(data)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def tell(self):
+        return self.written
+
+    def flush(self):
+        buffer, self.buffer = self.buffer, bytearray()
+        view = memoryview(buffer)
+        while view:
+            view = view[self.stream.write(view):]
+        self.stream.flush()
+
+
+def generate_zip(path, xml_documents_quantity=100, renderer='template',
+                 compression='stored', compresslevel=None, data_options=None,
+                 seed=None, buffer_size=DEFAULT_BUFFER_SIZE, overwrite=True):
     '''Сгенерировать zip архив с xml документами.
 
-    :param str path: путь до генерируемого архива.
+    Архив записывается последовательно через буфер (см. StreamWriter),
+    поэтому path может быть именованным каналом, а вместо пути можно
+    передать двоичный поток, например стандартный вывод.
+
+    :param path: путь до генерируемого архива или двоичный file-like объект.
     :param int xml_documents_quantity: количество xml документов в генерируемом
                                        архиве.
+    :param str renderer: способ формирования xml документов: lxml - через
+                         дерево элементов, template - подстановкой в шаблон.
+    :param str compression: метод сжатия (см. COMPRESSIONS).
+    :param int compresslevel: уровень сжатия (По умолчанию: уровень метода
+                              сжатия по умолчанию).
+    :param dict data_options: параметры generate_data.
+    :param seed: начальное значение генератора случайных чисел. Архивы,
+                 сгенерированные с одинаковым seed и параметрами, совпадают
+                 побайтно.
+    :param int buffer_size: размер буфера записи в байтах.
+    :param bool overwrite: перезаписать существующий архив по пути path.
+
+    :raises: GeneratorError.
     '''
+    check_compression(compression, compresslevel)
+    render = RENDERERS[renderer]
+    data_options = dict(data_options or {})
+    if seed is None:
+        date_time = time.localtime()[:6]
+    else:
+        data_options['rng'] = Random(seed)
+        date_time = SEEDED_DATE_TIME
     try:
-        with ZipFile(path, 'w') as archive:
-            for xml_number in range(xml_documents_quantity):
-                xml_filename = '{}.xml'.format(xml_number)
-                content = render_xml(*generate_data())
-                archive.writestr(xml_filename, content)
-    except IOError as error:
+        with ExitStack() as stack:
+            stream = path
+            if isinstance(path, str):
+                mode = 'wb' if overwrite else 'xb'
+                stream = stack.enter_context(open(path, mode, buffering=0))
+            output = StreamWriter(stream, buffer_size)
+            with ZipFile(output, 'w', COMPRESSIONS[compression],
+                         compresslevel=compresslevel) as archive:
+                for xml_number in range(xml_documents_quantity):
+                    xml_info = ZipInfo('{}.xml'.format(xml_number), date_time)
+                    xml_info.compress_type = archive.compression
+                    xml_info.external_attr = 0o600 << 16
+                    started = metrics.start()
+                    data = generate_data(**data_options)
+                    metrics.stop('generate_data', started)
+                    started = metrics.start()
+                    content = render(*data).encode('utf-8')
+                    metrics.stop('render', started)
+                    started = metrics.start()
+                    archive.writestr(xml_info, content,
+                                     compresslevel=compresslevel)
+                    metrics.stop('zip_write', started)
+                    metrics.count('documents')
+            output.flush()
+        metrics.count('archives')
+        metrics.count('bytes', output.written)
+    except FileExistsError:
+        raise GeneratorError('Archive {} already exists'.format(path))
+    except (IOError, ValueError, zlib.error, lzma.LZMAError) as error:
         raise GeneratorError(str(error))
 
 
-def do_task_one(path, quantity=50):
+def check_compression(compression, compresslevel=None):
+    '''Проверить метод и уровень сжатия.
+
+    :param str compression: метод сжатия (см. COMPRESSIONS).
+    :param int compresslevel: уровень сжатия (см. COMPRESSLEVELS).
+
+    :raises: GeneratorError.
+    '''
+    if compression not in COMPRESSIONS:
+        message = 'Unknown compression method {}'.format(compression)
+        raise GeneratorError(message)
+    if compresslevel is None:
+        return
+    levels = COMPRESSLEVELS.get(compression)
+    if levels is None:
+        message = 'Compression method {} does not support compresslevel'
+        raise GeneratorError(message.format(compression))
+    if compresslevel not in levels:
+        message = 'Compression level of {} must be from {} to {}'.format(
+            compression, levels[0], levels[-1])
+        raise GeneratorError(message)
+
+
+def check_data_options(min_objects=1, max_objects=10, min_level=1,
+                       max_level=100, distribution='uniform'):
+    '''Проверить параметры generate_data.
+
+    Количество объектов ограничено MAX_OBJECTS, чтобы сгенерированные
+    документы проходили проверки разбора.
+
+    :raises: GeneratorError.
+    '''
+    if min_objects < 1:
+        raise GeneratorError('Document must have at least one object')
+    if max_objects > MAX_OBJECTS:
+        message = 'Document must have at most {} objects'.format(MAX_OBJECTS)
+        raise GeneratorError(message)
+    if min_objects > max_objects:
+        raise GeneratorError('min_objects must not exceed max_objects')
+    if min_level > max_level:
+        raise GeneratorError('min_level must not exceed max_level')
+    if distribution not in OBJECTS_DISTRIBUTIONS:
+        message = 'Unknown objects distribution {}'.format(distribution)
+        raise GeneratorError(message)
+
+
+def archive_name(archive_number, quantity):
+    '''Сформировать имя zip архива по его номеру.
+
+    Номер дополняется нулями до ширины наибольшего номера, поэтому имена
+    предсказуемы, не пересекаются между архивами одного набора и
+    сортируются в порядке генерации. Наборы, сгенерированные в одну папку,
+    имеют одинаковые имена, поэтому do_task_one не перезаписывает
+    существующие архивы.
+
+    :param int archive_number: номер архива.
+    :param int quantity: количество архивов в наборе.
+
+    :returns: имя архива.
+    '''
+    width = len(str(max(quantity - 1, 0)))
+    return '{:0{}d}.zip'.format(archive_number, width)
+
+
+def _generate_archive(job, **options):
+    '''Сгенерировать zip архив по паре (путь, seed) в процессе пула.'''
+    path, seed = job
+    generate_zip(path, seed=seed, **options)
+
+
+def _archive_seed(seed, archive_number):
+    if seed is None:
+        return None
+    return '{}:{}'.format(seed, archive_number)
+
+
+def _check_options(compression, compresslevel, data_options):
+    check_data_options(**(data_options or {}))
+    check_compression(compression, compresslevel)
+
+
+def do_task_one(path, quantity=50, workers=None, renderer='template',
+                documents=100, compression='stored', compresslevel=None,
+                data_options=None, seed=None,
+                buffer_size=DEFAULT_BUFFER_SIZE):
     '''Сгенерировать набор zip архивов согласно задания №1.
 
     :param str path: путь до папки в которой нужно сохранить архивы.
     :param int quantity: количество генерируемых архивов.
+    :param int workers: количество процессов (По умолчанию: количество
+                        процессоров).
+    :param str renderer: способ формирования xml документов (см.
+                         generate_zip).
+    :param int documents: количество xml документов в архиве.
+    :param str compression: метод сжатия (см. COMPRESSIONS).
+    :param int compresslevel: уровень сжатия.
+    :param dict data_options: параметры generate_data.
+    :param int seed: начальное значение генератора случайных чисел. Набор
+                     архивов, сгенерированный с одинаковым seed и
+                     параметрами, воспроизводится побайтно независимо от
+                     количества процессов.
+    :param int buffer_size: размер буфера записи архива в байтах.
+
+    :raises: GeneratorError, в том числе если архив с именем из набора уже
+             существует в папке.
     '''
+    _check_options(compression, compresslevel, data_options)
+    task = partial(
+        _generate_archive, xml_documents_quantity=documents,
+        renderer=renderer, compression=compression,
+        compresslevel=compresslevel, data_options=data_options,
+        buffer_size=buffer_size, overwrite=False
+    )
+    jobs = []
     for archive_number in range(quantity):
-        timestamp = datetime.utcnow().isoformat()
-        archive_name = '{}_{}.zip'.format(archive_number, timestamp)
-        zip_path = os.path.join(path, archive_name)
-        generate_zip(zip_path)
+        zip_path = os.path.join(path, archive_name(archive_number, quantity))
+        if os.path.exists(zip_path):
+            raise GeneratorError('Archive {} already exists'.format(zip_path))
+        jobs.append((zip_path, _archive_seed(seed, archive_number)))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, quantity)
+    if workers <= 1:
+        for job in jobs:
+            task(job)
+        return
+    if metrics.enabled():
+        task = partial(metrics.profiled, task)
+    with mp.Pool(workers) as pool:
+        results = pool.imap_unordered(task, jobs)
+        if metrics.enabled():
+            results = metrics.collect(results)
+        for _ in results:
+            pass
+
+
+def do_task_one_stream(stream, renderer='template', documents=100,
+                       compression='stored', compresslevel=None,
+                       data_options=None, seed=None,
+                       buffer_size=DEFAULT_BUFFER_SIZE):
+    '''Сгенерировать zip архив согласно задания №1 и записать его в поток,
+    например в стандартный вывод для передачи другой программе.
+
+    Архив совпадает побайтно с первым архивом набора, сгенерированного
+    do_task_one с теми же seed и параметрами.
+
+    :param stream: двоичный file-like объект для записи архива.
+    :param options: см. do_task_one.
+
+    :raises: GeneratorError.
+    '''
+    _check_options(compression, compresslevel, data_options)
+    generate_zip(stream, xml_documents_quantity=documents, renderer=renderer,
+                 compression=compression, compresslevel=compresslevel,
+                 data_options=data_options, seed=_archive_seed(seed, 0),
+                 buffer_size=buffer_size)
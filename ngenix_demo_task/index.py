@@ -0,0 +1,89 @@
+from array import array
+from hashlib import blake2b
+
+DIGEST_SIZE = 16
+
+
+def id_digests(ids):
+    '''Вычислить 128-битные хеши id.
+
+    :param ids: iterable значений var типа id.
+
+    :returns: bytes, по DIGEST_SIZE байт на id.
+    '''
+    return b''.join(
+        blake2b(x.encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+        for x in ids
+    )
+
+
+def iter_digests(data):
+    '''Получить хеши, вычисленные id_digests, в виде пар 64-битных чисел.
+
+    :param bytes data: результат id_digests.
+
+    :returns: итератор пар (старшее слово, младшее слово).
+    '''
+    words = array('Q')
+    words.frombytes(data)
+    return zip(words[::2], words[1::2])
+
+
+class IdIndex:
+    '''Множество 128-битных хешей id.
+
+    Хеши хранятся в хеш-таблице с открытой адресацией и линейным
+    пробированием, упакованной в array: каждая ячейка занимает 16 байт, а
+    заполненность таблицы поддерживается не выше 3/4, поэтому на один id
+    приходится от 21 до 43 байт вместо сотни с лишним байт для строки в
+    set. Вероятность совпадения хешей разных id среди миллиарда id
+    порядка 10 ** -21, поэтому совпадение хешей считается совпадением id.
+
+    :param int capacity: начальное количество ячеек (степень двойки).
+    '''
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.mask = capacity - 1
+        self.slots = array('Q', bytes(2 * 8 * capacity))
+
+    def __len__(self):
+        return self.size
+
+    def add(self, high, low):
+        '''Добавить хеш id в множество.
+
+        :param int high: старшее слово хеша.
+        :param int low: младшее слово хеша.
+
+        :returns: False, если хеш уже был в множестве, иначе True.
+        '''
+        if not high and not low:
+            # Нулевой хеш обозначает пустую ячейку.
+            low = 1
+        if 4 * (self.size + 1) > 3 * (self.mask + 1):
+            self._grow()
+        slots = self.slots
+        mask = self.mask
+        slot = low & mask
+        while True:
+            index = 2 * slot
+            slot_high = slots[index]
+            slot_low = slots[index + 1]
+            if slot_high == high and slot_low == low:
+                return False
+            if not slot_high and not slot_low:
+                slots[index] = high
+                slots[index + 1] = low
+                self.size += 1
+                return True
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        slots = self.slots
+        self.size = 0
+        self.mask = 2 * self.mask + 1
+        self.slots = array('Q', bytes(len(slots) * 2 * 8))
+        for high, low in zip(slots[::2], slots[1::2]):
+            if high or low:
+                self.add(high, low)
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import shutil
+
+from ngenix_demo_task.parser import (
+    OBJECTS_HEADER, VARS_HEADER, ParserError, encode_csv, list_archives,
+    parse_archives)
+
+STATE_DIR = '.ndt'
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 2
+OUTPUTS = (
+    ('vars.csv', VARS_HEADER, 'vars'),
+    ('objects.csv', OBJECTS_HEADER, 'objects'),
+)
+
+
+def file_digest(path):
+    '''Вычислить sha1 содержимого файла.
+
+    :param str path: путь до файла.
+
+    :returns: str с шестнадцатеричным представлением хэша.
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    '''Прочитать манифест целиком.
+
+    :param str path: путь до папки с архивами.
+
+    :returns: dict с ключами archives ({имя архива: запись манифеста}) и
+              outputs ({имя csv файла: размер}). Если манифеста нет или он
+              создан другой версией, возвращается пустой dict.
+    :raises: ParserError.
+    '''
+    manifest_path = os.path.join(path, STATE_DIR, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except (IOError, ValueError) as error:
+        raise ParserError('Manifest {} is corrupted: {}'.format(
+            manifest_path, error))
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def load_manifest(path):
+    '''Загрузить манифест обработанных архивов.
+
+    :param str path: путь до папки с архивами.
+
+    :returns: dict {имя архива: запись манифеста}. Если манифеста нет или
+              он создан другой версией, возвращается пустой dict.
+    :raises: ParserError.
+    '''
+    return read_manifest(path).get('archives', {})
+
+
+def save_manifest(path, archives, outputs=None):
+    '''Атомарно сохранить манифест обработанных архивов.
+
+    :param str path: путь до папки с архивами.
+    :param dict archives: {имя архива: запись манифеста}.
+    :param dict outputs: {имя csv файла: размер} после записи строк
+                         archives. Если не задан, при следующем запуске csv
+                         файлы будут пересобраны.
+
+    :raises: ParserError.
+    '''
+    manifest_path = os.path.join(path, STATE_DIR, MANIFEST_FILENAME)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'archives': archives,
+        'outputs': outputs or {},
+    }
+    try:
+        with open(manifest_path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except IOError as error:
+        raise ParserError(str(error))
+
+
+def part_path(path, digest, table):
+    '''Путь до файла со строками таблицы, полученными из одного архива.
+
+    :param str path: путь до папки с архивами.
+    :param str digest: sha1 содержимого архива.
+    :param str table: vars или objects.
+    '''
+    return os.path.join(path, STATE_DIR, 'parts', '{}.{}.csv'.format(
+        digest, table))
+
+
+def plan_update(archive_paths, archives):
+    '''Сравнить архивы в папке с манифестом.
+
+    Архив считается неизменным, если совпадают его размер и время
+    изменения. Иначе вычисляется хэш содержимого: если он совпадает с
+    записанным, обновляется только время изменения. Новый архив с
+    содержимым, уже разобранным ранее (например, переименованный), повторно
+    не разбирается. Архив, удаленный или переименованный во время
+    сравнения, считается удаленным.
+
+    :param list archive_paths: пути до zip архивов.
+    :param dict archives: записи манифеста.
+
+    :returns: tuple (новые записи манифеста, имена новых и измененных
+              архивов, пути до архивов, которые нужно разобрать, признак
+              изменения или удаления ранее разобранных архивов).
+    '''
+    known = set(x['sha1'] for x in archives.values())
+    current, added, pending, modified = {}, [], [], False
+    for archive_path in archive_paths:
+        filename = os.path.basename(archive_path)
+        try:
+            stat = os.stat(archive_path)
+            entry = archives.get(filename)
+            if (entry is not None and entry['size'] == stat.st_size and
+                    entry['mtime'] == stat.st_mtime):
+                current[filename] = entry
+                continue
+            digest = file_digest(archive_path)
+        except FileNotFoundError:
+            continue
+        if entry is not None and entry['sha1'] == digest:
+            current[filename] = dict(entry, mtime=stat.st_mtime)
+            continue
+        modified = modified or entry is not None
+        current[filename] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest,
+        }
+        added.append(filename)
+        if digest not in known:
+            known.add(digest)
+            pending.append(archive_path)
+    modified = modified or bool(set(archives) - set(current))
+    return current, added, pending, modified
+
+
+def _update_parts(path, pending, current, archives, options):
+    '''Разобрать новые архивы, сохранив полученные строки в папке
+    состояния, и записать количество строк в записи манифеста.'''
+    counts = {
+        x['sha1']: {'vars': x['vars'], 'objects': x['objects']}
+        for x in archives.values()
+    }
+    for archive_path in pending:
+        digest = current[os.path.basename(archive_path)]['sha1']
+        counts[digest] = dict.fromkeys(('vars', 'objects'), 0)
+        for filename, header, table in OUTPUTS:
+            open(part_path(path, digest, table), 'wb').close()
+    archive_path, files = None, []
+    results = ()
+    if pending:
+        results = parse_archives(pending, encode=True, **options)
+    try:
+        for chunk, result in results:
+            if chunk.path != archive_path:
+                for part in files:
+                    part.close()
+                archive_path = chunk.path
+                digest = current[os.path.basename(archive_path)]['sha1']
+                files = [
+                    open(part_path(path, digest, table), 'ab')
+                    for filename, header, table in OUTPUTS
+                ]
+            for part, (filename, header, table) in zip(files, OUTPUTS):
+                part.write(result[table].data)
+                counts[digest][table] += result[table].rows
+    finally:
+        for part in files:
+            part.close()
+    for entry in current.values():
+        if 'vars' not in entry:
+            entry.update(counts[entry['sha1']])
+
+
+def _output_sizes(path, outputs):
+    '''Проверить, что csv файлы не короче размеров, записанных в
+    манифесте при прошлом запуске.'''
+    for filename, header, table in OUTPUTS:
+        size = outputs.get(filename)
+        output_path = os.path.join(path, filename)
+        if size is None or not os.path.exists(output_path):
+            return False
+        if os.path.getsize(output_path) < size:
+            return False
+    return True
+
+
+def _write_outputs(path, digests, sizes):
+    '''Записать в csv файлы строки, сохраненные для архивов с хэшами
+    digests: пересобрать файлы целиком или дописать строки в конец.
+
+    Перед дописыванием файлы обрезаются до размеров sizes из манифеста,
+    поэтому строки, дописанные прерванным запуском, не дублируются.
+
+    :returns: dict {имя csv файла: размер}.
+    '''
+    result = {}
+    for filename, header, table in OUTPUTS:
+        mode = 'wb' if sizes is None else 'r+b'
+        with open(os.path.join(path, filename), mode) as output:
+            if sizes is None:
+                output.write(encode_csv([header]))
+            else:
+                output.truncate(sizes[filename])
+                output.seek(sizes[filename])
+            for digest in digests:
+                with open(part_path(path, digest, table), 'rb') as part:
+                    shutil.copyfileobj(part, output)
+            result[filename] = output.tell()
+    return result
+
+
+def _remove_unused_parts(path, current):
+    '''Удалить сохраненные строки архивов, которых больше нет в папке.'''
+    used = set(x['sha1'] for x in current.values())
+    parts_dir = os.path.join(path, STATE_DIR, 'parts')
+    for filename in os.listdir(parts_dir):
+        if filename.split('.', 1)[0] not in used:
+            os.remove(os.path.join(parts_dir, filename))
+
+
+def do_task_two_incremental(path, archive_paths=None, **options):
+    '''Обработать содержимое папки с zip архивами согласно заданию №2,
+    разбирая только новые и измененные с прошлого запуска архивы.
+
+    Состояние хранится в папке .ndt: манифест с размером, временем
+    изменения, sha1 и количеством строк каждого архива, а также строки
+    таблиц, полученные из каждого архива. Если с прошлого запуска только
+    добавились новые архивы, их строки дописываются в конец csv файлов. Если
+    архивы были изменены или удалены, csv файлы пересобираются из
+    сохраненных строк без повторного разбора неизменных архивов.
+
+    В манифесте хранятся и размеры csv файлов, поэтому запуск, прерванный
+    до сохранения манифеста, можно безопасно повторить: лишние строки
+    отбрасываются, а прерванная пересборка выполняется заново.
+
+    :param str path: путь до папки с архивами.
+    :param list archive_paths: пути до архивов папки, которые нужно учесть
+                               (По умолчанию: все zip архивы папки).
+                               Архивы, отсутствующие в списке, считаются
+                               удаленными.
+    :param options: параметры обработки архивов (см. parse_archives).
+
+    :raises: ParserError.
+    '''
+    if archive_paths is None:
+        archive_paths = list_archives(path)
+    manifest = read_manifest(path)
+    archives = manifest.get('archives', {})
+    outputs = manifest.get('outputs', {})
+    current, added, pending, modified = plan_update(archive_paths, archives)
+    rebuild = modified or not archives or not _output_sizes(path, outputs)
+    if rebuild:
+        added = sorted(current)
+    try:
+        os.makedirs(os.path.join(path, STATE_DIR, 'parts'), exist_ok=True)
+        if rebuild and outputs:
+            save_manifest(path, archives)
+        _update_parts(path, pending, current, archives, options)
+        sizes = _write_outputs(path, [current[x]['sha1'] for x in added],
+                               None if rebuild else outputs)
+        _remove_unused_parts(path, current)
+    except IOError as error:
+        raise ParserError(str(error))
+    save_manifest(path, current, sizes)
@@ -0,0 +1,196 @@
+import json
+import time
+
+_enabled = False
+_timers = {}
+_counters = {}
+
+
+class MetricsError(Exception):
+    '''Ошибка сохранения метрик.'''
+    pass
+
+
+def enable(flag=True):
+    '''Включить или выключить сбор метрик в текущем процессе.'''
+    global _enabled
+    _enabled = flag
+
+
+def enabled():
+    '''Проверить, включен ли сбор метрик.'''
+    return _enabled
+
+
+def reset():
+    '''Сбросить собранные метрики текущего процесса.'''
+    _timers.clear()
+    _counters.clear()
+
+
+def start():
+    '''Начать замер этапа обработки.
+
+    Пока сбор метрик выключен, возвращает None и не обращается к таймеру,
+    поэтому замеры в горячем пути почти ничего не стоят.
+
+    :returns: время начала замера или None.
+    '''
+    if _enabled:
+        return time.perf_counter()
+    return None
+
+
+def stop(stage, started):
+    '''Завершить замер этапа обработки.
+
+    :param str stage: наименование этапа.
+    :param started: результат start().
+    '''
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    timer = _timers.get(stage)
+    if timer is None:
+        _timers[stage] = [1, elapsed]
+    else:
+        timer[0] += 1
+        timer[1] += elapsed
+
+
+def count(name, value=1):
+    '''Увеличить счетчик.
+
+    :param str name: наименование счетчика.
+    :param int value: величина увеличения.
+    '''
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    '''Получить собранные метрики текущего процесса.
+
+    :returns: dict {'timers': {этап: [вызовы, секунды]},
+                    'counters': {счетчик: значение}}.
+    '''
+    return {
+        'timers': {stage: list(timer) for stage, timer in _timers.items()},
+        'counters': dict(_counters),
+    }
+
+
+def merge(metrics):
+    '''Добавить метрики другого процесса к метрикам текущего.
+
+    :param dict metrics: результат snapshot().
+    '''
+    for stage, (calls, seconds) in metrics['timers'].items():
+        timer = _timers.setdefault(stage, [0, 0.0])
+        timer[0] += calls
+        timer[1] += seconds
+    for name, value in metrics['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def profiled(func, *args, **kwargs):
+    '''Вызвать функцию в процессе пула, собрав метрики этого вызова.
+
+    :returns: tuple (результат func, метрики вызова).
+    '''
+    enable()
+    reset()
+    result = func(*args, **kwargs)
+    return result, snapshot()
+
+
+def collect(results):
+    '''Добавить метрики результатов profiled к метрикам текущего процесса.
+
+    :param results: iterable результатов profiled.
+
+    :returns: генератор результатов func.
+    '''
+    for result, metrics in results:
+        merge(metrics)
+        yield result
+
+
+def format_table(metrics, wall=None):
+    '''Сформировать текстовую таблицу метрик.
+
+    Время этапов суммируется по всем процессам, поэтому может превышать
+    общее время работы.
+
+    :param dict metrics: результат snapshot().
+    :param float wall: общее время работы в секундах.
+
+    :returns: str с таблицей.
+    '''
+    lines = ['{:<16}{:>10}{:>12}{:>14}'.format(
+        'stage', 'calls', 'seconds', 'us/call')]
+    for stage, (calls, seconds) in sorted(metrics['timers'].items()):
+        lines.append('{:<16}{:>10}{:>12.3f}{:>14.1f}'.format(
+            stage, calls, seconds, seconds / calls * 10 ** 6 if calls else 0
+        ))
+    lines.append('')
+    lines.append('{:<16}{:>10}'.format('counter', 'value'))
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append('{:<16}{:>10}'.format(name, value))
+    if wall is not None:
+        lines.append('')
+        lines.append('wall time: {:.3f} s'.format(wall))
+    return '\n'.join(lines)
+
+
+def format_prometheus(metrics, wall=None):
+    '''Сформировать метрики в текстовом формате Prometheus (для
+    node_exporter textfile collector).
+
+    :param dict metrics: результат snapshot().
+    :param float wall: общее время работы в секундах.
+
+    :returns: str.
+    '''
+    lines = [
+        '# HELP ndt_stage_seconds_total Time spent in processing stage.',
+        '# TYPE ndt_stage_seconds_total counter',
+    ]
+    timers = sorted(metrics['timers'].items())
+    for stage, (calls, seconds) in timers:
+        lines.append('ndt_stage_seconds_total{{stage="{}"}} {!r}'.format(
+            stage, seconds))
+    lines.append('# HELP ndt_stage_calls_total Calls of processing stage.')
+    lines.append('# TYPE ndt_stage_calls_total counter')
+    for stage, (calls, seconds) in timers:
+        lines.append('ndt_stage_calls_total{{stage="{}"}} {}'.format(
+            stage, calls))
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append('# TYPE ndt_{}_total counter'.format(name))
+        lines.append('ndt_{}_total {}'.format(name, value))
+    if wall is not None:
+        lines.append('# TYPE ndt_wall_seconds gauge')
+        lines.append('ndt_wall_seconds {!r}'.format(wall))
+    return '\n'.join(lines) + '\n'
+
+
+def save(path, metrics, wall=None):
+    '''Сохранить метрики в файл: в формате Prometheus, если имя файла
+    оканчивается на .prom, иначе в JSON.
+
+    :param str path: путь до файла.
+    :param dict metrics: результат snapshot().
+    :param float wall: общее время работы в секундах.
+
+    :raises: MetricsError.
+    '''
+    if path.endswith('.prom'):
+        content = format_prometheus(metrics, wall)
+    else:
+        content = json.dumps(dict(metrics, wall=wall), indent=2,
+                             sort_keys=True)
+    try:
+        with open(path, 'w') as metrics_file:
+            metrics_file.write(content)
+    except IOError as error:
+        raise MetricsError(str(error))
@@ -1,10 +1,26 @@
 import csv
+import io
+import lzma
+import mmap
 import multiprocessing as mp
 import os
-from zipfile import BadZipFile, ZipFile
+import re
+import shutil
+import signal
+import struct
+import zlib
+from collections import Counter, deque, namedtuple
+from contextlib import ExitStack, closing, contextmanager
+from functools import partial
+from itertools import chain, tee
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
 
 from lxml import etree
 
+from ngenix_demo_task import metrics
+from ngenix_demo_task.index import IdIndex, id_digests, iter_digests
+from ngenix_demo_task.records import Records, Reject, encode_csv
+
 
 class ParserError(Exception):
     '''Ошибка работы парсера.'''
@@ -21,93 +37,558 @@ class XMLParserError(ParserError):
     pass
 
 
-def parse_xml_file(xml_file):
-    '''Получить значения id, level элементов var и name элементов object из
-    xml файла.
+def _build_result(var_ids, var_levels, xobjects, records):
+    '''Проверить найденные в документе элементы и добавить результат
+    разбора в records.
 
-    :param file xml_file: file-like объект.
+    :param list var_ids: атрибуты элементов var типа id.
+    :param list var_levels: атрибуты элементов var типа level.
+    :param list xobjects: атрибуты элементов object.
+    :param Records records: результаты разбора.
 
-    :returns: dict c результатами разбора xml файла.
+    :returns: Records.
     :raises: XMLParserError.
     '''
-    result = {
-        'vars': [],
-        'objects': []
-    }
-    try:
-        tree = etree.parse(xml_file)
-    except etree.XMLSyntaxError:
-        raise XMLParserError('XML file {} is corrupted'.format(xml_file.name))
-    var_id_list = tree.xpath('/root/var[@name="id"]')
-    if len(var_id_list) == 0:
+    if len(var_ids) == 0:
         raise XMLParserError('XML document has no var element of type id')
-    if len(var_id_list) > 1:
+    if len(var_ids) > 1:
         message = 'XML document has multiple var elements of type id'
         raise XMLParserError(message)
-    var_level_list = tree.xpath('/root/var[@name="level"]')
-    if len(var_level_list) == 0:
+    if len(var_levels) == 0:
         raise XMLParserError('XML document has no var element of type level')
-    if len(var_level_list) > 1:
+    if len(var_levels) > 1:
         message = 'XML document has multiple var elements of type level'
         raise XMLParserError(message)
-    var_id, var_level = var_id_list[0], var_level_list[0]
-    id, level = var_id.attrib['value'], var_level.attrib['value']
-    result['vars'].append((id, level))
-    xobjects = tree.xpath('/root/objects/object')
     if len(xobjects) == 0:
         message = 'XML document has no elements of type object'
         raise XMLParserError(message)
     if len(xobjects) > 10:
         message = 'XML document has more than ten elements of type object'
         raise XMLParserError(message)
-    for xobject in xobjects:
-        name = xobject.attrib['name']
-        result['objects'].append((id, name))
-    return result
+    if 'value' not in var_ids[0]:
+        raise XMLParserError('XML document has var element of type id '
+                             'without value')
+    if 'value' not in var_levels[0]:
+        raise XMLParserError('XML document has var element of type level '
+                             'without value')
+    if any('name' not in xobject for xobject in xobjects):
+        raise XMLParserError('XML document has element of type object '
+                             'without name')
+    names = [xobject['name'] for xobject in xobjects]
+    records.append(var_ids[0]['value'], var_levels[0]['value'], names)
+    return records
+
+
+XMLBuffer = namedtuple('XMLBuffer', 'name data')
+XMLBuffer.__doc__ = '''Содержимое xml файла в памяти (bytes или memoryview).'''
+
+
+_VAR_ID_XPATH = etree.XPath('/root/var[@name="id"]')
+_VAR_LEVEL_XPATH = etree.XPath('/root/var[@name="level"]')
+_OBJECTS_XPATH = etree.XPath('/root/objects/object')
+
+
+def _parse_xml_tree(xml_file, records):
+    '''Разобрать xml файл построением полного дерева и xpath запросами.
+
+    :param xml_file: file-like объект или XMLBuffer.
+    :param Records records: результаты разбора.
+
+    :returns: Records.
+    :raises: XMLParserError.
+    '''
+    started = metrics.start()
+    try:
+        if isinstance(xml_file, XMLBuffer):
+            tree = etree.fromstring(xml_file.data)
+        else:
+            tree = etree.parse(xml_file)
+    except etree.XMLSyntaxError:
+        raise XMLParserError('XML file {} is corrupted'.format(xml_file.name))
+    metrics.stop('xml_parse', started)
+    started = metrics.start()
+    var_ids = [x.attrib for x in _VAR_ID_XPATH(tree)]
+    var_levels = [x.attrib for x in _VAR_LEVEL_XPATH(tree)]
+    xobjects = [x.attrib for x in _OBJECTS_XPATH(tree)]
+    _build_result(var_ids, var_levels, xobjects, records)
+    metrics.stop('validate', started)
+    return records
+
+
+def _parse_xml_iter(xml_file, records):
+    '''Разобрать xml файл за один проход с помощью iterparse.
+
+    Отбирает те же элементы, что и запросы /root/var[@name="id"],
+    /root/var[@name="level"] и /root/objects/object, очищая разобранные
+    элементы по мере продвижения по документу. Документ в памяти (XMLBuffer)
+    читается iterparse из io.BytesIO, поэтому полное дерево не строится и
+    для него.
+
+    :param xml_file: file-like объект или XMLBuffer.
+    :param Records records: результаты разбора.
+
+    :returns: Records.
+    :raises: XMLParserError.
+    '''
+    var_ids, var_levels, xobjects = [], [], []
+    depth, in_root, in_objects = 0, False, False
+    started = metrics.start()
+    try:
+        if isinstance(xml_file, XMLBuffer):
+            source = io.BytesIO(xml_file.data)
+        else:
+            # iterparse читает только байты, поэтому у текстового файла
+            # берется нижележащий двоичный поток.
+            source = getattr(xml_file, 'buffer', xml_file)
+        events = etree.iterparse(source, ('start', 'end'))
+        for event, element in events:
+            if event == 'end':
+                if depth == 2:
+                    in_objects = False
+                if depth > 1:
+                    element.clear()
+                depth -= 1
+                continue
+            depth += 1
+            tag = element.tag
+            if depth == 1:
+                in_root = tag == 'root'
+            elif depth == 2 and in_root:
+                if tag == 'var':
+                    name = element.get('name')
+                    if name == 'id':
+                        var_ids.append(dict(element.attrib))
+                    elif name == 'level':
+                        var_levels.append(dict(element.attrib))
+                elif tag == 'objects':
+                    in_objects = True
+            elif depth == 3 and in_objects and tag == 'object':
+                xobjects.append(dict(element.attrib))
+    except etree.XMLSyntaxError:
+        raise XMLParserError('XML file {} is corrupted'.format(xml_file.name))
+    metrics.stop('xml_parse', started)
+    started = metrics.start()
+    _build_result(var_ids, var_levels, xobjects, records)
+    metrics.stop('validate', started)
+    return records
+
+
+_FAST_SPACE = rb'[ \t\r\n]*'
+# Значения атрибутов без ссылок на сущности и символов, которые lxml
+# отвергает или нормализует.
+_FAST_VALUE = rb'([^"<&\x00-\x1f]*)'
+_FAST_DOCUMENT = re.compile(
+    rb'(?:<\?xml version="1\.0"(?: encoding="(?:UTF|utf)-8")?\?>)?' +
+    _FAST_SPACE + rb'<root>' + _FAST_SPACE +
+    rb'<var name="id" value="' + _FAST_VALUE + rb'"/>' + _FAST_SPACE +
+    rb'<var name="level" value="' + _FAST_VALUE + rb'"/>' + _FAST_SPACE +
+    rb'<objects>' + _FAST_SPACE +
+    rb'((?:<object name="[^"<&\x00-\x1f]*"/>' + _FAST_SPACE + rb'){1,10})' +
+    rb'</objects>' + _FAST_SPACE + rb'</root>' + _FAST_SPACE
+)
+_FAST_OBJECT = re.compile(rb'<object name="' + _FAST_VALUE + rb'"/>')
+# U+FFFE и U+FFFF допустимы в utf-8, но недопустимы в xml.
+_FAST_NONCHARACTERS = re.compile(b'\xef\xbf[\xbe\xbf]')
+
+
+def _scan_xml(data):
+    '''Получить значения из документа в точности той формы, которую
+    формирует generator.render_xml.
+
+    :param data: bytes или memoryview с содержимым документа.
+
+    :returns: tuple (id, level, list имен объектов) или None, если документ
+              имеет другую форму.
+    '''
+    match = _FAST_DOCUMENT.fullmatch(data)
+    if match is None or _FAST_NONCHARACTERS.search(data):
+        return None
+    id, level, objects = match.groups()
+    try:
+        return (
+            id.decode('utf-8'),
+            level.decode('utf-8'),
+            [x.decode('utf-8') for x in _FAST_OBJECT.findall(objects)],
+        )
+    except UnicodeDecodeError:
+        return None
+
+
+def _parse_xml_fast(xml_file, records):
+    '''Разобрать xml файл сканированием байтов.
+
+    Документы той формы, которую формирует generator.render_xml (с
+    необязательными объявлением xml и пробельными символами между
+    элементами), разбираются регулярным выражением без построения дерева.
+    Все остальные документы, в том числе содержащие ссылки на сущности,
+    комментарии, пространства имен, одинарные кавычки или неверное
+    количество элементов, разбираются _parse_xml_tree, поэтому результаты и
+    ошибки не отличаются от разбора lxml.
+
+    :param xml_file: file-like объект или XMLBuffer.
+    :param Records records: результаты разбора.
+
+    :returns: Records.
+    :raises: XMLParserError.
+    '''
+    if not isinstance(xml_file, XMLBuffer):
+        source = getattr(xml_file, 'buffer', xml_file)
+        xml_file = XMLBuffer(getattr(xml_file, 'name', None), source.read())
+    started = metrics.start()
+    document = _scan_xml(xml_file.data)
+    metrics.stop('xml_scan', started)
+    if document is None:
+        metrics.count('fallbacks')
+        return _parse_xml_tree(xml_file, records)
+    records.append(*document)
+    return records
+
+
+XML_PARSERS = {
+    'tree': _parse_xml_tree,
+    'iter': _parse_xml_iter,
+    'fast': _parse_xml_fast,
+}
+
+# Документы, которые записывает generator, сканируются без запасного разбора
+# lxml втрое быстрее tree; документ другой формы разбирается tree после
+# неудачного сканирования, что медленнее tree на 3-5%.
+DEFAULT_XML_PARSER = 'fast'
+
+
+def parse_xml_file(xml_file, xml_parser=DEFAULT_XML_PARSER, records=None):
+    '''Получить значения id, level элементов var и name элементов object из
+    xml файла.
+
+    :param xml_file: file-like объект или XMLBuffer.
+    :param str xml_parser: способ разбора документа: tree - построение
+                           полного дерева и xpath запросы, iter - разбор за
+                           один проход с очисткой разобранных элементов,
+                           fast - сканирование байтов документов известной
+                           формы с разбором остальных способом tree.
+    :param Records records: результаты, в которые добавляется результат
+                            разбора документа (По умолчанию: новые).
+
+    :returns: Records c результатами разбора.
+    :raises: XMLParserError.
+    '''
+    if records is None:
+        records = Records()
+    XML_PARSERS[xml_parser](xml_file, records)
+    metrics.count('documents')
+    return records
+
+
+def _read_members(path, start=0, stop=None):
+    '''Читать файлы zip архива средствами zipfile.
+
+    :returns: генератор пар (имя файла, file-like объект).
+    '''
+    started = metrics.start()
+    with ZipFile(path, 'r') as archive:
+        infos = archive.infolist()[start:stop]
+        metrics.stop('zip_open', started)
+        for info in infos:
+            metrics.count('bytes', info.file_size)
+            with archive.open(info, 'r') as xml_file:
+                yield info.filename, xml_file
+
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def _read_mapped_members(path, start=0, stop=None):
+    '''Читать файлы zip архива, отображенного в память.
+
+    Центральный каталог читается zipfile, а данные файлов берутся прямо из
+    отображения архива: несжатые файлы передаются срезами memoryview без
+    копирования, сжатые deflate распаковываются за один вызов zlib.
+    Зашифрованные файлы и файлы с другими методами сжатия читаются
+    средствами zipfile.
+
+    :returns: генератор пар (имя файла, XMLBuffer или file-like объект).
+    :raises: BadZipFile.
+    '''
+    started = metrics.start()
+    with open(path, 'rb') as stream, ZipFile(stream, 'r') as archive:
+        mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        metrics.stop('zip_open', started)
+        with mapping, memoryview(mapping) as view:
+            for info in archive.infolist()[start:stop]:
+                metrics.count('bytes', info.file_size)
+                if (info.flag_bits & 0x1 or info.compress_type not in
+                        (ZIP_STORED, ZIP_DEFLATED)):
+                    with archive.open(info, 'r') as xml_file:
+                        yield info.filename, xml_file
+                    continue
+                started = metrics.start()
+                member = _mapped_member(view, info)
+                metrics.stop('decompress', started)
+                try:
+                    yield info.filename, member
+                finally:
+                    # Срез memoryview нужно освободить до закрытия
+                    # отображения.
+                    if isinstance(member.data, memoryview):
+                        member.data.release()
+
+
+def _mapped_member(view, info):
+    '''Получить содержимое несжатого или сжатого deflate файла архива из
+    отображения архива в память.
+
+    :param memoryview view: отображение архива.
+    :param ZipInfo info: описание файла архива.
+
+    :returns: XMLBuffer.
+    :raises: BadZipFile.
+    '''
+    try:
+        header = _LOCAL_HEADER.unpack_from(view, info.header_offset)
+    except struct.error:
+        raise BadZipFile('Truncated file header')
+    if header[0] != _LOCAL_HEADER_SIGNATURE:
+        raise BadZipFile('Bad magic number for file header')
+    offset = info.header_offset + _LOCAL_HEADER.size + sum(header[-2:])
+    content = data = view[offset:offset + info.compress_size]
+    if info.compress_type == ZIP_DEFLATED:
+        with data:
+            try:
+                content = zlib.decompress(data, -15, info.file_size)
+            except zlib.error:
+                raise BadZipFile('Bad compressed data')
+    if zlib.crc32(content) != info.CRC:
+        data.release()
+        raise BadZipFile('Bad CRC-32 for file')
+    return XMLBuffer(info.filename, content)
+
+
+ZIP_READERS = {
+    'zipfile': _read_members,
+    'mmap': _read_mapped_members,
+}
+
+
+ON_ERROR = ('raise', 'skip', 'quarantine')
+# Ошибки распаковки файла архива при чтении: zipfile проверяет только crc и
+# пропускает ошибки декомпрессоров и обрыв сжатых данных.
+MEMBER_ERRORS = (zlib.error, EOFError, lzma.LZMAError, OSError)
 
 
-def parse_archive(path):
+def _validate_document(records, validate):
+    '''Проверить последний добавленный документ и удалить его, если
+    проверка не пройдена.'''
+    try:
+        validate(records.ids[-1], records.levels[-1])
+    except XMLParserError:
+        records.pop()
+        raise
+
+
+def parse_archive(path, xml_parser=DEFAULT_XML_PARSER, start=0, stop=None,
+                  zip_reader='zipfile', on_error='raise', validate=None):
     '''Обработать содержимое zip архива согласно заданию №2.
 
     :param str path: путь до zip архива.
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param int start: индекс первого обрабатываемого файла архива.
+    :param int stop: индекс файла архива, на котором обработка завершается
+                     (По умолчанию: до конца архива).
+    :param str zip_reader: способ чтения архива: zipfile - средствами
+                           модуля zipfile, mmap - из отображения архива в
+                           память.
+    :param str on_error: действие при ошибке разбора: raise - вызвать
+                         исключение, skip и quarantine - пропустить
+                         документ или оставшуюся часть поврежденного архива,
+                         добавив запись в rejects результата.
+    :param validate: функция проверки документа, принимающая id и level и
+                     вызывающая XMLParserError, если документ нельзя
+                     записать (см. writers.check_level). Такой документ
+                     обрабатывается как ошибка разбора.
+    :returns: Records c результатами разбора; если архив поврежден, в них
+              остаются только отклонения.
     :raises: ZIPParserError.
     '''
-    result = {
-        'vars': [],
-        'objects': []
-    }
+    records = Records()
     try:
-        with ZipFile(path, 'r') as archive:
-            files = archive.namelist()
-            for file in files:
-                assert '.xml' in file, 'archive must contain only xml files'
-                with archive.open(file, 'r') as xml_file:
-                    diff = parse_xml_file(xml_file)
-                    result['vars'] += diff['vars']
-                    result['objects'] += diff['objects']
-    except (BadZipFile, AssertionError):
-        raise ZIPParserError('ZIP file {} is corrupted'.format(path))
+        with closing(ZIP_READERS[zip_reader](path, start, stop)) as members:
+            for file, xml_file in members:
+                if '.xml' not in file:
+                    if on_error == 'raise':
+                        raise BadZipFile('archive must contain only xml files')
+                    metrics.count('errors')
+                    records.rejects.append(Reject(
+                        'member', path, file,
+                        'File {} is not an XML file'.format(file)
+                    ))
+                    continue
+                try:
+                    parse_xml_file(xml_file, xml_parser, records)
+                    if validate is not None:
+                        _validate_document(records, validate)
+                except MEMBER_ERRORS as error:
+                    raise BadZipFile('Bad compressed data in {}: {}'.format(
+                        file, error))
+                except XMLParserError as error:
+                    if on_error == 'raise':
+                        raise
+                    metrics.count('errors')
+                    records.rejects.append(
+                        Reject('xml', path, file, str(error))
+                    )
+    except BadZipFile as error:
+        if on_error == 'raise':
+            raise ZIPParserError('ZIP file {} is corrupted'.format(path))
+        metrics.count('errors')
+        # Поврежденный архив отклоняется целиком, поэтому разобранные до
+        # ошибки документы в результаты не попадают.
+        records = records.drop(range(len(records)))
+        records.rejects.append(Reject(
+            'zip', path, None,
+            'ZIP file {} is corrupted: {}'.format(path, error)
+        ))
+    return records
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+ArchiveChunk = namedtuple('ArchiveChunk', 'path start stop')
+
+
+def plan_chunks(archive_paths, chunk_size=DEFAULT_CHUNK_SIZE,
+                on_error='raise'):
+    '''Разбить zip архивы на части для параллельной обработки.
+
+    Части формируются из идущих подряд файлов архива так, чтобы их суммарный
+    размер после распаковки (по данным центрального каталога архива) был не
+    меньше chunk_size. Большой архив разбивается на несколько частей, а
+    небольшой целиком попадает в одну, поэтому нагрузка распределяется между
+    процессами независимо от разброса размеров архивов.
+
+    :param list archive_paths: пути до zip архивов.
+    :param int chunk_size: желаемый размер части в байтах; None - архив
+                           целиком.
+    :param str on_error: действие при ошибке чтения архива (см.
+                         parse_archive): поврежденный архив передается
+                         на разбор одной частью, чтобы ошибка попала в
+                         rejects результата.
+
+    :returns: генератор ArchiveChunk.
+    :raises: ZIPParserError.
+    '''
+    for path in archive_paths:
+        try:
+            with ZipFile(path, 'r') as archive:
+                sizes = [info.file_size for info in archive.infolist()]
+        except BadZipFile:
+            if on_error == 'raise':
+                raise ZIPParserError('ZIP file {} is corrupted'.format(path))
+            yield ArchiveChunk(path, 0, None)
+            continue
+        start, total = 0, 0
+        for index, size in enumerate(sizes, 1):
+            total += size
+            if chunk_size is not None and total >= chunk_size:
+                yield ArchiveChunk(path, start, index)
+                start, total = index, 0
+        if start < len(sizes):
+            yield ArchiveChunk(path, start, len(sizes))
+
+
+VARS_HEADER = ('id', 'level')
+OBJECTS_HEADER = ('id', 'object_name')
+
+EncodedTable = namedtuple('EncodedTable', 'rows data')
+
+
+def encode_result(result):
+    '''Закодировать результат разбора в csv.
+
+    Закодированный результат передается из процесса пула одним буфером
+    bytes на таблицу: его сериализация сводится к копированию буфера, а
+    родительскому процессу не нужно создавать объекты для каждой строки.
+
+    :param Records result: результат parse_archive.
+
+    :returns: dict {таблица: EncodedTable(количество строк, данные csv)},
+              отклоненные документы передаются по ключу rejects.
+    '''
+    encoded = {
+        table: EncodedTable(result.count(table), result.to_csv(table))
+        for table in ('vars', 'objects')
+    }
+    encoded['rejects'] = result.rejects
+    return encoded
+
+
+def parse_chunk(chunk, xml_parser=DEFAULT_XML_PARSER, encode=False,
+                zip_reader='zipfile', on_error='raise', store=None,
+                digest=False, validate=None):
+    '''Обработать часть zip архива.
+
+    :param ArchiveChunk chunk: обрабатываемая часть архива.
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param bool encode: закодировать результат в csv (см. encode_result).
+    :param str zip_reader: способ чтения архива (см. parse_archive).
+    :param str on_error: действие при ошибке разбора (см. parse_archive).
+    :param store: функция, сохраняющая результат разбора в процессе пула;
+                  вместо результата возвращается ее результат.
+    :param bool digest: передать хеши id документов (см. index.id_digests)
+                        по ключу digests закодированного результата или
+                        результата store.
+    :param validate: функция проверки документа (см. parse_archive).
+    :raises: ZIPParserError.
+    '''
+    result = parse_archive(
+        chunk.path, xml_parser, chunk.start, chunk.stop, zip_reader, on_error,
+        validate
+    )
+    digests = None
+    if digest and (store is not None or encode):
+        digests = id_digests(result.ids)
+    if store is not None:
+        result = store(result)
+    elif encode:
+        started = metrics.start()
+        result = encode_result(result)
+        metrics.stop('encode', started)
+    if digests is not None:
+        result['digests'] = digests
     return result
 
 
-def render_vars_csv(path, vars):
-    '''Сохранить информацию об элементах var в csv файл.
+@contextmanager
+def open_csv(path, filename, header):
+    '''Открыть csv файл на запись и записать в него заголовок.
 
-    :param str path: путь до папки в которую нужно сохранить CSV файл.
-    :param list vars: массив с данными элементов var.
+    :param str path: путь до папки в которой нужно создать CSV файл.
+    :param str filename: имя CSV файла.
+    :param tuple header: заголовок CSV файла.
 
+    :returns: csv.writer для построчной записи данных.
+    :raises: ParserError.
     '''
     try:
-        vars_path = os.path.join(path, 'vars.csv')
-        with open(vars_path, 'w') as csvfile:
+        with open(os.path.join(path, filename), 'w') as csvfile:
             csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(('id', 'level'))
-            for line in vars:
-                csvwriter.writerow(line)
+            csvwriter.writerow(header)
+            yield csvwriter
     except IOError as error:
         raise ParserError(str(error))
 
 
+def render_vars_csv(path, vars):
+    '''Сохранить информацию об элементах var в csv файл.
+
+    :param str path: путь до папки в которую нужно сохранить CSV файл.
+    :param list vars: массив с данными элементов var.
+
+    '''
+    with open_csv(path, 'vars.csv', VARS_HEADER) as csvwriter:
+        csvwriter.writerows(vars)
+
+
 def render_objects_csv(path, objects):
     '''Сохранить информацию об элементах object в csv файл.
 
@@ -115,37 +596,464 @@ def render_objects_csv(path, objects):
     :param list objects: массив с данными элементов object.
 
     '''
-    try:
-        objects_path = os.path.join(path, 'objects.csv')
-        with open(objects_path, 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(('id', 'object_name'))
-            for line in objects:
-                csvwriter.writerow(line)
-    except IOError as error:
-        raise ParserError(str(error))
+    with open_csv(path, 'objects.csv', OBJECTS_HEADER) as csvwriter:
+        csvwriter.writerows(objects)
 
 
-def do_task_two(path):
-    '''Обработать содержимое папки с zip архивами согласно заданию №2.
+def imap_window(pool, func, iterable, window):
+    '''Применить функцию к элементам iterable в пуле процессов, удерживая
+    в работе не более window задач одновременно.
+
+    В отличие от pool.map не материализует все результаты сразу: следующая
+    задача отправляется в пул только после того, как родительский процесс
+    забрал результат самой старой из них. Результаты возвращаются в порядке
+    элементов iterable.
+
+    :param pool: пул процессов multiprocessing.Pool.
+    :param func: функция, применяемая к элементам.
+    :param iterable: набор аргументов для func.
+    :param int window: максимальное количество задач в работе.
+
+    :returns: генератор результатов.
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item, )))
+        if len(pending) >= window:
+            yield _wait(pending.popleft())
+    while pending:
+        yield _wait(pending.popleft())
+
+
+def _wait(async_result):
+    started = metrics.start()
+    result = async_result.get()
+    metrics.stop('result_wait', started)
+    return result
+
+
+def list_archives(path):
+    '''Получить отсортированный список zip архивов в папке.
 
     :param str path: путь до папки с архивами.
 
+    :returns: list путей до zip архивов.
     :raises: ParserError.
     '''
     archive_paths = []
-    for filename in os.listdir(path):
+    for filename in sorted(os.listdir(path)):
         if filename.endswith('.zip'):
             archive_paths.append(os.path.join(path, filename))
     if len(archive_paths) == 0:
         raise ParserError('No zip files found in folder {}'.format(path))
-    results = []
-    with mp.Pool() as pool:
-        results = pool.map(parse_archive, archive_paths)
-    vars = []
-    objects = []
-    for result in results:
-        vars += result['vars']
-        objects += result['objects']
-    render_vars_csv(path, vars)
-    render_objects_csv(path, objects)
+    return archive_paths
+
+
+def _without_documents(result):
+    '''Получить результат разбора части архива без документов, сохранив
+    отклонения.
+
+    :param result: результат parse_archive или encode_result.
+    '''
+    if isinstance(result, Records):
+        return result.drop(range(len(result)))
+    result = dict(result, vars=EncodedTable(0, b''),
+                  objects=EncodedTable(0, b''))
+    if 'digests' in result:
+        result['digests'] = b''
+    return result
+
+
+def complete_archives(results):
+    '''Передавать результаты частей архивов только после получения всех
+    частей архива.
+
+    Если архив отклонен как поврежденный (запись zip в rejects одной из
+    частей), из результатов всех его частей исключаются документы, поэтому
+    в результаты не попадают данные архива, который отчет считает
+    отклоненным. В памяти находятся результаты частей одного архива.
+
+    :param results: iterable пар (ArchiveChunk, результат parse_archive или
+                    encode_result) в порядке архивов.
+
+    :returns: генератор таких же пар.
+    '''
+    pending = []
+    for chunk, result in chain(results, [(None, None)]):
+        if pending and (chunk is None or chunk.path != pending[0][0].path):
+            damaged = any(
+                x.kind == 'zip' for _, part in pending
+                for x in (part.rejects if isinstance(part, Records)
+                          else part['rejects'])
+            )
+            for pending_chunk, part in pending:
+                if damaged:
+                    part = _without_documents(part)
+                yield pending_chunk, part
+            pending = []
+        if chunk is not None:
+            pending.append((chunk, result))
+
+
+def init_worker():
+    '''Подготовить процесс пула к работе.
+
+    Процессы пула наследуют обработчики сигналов родителя, поэтому
+    обработчик SIGTERM сбрасывается: иначе pool.terminate() не сможет
+    завершить процессы, если родитель перехватывает SIGTERM.
+    '''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def parse_archives(archive_paths, window=None, xml_parser=DEFAULT_XML_PARSER,
+                   workers=None, chunk_size=DEFAULT_CHUNK_SIZE, encode=False,
+                   zip_reader='zipfile', on_error='raise', store=None,
+                   digest=False, pool=None, validate=None):
+    '''Обработать zip архивы в пуле процессов.
+
+    Архивы разбиваются на части (см. plan_chunks), которые обрабатываются в
+    пуле процессов. Результаты возвращаются по мере поступления в порядке
+    архивов и файлов в них, поэтому потребление памяти ограничено размером
+    окна задач, а не объемом всех данных.
+
+    Если ошибки пропускаются, результаты возвращаются по архивам целиком,
+    а из результатов поврежденного архива исключаются документы (см.
+    complete_archives). Результаты, сохраненные функцией store в процессах
+    пула, исключить нельзя, поэтому в этом случае архив разбирается одной
+    частью.
+
+    :param list archive_paths: пути до zip архивов.
+    :param int window: максимальное количество частей архивов,
+                       обрабатываемых одновременно (По умолчанию: удвоенное
+                       количество процессов).
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param int workers: количество процессов (По умолчанию: количество
+                        процессоров).
+    :param int chunk_size: желаемый размер части архива в байтах.
+    :param bool encode: кодировать результаты в csv в процессах пула
+                        (см. encode_result).
+    :param str zip_reader: способ чтения архивов (см. parse_archive).
+    :param str on_error: действие при ошибке разбора (см. parse_archive).
+    :param store: функция сохранения результатов в процессах пула
+                  (см. parse_chunk).
+    :param bool digest: вычислять хеши id в процессах пула (см.
+                        parse_chunk).
+    :param pool: пул процессов multiprocessing.Pool для повторного
+                 использования между вызовами (По умолчанию: пул из workers
+                 процессов создается на время обработки).
+    :param validate: функция проверки документа в процессах пула (см.
+                     parse_archive).
+
+    :returns: генератор пар (ArchiveChunk, результат parse_chunk).
+    :raises: ParserError.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    if on_error != 'raise' and store is not None:
+        # parse_archive исключает документы поврежденного архива только
+        # из своей части.
+        chunk_size = None
+    chunks, planned = tee(plan_chunks(archive_paths, chunk_size, on_error))
+    task = partial(parse_chunk, xml_parser=xml_parser, encode=encode,
+                   zip_reader=zip_reader, on_error=on_error, store=store,
+                   digest=digest, validate=validate)
+    if metrics.enabled():
+        task = partial(metrics.profiled, task)
+    with ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(
+                mp.Pool(workers, initializer=init_worker)
+            )
+        results = imap_window(pool, task, chunks, window)
+        if metrics.enabled():
+            results = metrics.collect(results)
+        results = zip(planned, results)
+        if on_error != 'raise' and store is None:
+            results = complete_archives(results)
+        try:
+            yield from results
+        except IOError as error:
+            raise ParserError(str(error))
+
+
+class CSVWriter:
+    '''Запись результатов разбора в файлы vars.csv и objects.csv.
+
+    Принимает закодированные результаты (см. encode_result), поэтому
+    строки форматируются в процессах пула, а здесь только записываются.
+
+    :param str path: путь до папки в которой нужно сохранить CSV файлы.
+    '''
+
+    encoded = True
+    store = None
+    validate = None
+
+    def __init__(self, path):
+        self.path = path
+        self.stack = None
+        self.files = {}
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            for table, filename, header in (
+                    ('vars', 'vars.csv', VARS_HEADER),
+                    ('objects', 'objects.csv', OBJECTS_HEADER)):
+                try:
+                    csvfile = stack.enter_context(
+                        open(os.path.join(self.path, filename), 'wb')
+                    )
+                    csvfile.write(encode_csv([header]))
+                except IOError as error:
+                    raise ParserError(str(error))
+                self.files[table] = csvfile
+            self.stack = stack.pop_all()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.stack.__exit__(*exc_info)
+
+    def write(self, result):
+        '''Записать результат разбора части архива.
+
+        :param result: результат parse_archive или encode_result.
+
+        :raises: ParserError.
+        '''
+        started = metrics.start()
+        if isinstance(result, Records):
+            result = encode_result(result)
+        for table, csvfile in self.files.items():
+            try:
+                csvfile.write(result[table].data)
+            except IOError as error:
+                raise ParserError(str(error))
+        metrics.stop('write', started)
+
+
+REJECTS_FILENAME = 'rejects.csv'
+REJECTS_HEADER = ('kind', 'archive', 'member', 'message')
+QUARANTINE_DIR = 'quarantine'
+
+
+class RejectsReport:
+    '''Отчет об отклоненных при разборе документах и архивах.
+
+    Отклоненные документы записываются в файл rejects.csv, количество
+    отклонений подсчитывается по видам ошибок. В режиме quarantine после
+    завершения разбора отклоненные файлы извлекаются из архивов в папку
+    карантина, а поврежденные архивы перемещаются в нее целиком. В режиме
+    raise отчет не ведется.
+
+    :param str path: путь до папки, в которой нужно сохранить отчет.
+    :param str on_error: действие при ошибке разбора (см. parse_archive).
+    :param str quarantine: путь до папки карантина (По умолчанию: папка
+                           quarantine внутри path).
+    '''
+
+    def __init__(self, path, on_error='skip', quarantine=None):
+        self.path = path
+        self.on_error = on_error
+        self.quarantine = quarantine or os.path.join(path, QUARANTINE_DIR)
+        self.counts = Counter()
+        self.rejects = []
+        self.file = None
+
+    def __enter__(self):
+        if self.on_error == 'raise':
+            return self
+        try:
+            self.file = open(os.path.join(self.path, REJECTS_FILENAME), 'wb')
+            self.file.write(encode_csv([REJECTS_HEADER]))
+        except IOError as error:
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file is not None:
+            self.file.close()
+        if exc_type is None and self.on_error == 'quarantine':
+            self.isolate()
+
+    def write(self, result):
+        '''Записать отклоненные документы из результата разбора части
+        архива.
+
+        :param result: результат parse_archive или encode_result.
+
+        :raises: ParserError.
+        '''
+        if isinstance(result, Records):
+            rejects = result.rejects
+        else:
+            rejects = result.get('rejects', ())
+        if not rejects or self.file is None:
+            return
+        rows = (
+            (x.kind, os.path.basename(x.archive), x.member or '', x.message)
+            for x in rejects
+        )
+        try:
+            self.file.write(encode_csv(rows))
+        except IOError as error:
+            raise ParserError(str(error))
+        self.counts.update(x.kind for x in rejects)
+        self.rejects.extend(rejects)
+
+    def isolate(self):
+        '''Поместить отклоненные файлы и архивы в папку карантина.
+
+        :raises: ParserError.
+        '''
+        damaged = set(x.archive for x in self.rejects if x.kind == 'zip')
+        try:
+            for reject in self.rejects:
+                if reject.archive in damaged:
+                    continue
+                folder = os.path.join(
+                    self.quarantine, os.path.basename(reject.archive)
+                )
+                with ZipFile(reject.archive, 'r') as archive:
+                    archive.extract(reject.member, folder)
+            for path in sorted(damaged):
+                os.makedirs(self.quarantine, exist_ok=True)
+                shutil.move(path, os.path.join(
+                    self.quarantine, os.path.basename(path)
+                ))
+        except (IOError, BadZipFile) as error:
+            raise ParserError(str(error))
+
+
+DUPLICATES = ('allow', 'report', 'drop')
+DUPLICATES_FILENAME = 'duplicates.csv'
+DUPLICATES_HEADER = ('id', 'archive')
+
+
+class DuplicatesReport:
+    '''Проверка уникальности id документов во всех архивах.
+
+    Хеши id вычисляются в процессах пула, а родительский процесс проверяет
+    их по IdIndex, не храня строки id. Повторные вхождения id
+    записываются в файл duplicates.csv; в режиме drop документы с
+    повторными id также исключаются из результатов, и сохраняется только
+    первое вхождение. В режиме allow проверка не выполняется.
+
+    :param str path: путь до папки, в которой нужно сохранить отчет.
+    :param str mode: режим проверки (см. DUPLICATES).
+    '''
+
+    def __init__(self, path, mode='report'):
+        self.path = path
+        self.mode = mode
+        self.index = IdIndex()
+        self.count = 0
+        self.file = None
+
+    def __enter__(self):
+        if self.mode == 'allow':
+            return self
+        try:
+            filename = os.path.join(self.path, DUPLICATES_FILENAME)
+            self.file = open(filename, 'wb')
+            self.file.write(encode_csv([DUPLICATES_HEADER]))
+        except IOError as error:
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            self.file.close()
+
+    def check(self, chunk, result):
+        '''Проверить id документов результата разбора части архива.
+
+        :param ArchiveChunk chunk: часть архива.
+        :param result: результат parse_chunk с хешами id.
+
+        :returns: результат без повторных документов в режиме drop, иначе
+                  переданный результат.
+        :raises: ParserError.
+        '''
+        if self.file is None:
+            return result
+        if isinstance(result, Records):
+            digests = id_digests(result.ids)
+        else:
+            digests = result.pop('digests')
+        add = self.index.add
+        positions = []
+        for position, (high, low) in enumerate(iter_digests(digests)):
+            if not add(high, low):
+                positions.append(position)
+        if not positions:
+            return result
+        if isinstance(result, Records):
+            ids = result.ids
+        else:
+            data = io.StringIO(result['vars'].data.decode('utf-8'))
+            ids = [row[0] for row in csv.reader(data)]
+        archive = os.path.basename(chunk.path)
+        try:
+            self.file.write(encode_csv((ids[x], archive) for x in positions))
+        except IOError as error:
+            raise ParserError(str(error))
+        self.count += len(positions)
+        if self.mode == 'drop':
+            return result.drop(positions)
+        return result
+
+
+def do_task_two(path, writer=CSVWriter, on_error='raise', quarantine=None,
+                duplicates='allow', **options):
+    '''Обработать содержимое папки с zip архивами согласно заданию №2.
+
+    Результаты разбора записываются по мере поступления.
+
+    :param str path: путь до папки с архивами.
+    :param writer: класс записи результатов, принимающий путь до папки
+                   (По умолчанию: CSVWriter, см. также writers.WRITERS).
+                   Если у класса задана функция store, результаты
+                   сохраняются ею в процессах пула, а в write передаются
+                   ее результаты (см. shards.ShardedCSVWriter). Функция
+                   validate класса проверяет документы в процессах пула
+                   (см. parse_archive).
+    :param str on_error: действие при ошибке разбора: raise - прервать
+                         обработку, skip - пропустить документ или архив и
+                         записать его в rejects.csv, quarantine - также
+                         поместить его в папку карантина (см.
+                         RejectsReport).
+    :param str quarantine: путь до папки карантина.
+    :param str duplicates: проверка уникальности id: allow - не проверять,
+                           report - записать повторные id в duplicates.csv,
+                           drop - также исключить документы с повторными
+                           id из результатов (см. DuplicatesReport).
+    :param options: параметры обработки архивов (см. parse_archives).
+
+    :returns: collections.Counter с количеством отклонений по видам ошибок
+              и количеством повторных id по ключу duplicate.
+    :raises: ParserError.
+    '''
+    archive_paths = list_archives(path)
+    report = RejectsReport(path, on_error, quarantine)
+    index = DuplicatesReport(path, duplicates)
+    with writer(path) as output, report, index:
+        if duplicates != 'allow' and output.store is not None:
+            raise ParserError(
+                'Duplicate ids check is not supported for results stored '
+                'by workers'
+            )
+        results = parse_archives(
+            archive_paths, encode=output.encoded and duplicates != 'drop',
+            on_error=on_error, store=output.store,
+            digest=duplicates != 'allow', validate=output.validate, **options
+        )
+        for chunk, result in results:
+            result = index.check(chunk, result)
+            output.write(result)
+            report.write(result)
+    counts = report.counts
+    if index.count:
+        counts['duplicate'] = index.count
+    return counts
@@ -0,0 +1,237 @@
+import csv
+import io
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from itertools import chain, repeat
+
+_HEADER = struct.Struct('<I')
+
+Reject = namedtuple('Reject', 'kind archive member message')
+Reject.__doc__ = '''Отклоненный при разборе документ или архив.
+
+kind - вид ошибки (xml, member, zip), archive - путь до архива, member -
+имя файла в архиве (None, если отклонен архив целиком), message - текст
+ошибки.'''
+
+Document = namedtuple('Document', 'id level objects')
+Document.__doc__ = '''Результат разбора xml документа.
+
+id и level - значения элементов var, objects - tuple имен элементов
+object.'''
+
+
+def encode_csv(rows):
+    '''Сформировать содержимое csv файла из строк таблицы.
+
+    :param rows: iterable строк таблицы.
+
+    :returns: bytes в кодировке utf-8.
+    '''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+class Records:
+    '''Результаты разбора xml документов, хранящиеся по столбцам.
+
+    Для каждого документа хранятся id, level и количество объектов, имена
+    объектов всех документов хранятся одним списком. Строки таблиц vars и
+    objects формируются из столбцов только при выводе, поэтому разбор
+    документа не создает промежуточных словарей и кортежей. Документы,
+    которые не удалось разобрать, перечисляются в rejects (см. Reject).
+    '''
+
+    __slots__ = ('ids', 'levels', 'names', 'sizes', 'rejects')
+
+    def __init__(self):
+        self.ids = []
+        self.levels = []
+        self.names = []
+        self.sizes = array('H')
+        self.rejects = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        if not isinstance(other, Records):
+            return NotImplemented
+        return (self.ids == other.ids and self.levels == other.levels and
+                self.names == other.names and self.sizes == other.sizes and
+                self.rejects == other.rejects)
+
+    def __reduce__(self):
+        if not self.rejects:
+            return Records.from_bytes, (self.to_bytes(), )
+        state = {'rejects': self.rejects}
+        return Records.from_bytes, (self.to_bytes(), ), (None, state)
+
+    def __repr__(self):
+        return '<Records: {} documents, {} objects>'.format(
+            len(self.ids), len(self.names))
+
+    def append(self, id, level, names):
+        '''Добавить результат разбора документа.
+
+        :param str id: значение var типа id.
+        :param str level: значение var типа level.
+        :param list names: имена элементов object.
+        '''
+        self.ids.append(id)
+        self.levels.append(level)
+        self.names.extend(names)
+        self.sizes.append(len(names))
+
+    def extend(self, other):
+        '''Добавить результаты разбора других документов.
+
+        :param Records other: добавляемые результаты.
+        '''
+        self.ids.extend(other.ids)
+        self.levels.extend(other.levels)
+        self.names.extend(other.names)
+        self.sizes.extend(other.sizes)
+        self.rejects.extend(other.rejects)
+
+    def pop(self):
+        '''Удалить последний добавленный документ.'''
+        size = self.sizes.pop()
+        self.ids.pop()
+        self.levels.pop()
+        if size:
+            del self.names[-size:]
+
+    def drop(self, positions):
+        '''Получить результаты без документов с указанными номерами.
+
+        :param positions: номера исключаемых документов.
+
+        :returns: Records, отклоненные документы сохраняются.
+        '''
+        positions = set(positions)
+        records = Records()
+        offset = 0
+        for position, size in enumerate(self.sizes):
+            if position not in positions:
+                records.append(self.ids[position], self.levels[position],
+                               self.names[offset:offset + size])
+            offset += size
+        records.rejects = list(self.rejects)
+        return records
+
+    def object_ids(self):
+        '''Получить id документа для каждого объекта.
+
+        :returns: итератор id, параллельный столбцу names.
+        '''
+        return chain.from_iterable(map(repeat, self.ids, self.sizes))
+
+    def documents(self):
+        '''Получить результаты разбора по документам.
+
+        :returns: генератор Document.
+        '''
+        offset = 0
+        for id, level, size in zip(self.ids, self.levels, self.sizes):
+            yield Document(id, level, tuple(self.names[offset:offset + size]))
+            offset += size
+
+    def vars(self):
+        '''Получить строки таблицы vars.
+
+        :returns: итератор пар (id, level).
+        '''
+        return zip(self.ids, self.levels)
+
+    def objects(self):
+        '''Получить строки таблицы objects.
+
+        :returns: итератор пар (id, object_name).
+        '''
+        return zip(self.object_ids(), self.names)
+
+    def rows(self, table):
+        '''Получить строки таблицы по ее имени.
+
+        :param str table: vars или objects.
+
+        :returns: итератор строк таблицы.
+        '''
+        if table == 'vars':
+            return self.vars()
+        if table == 'objects':
+            return self.objects()
+        raise KeyError(table)
+
+    def count(self, table):
+        '''Получить количество строк таблицы.
+
+        :param str table: vars или objects.
+        '''
+        if table == 'vars':
+            return len(self.ids)
+        if table == 'objects':
+            return len(self.names)
+        raise KeyError(table)
+
+    def to_dict(self):
+        '''Получить результаты в виде словаря списков строк таблиц.
+
+        :returns: dict {'vars': [(id, level)], 'objects': [(id, name)]}.
+        '''
+        return {'vars': list(self.vars()), 'objects': list(self.objects())}
+
+    def to_csv(self, table):
+        '''Сформировать содержимое csv файла таблицы без заголовка.
+
+        :param str table: vars или objects.
+
+        :returns: bytes в кодировке utf-8.
+        '''
+        return encode_csv(self.rows(table))
+
+    def to_bytes(self):
+        '''Сериализовать результаты в двоичный формат.
+
+        Формат: количество документов (uint32 little-endian), количество
+        объектов каждого документа (uint16 little-endian) и строки столбцов
+        ids, levels, names в utf-8, разделенные нулевым байтом. Нулевой
+        символ не допускается в xml, поэтому не встречается в значениях.
+        Отклоненные документы не сериализуются.
+
+        :returns: bytes.
+        '''
+        sizes = array('H', self.sizes)
+        if sys.byteorder == 'big':  # pragma: no cover
+            sizes.byteswap()
+        strings = '\0'.join(chain(self.ids, self.levels, self.names))
+        return b''.join((
+            _HEADER.pack(len(self.ids)),
+            sizes.tobytes(),
+            strings.encode('utf-8'),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Восстановить результаты, сериализованные to_bytes.
+
+        :param bytes data: сериализованные результаты.
+
+        :returns: Records.
+        '''
+        records = cls()
+        count, = _HEADER.unpack_from(data)
+        offset = _HEADER.size + count * records.sizes.itemsize
+        records.sizes.frombytes(data[_HEADER.size:offset])
+        if sys.byteorder == 'big':  # pragma: no cover
+            records.sizes.byteswap()
+        if offset == len(data) and count == 0:
+            return records
+        strings = data[offset:].decode('utf-8').split('\0')
+        records.ids = strings[:count]
+        records.levels = strings[count:2 * count]
+        records.names = strings[2 * count:]
+        return records
@@ -0,0 +1,194 @@
+import fcntl
+import glob
+import json
+import os
+import zlib
+from functools import partial
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.parser import OBJECTS_HEADER, VARS_HEADER, ParserError
+from ngenix_demo_task.records import Records, encode_csv
+
+DEFAULT_SHARDS = 8
+PARTS_FILENAME = 'parts.json'
+HEADERS = {'vars': VARS_HEADER, 'objects': OBJECTS_HEADER}
+
+
+def shard_of(id, shards):
+    '''Получить номер части таблицы для id.
+
+    Используется crc32, а не hash(): значение hash() для строк различается
+    между процессами.
+
+    :param str id: значение var типа id.
+    :param int shards: количество частей.
+
+    :returns: int от 0 до shards - 1.
+    '''
+    return zlib.crc32(id.encode('utf-8')) % shards
+
+
+def part_path(path, table, shard):
+    '''Получить путь до файла части таблицы.
+
+    :param str path: путь до папки с результатами.
+    :param str table: vars или objects.
+    :param int shard: номер части.
+    '''
+    return os.path.join(path, table, 'part-{:05d}.csv'.format(shard))
+
+
+def split_records(result, shards):
+    '''Разделить результаты разбора на части по id документа.
+
+    Документ и все его объекты попадают в части с одним номером.
+
+    :param Records result: результаты разбора.
+    :param int shards: количество частей.
+
+    :returns: list из shards объектов Records.
+    '''
+    parts = [Records() for _ in range(shards)]
+    offset = 0
+    for id, level, size in zip(result.ids, result.levels, result.sizes):
+        parts[shard_of(id, shards)].append(
+            id, level, result.names[offset:offset + size]
+        )
+        offset += size
+    return parts
+
+
+def _append(filename, data):
+    '''Дописать данные в конец файла.
+
+    Файл части могут одновременно дописывать несколько процессов, поэтому
+    на время записи он блокируется: данные одной части архива попадают в
+    файл одним непрерывным блоком.
+    '''
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def store_shards(path, shards, result):
+    '''Записать результат разбора части архива в файлы частей таблиц.
+
+    Вызывается в процессе пула (см. parse_chunk), поэтому строки
+    форматируются и записываются без передачи в родительский процесс.
+
+    :param str path: путь до папки с результатами.
+    :param int shards: количество частей.
+    :param Records result: результат parse_archive.
+
+    :returns: dict {таблица: list количества строк в каждой части},
+              отклоненные документы передаются по ключу rejects.
+    :raises: ParserError.
+    '''
+    started = metrics.start()
+    counts = {table: [0] * shards for table in HEADERS}
+    try:
+        for shard, records in enumerate(split_records(result, shards)):
+            for table in HEADERS:
+                rows = records.count(table)
+                if rows:
+                    _append(part_path(path, table, shard),
+                            records.to_csv(table))
+                counts[table][shard] = rows
+    except IOError as error:
+        raise ParserError(str(error))
+    counts['rejects'] = result.rejects
+    metrics.stop('write', started)
+    return counts
+
+
+class ShardedCSVWriter:
+    '''Запись результатов разбора в несколько файлов на таблицу.
+
+    Строки распределяются по shards частям по crc32 id документа и
+    дописываются в файлы vars/part-NNNNN.csv и objects/part-NNNNN.csv
+    непосредственно процессами пула (см. store_shards): запись идет
+    параллельно и не проходит через родительский процесс. Каждый файл
+    части содержит заголовок и может загружаться отдельно; строки
+    документа в таблицах vars и objects находятся в частях с одинаковым
+    номером. Порядок строк внутри части не определен.
+
+    По завершении записи в файл parts.json сохраняется список частей с
+    количеством строк в каждой.
+
+    :param str path: путь до папки в которой нужно сохранить файлы.
+    :param int shards: количество частей каждой таблицы.
+    :param bool manifest: сохранить список частей в parts.json.
+    '''
+
+    encoded = False
+    validate = None
+
+    def __init__(self, path, shards=DEFAULT_SHARDS, manifest=True):
+        self.path = path
+        self.shards = shards
+        self.manifest = manifest
+        self.store = partial(store_shards, path, shards)
+        self.counts = {table: [0] * shards for table in HEADERS}
+
+    def __enter__(self):
+        try:
+            manifest_path = os.path.join(self.path, PARTS_FILENAME)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            for table, header in HEADERS.items():
+                folder = os.path.join(self.path, table)
+                os.makedirs(folder, exist_ok=True)
+                for filename in glob.glob(os.path.join(folder, 'part-*.csv')):
+                    os.remove(filename)
+                for shard in range(self.shards):
+                    filename = part_path(self.path, table, shard)
+                    with open(filename, 'wb') as part:
+                        part.write(encode_csv([header]))
+        except IOError as error:
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.manifest:
+            self.save_manifest()
+
+    def write(self, result):
+        '''Учесть результат сохранения части архива.
+
+        :param dict result: результат store_shards.
+        '''
+        for table, counts in self.counts.items():
+            for shard, rows in enumerate(result[table]):
+                counts[shard] += rows
+
+    def save_manifest(self):
+        '''Сохранить список частей таблиц в parts.json.
+
+        :raises: ParserError.
+        '''
+        tables = {}
+        for table, header in HEADERS.items():
+            tables[table] = {
+                'header': list(header),
+                'rows': sum(self.counts[table]),
+                'parts': [
+                    {
+                        'path': os.path.relpath(
+                            part_path(self.path, table, shard), self.path
+                        ),
+                        'rows': rows,
+                    }
+                    for shard, rows in enumerate(self.counts[table])
+                ],
+            }
+        manifest = {'shards': self.shards, 'hash': 'crc32', 'tables': tables}
+        try:
+            with open(os.path.join(self.path, PARTS_FILENAME), 'w') as output:
+                json.dump(manifest, output, indent=2, sort_keys=True)
+        except IOError as error:
+            raise ParserError(str(error))
@@ -0,0 +1,404 @@
+import bisect
+import csv
+import heapq
+import io
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from contextlib import ExitStack
+from operator import itemgetter
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.parser import OBJECTS_HEADER, VARS_HEADER, ParserError
+from ngenix_demo_task.records import Records, encode_csv
+
+DEFAULT_SORT_MEMORY = 64 * 1024 * 1024
+DEFAULT_INDEX_INTERVAL = 256
+MAX_FAN_IN = 64
+INDEX_FILENAME = 'index.idx'
+TABLES = (
+    ('vars', 'vars.csv', VARS_HEADER),
+    ('objects', 'objects.csv', OBJECTS_HEADER),
+)
+
+_INDEX_HEADER = struct.Struct('<8s5Q')
+_INDEX_MAGIC = b'NDTIDX2\n'
+_INDEX_ENTRY = struct.Struct('<2Q2L')
+# Примерный расход памяти на строку в списке сверх ее длины.
+_STRING_OVERHEAD = 56
+
+
+def _document_size(id, level, names):
+    '''Оценить объем памяти, занимаемый документом в буфере сортировки.'''
+    size = len(id) + len(level) + sum(map(len, names))
+    return size + _STRING_OVERHEAD * (3 + len(names))
+
+
+def write_run(filename, documents):
+    '''Записать отсортированные документы во временный файл.
+
+    Каждый документ записывается строкой csv: id, level и имена объектов.
+
+    :param str filename: путь до файла.
+    :param documents: iterable tuple (id, level, имена объектов).
+    '''
+    with open(filename, 'w', newline='', encoding='utf-8') as run:
+        csv.writer(run).writerows(
+            (id, level) + tuple(names) for id, level, names in documents
+        )
+
+
+def read_run(filename):
+    '''Читать документы временного файла, записанного write_run.
+
+    :returns: генератор tuple (id, level, list имен объектов).
+    '''
+    with open(filename, newline='', encoding='utf-8') as run:
+        for row in csv.reader(run):
+            yield row[0], row[1], row[2:]
+
+
+def merge_runs(filenames):
+    '''Объединить отсортированные последовательности документов.
+
+    Документы с одинаковыми id следуют в порядке последовательностей.
+
+    :param list filenames: пути до временных файлов (см. write_run).
+
+    :returns: итератор tuple (id, level, list имен объектов).
+    '''
+    return heapq.merge(*map(read_run, filenames), key=itemgetter(0))
+
+
+def file_stamp(filename):
+    '''Размер и время изменения файла в наносекундах.
+
+    По ним lookup определяет, что csv файл перезаписан после создания
+    индекса (например, командой parse без --sorted).
+    '''
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_index(path, entries, stamps):
+    '''Сохранить разреженный индекс отсортированных csv файлов.
+
+    Формат: сигнатура, количество записей, размеры и время изменения
+    vars.csv и objects.csv (uint64 little-endian), затем записи
+    фиксированной длины для каждого блока документов: смещения первой
+    строки блока в vars.csv и objects.csv (uint64), смещение и длина id
+    первого документа блока (uint32) в области id, которая следует за
+    записями. Фиксированная длина записей позволяет искать в индексе
+    двоичным поиском без чтения его целиком (см. SparseIndex).
+
+    :param str path: путь до папки с результатами.
+    :param list entries: tuple (id, смещение в vars.csv, смещение в
+                         objects.csv) для каждого блока.
+    :param tuple stamps: результаты file_stamp для vars.csv и objects.csv.
+    '''
+    ids = [id.encode('utf-8') for id, _, _ in entries]
+    with open(os.path.join(path, INDEX_FILENAME), 'wb') as index:
+        index.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(entries),
+                                       *(stamps[0] + stamps[1])))
+        position = 0
+        for (_, vars_offset, objects_offset), data in zip(entries, ids):
+            index.write(_INDEX_ENTRY.pack(vars_offset, objects_offset,
+                                          position, len(data)))
+            position += len(data)
+        index.write(b''.join(ids))
+
+
+class SparseIndex:
+    '''Разреженный индекс, отображенный в память (см. write_index).
+
+    Ведет себя как последовательность id первых документов блоков, поэтому
+    подходит для модуля bisect: при поиске декодируются только
+    просматриваемые записи.
+
+    :param data: содержимое файла индекса (bytes или mmap).
+
+    :raises: ParserError.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        try:
+            magic, self.count, *stamps = _INDEX_HEADER.unpack_from(data)
+            if magic != _INDEX_MAGIC:
+                raise ValueError('bad signature')
+        except (struct.error, ValueError) as error:
+            raise self.corrupted(error)
+        self.stamps = (tuple(stamps[:2]), tuple(stamps[2:]))
+        self.ids_start = _INDEX_HEADER.size + self.count * _INDEX_ENTRY.size
+        if self.ids_start > len(data):
+            raise self.corrupted('unexpected end of file')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    @staticmethod
+    def corrupted(error):
+        return ParserError('Index file {} is corrupted: {}'.format(
+            INDEX_FILENAME, error))
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, number):
+        '''Прочитать запись блока.
+
+        :returns: tuple (смещение в vars.csv, смещение в objects.csv, id).
+        :raises: ParserError.
+        '''
+        vars_offset, objects_offset, position, length = (
+            _INDEX_ENTRY.unpack_from(
+                self.data, _INDEX_HEADER.size + number * _INDEX_ENTRY.size
+            )
+        )
+        start = self.ids_start + position
+        if start + length > len(self.data):
+            raise self.corrupted('unexpected end of file')
+        try:
+            id = bytes(self.data[start:start + length]).decode('utf-8')
+        except UnicodeDecodeError as error:
+            raise self.corrupted(error)
+        return vars_offset, objects_offset, id
+
+    def __getitem__(self, number):
+        if not 0 <= number < self.count:
+            raise IndexError(number)
+        return self.entry(number)[2]
+
+    def offsets(self, number):
+        '''Смещения блока number в vars.csv и objects.csv.'''
+        return self.entry(number)[:2]
+
+
+def read_index(path):
+    '''Открыть разреженный индекс (см. write_index, SparseIndex).
+
+    :param str path: путь до папки с результатами.
+
+    :returns: SparseIndex.
+    :raises: ParserError.
+    '''
+    try:
+        with open(os.path.join(path, INDEX_FILENAME), 'rb') as index:
+            if os.fstat(index.fileno()).st_size < _INDEX_HEADER.size:
+                return SparseIndex(index.read())
+            return SparseIndex(
+                mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+    except (IOError, ValueError) as error:
+        raise ParserError(str(error))
+
+
+class SortedCSVWriter:
+    '''Запись результатов разбора в файлы vars.csv и objects.csv,
+    отсортированные по id, с разреженным индексом.
+
+    Документы накапливаются в памяти, пока их оценочный объем не превысит
+    memory байт, затем сортируются и записываются во временный файл в
+    папке результатов. По завершении записи временные файлы объединяются
+    слиянием (не более MAX_FAN_IN файлов за проход), поэтому потребление
+    памяти не зависит от объема результатов. Документы с одинаковыми id
+    сохраняют порядок поступления.
+
+    Строки документов записываются блоками по interval документов; для
+    каждого блока в index.idx сохраняются id первого документа и смещения
+    блока в обоих файлах (см. lookup).
+
+    :param str path: путь до папки в которой нужно сохранить файлы.
+    :param int memory: объем памяти для сортировки в байтах.
+    :param int interval: количество документов в блоке индекса.
+    '''
+
+    encoded = False
+    store = None
+    validate = None
+
+    def __init__(self, path, memory=DEFAULT_SORT_MEMORY,
+                 interval=DEFAULT_INDEX_INTERVAL):
+        self.path = path
+        self.memory = memory
+        self.interval = interval
+        self.buffer = []
+        self.size = 0
+        self.runs = []
+        self.run_count = 0
+        self.folder = None
+
+    def __enter__(self):
+        try:
+            index_path = os.path.join(self.path, INDEX_FILENAME)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            self.folder = tempfile.mkdtemp(prefix='.sort-', dir=self.path)
+        except IOError as error:
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+        finally:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, result):
+        '''Добавить результат разбора части архива.
+
+        :param Records result: результат parse_archive.
+
+        :raises: ParserError.
+        '''
+        started = metrics.start()
+        offset = 0
+        for id, level, count in zip(result.ids, result.levels, result.sizes):
+            names = result.names[offset:offset + count]
+            offset += count
+            self.buffer.append((id, level, names))
+            self.size += _document_size(id, level, names)
+            if self.size >= self.memory:
+                self.spill()
+        metrics.stop('write', started)
+
+    def _run_path(self):
+        self.run_count += 1
+        return os.path.join(self.folder, 'run-{:06d}'.format(self.run_count))
+
+    def spill(self):
+        '''Записать накопленные документы во временный файл.
+
+        :raises: ParserError.
+        '''
+        self.buffer.sort(key=itemgetter(0))
+        filename = self._run_path()
+        try:
+            write_run(filename, self.buffer)
+        except IOError as error:
+            raise ParserError(str(error))
+        self.runs.append(filename)
+        self.buffer = []
+        self.size = 0
+        metrics.count('sort_runs')
+
+    def finish(self):
+        '''Объединить временные файлы и записать результаты и индекс.
+
+        :raises: ParserError.
+        '''
+        started = metrics.start()
+        try:
+            if self.runs:
+                if self.buffer:
+                    self.spill()
+                while len(self.runs) > MAX_FAN_IN:
+                    runs, self.runs = self.runs, []
+                    for start in range(0, len(runs), MAX_FAN_IN):
+                        group = runs[start:start + MAX_FAN_IN]
+                        filename = self._run_path()
+                        self.runs.append(filename)
+                        write_run(filename, merge_runs(group))
+                        for run in group:
+                            os.remove(run)
+                documents = merge_runs(self.runs)
+            else:
+                self.buffer.sort(key=itemgetter(0))
+                documents = self.buffer
+            self.save(documents)
+        except (IOError, csv.Error) as error:
+            raise ParserError(str(error))
+        metrics.stop('merge', started)
+
+    def save(self, documents):
+        '''Записать отсортированные документы блоками и индекс блоков.
+
+        :param documents: iterable tuple (id, level, имена объектов),
+                          отсортированных по id.
+        '''
+        entries = []
+        with ExitStack() as stack:
+            files = []
+            for table, filename, header in TABLES:
+                csvfile = stack.enter_context(
+                    open(os.path.join(self.path, filename), 'wb')
+                )
+                csvfile.write(encode_csv([header]))
+                files.append((table, csvfile))
+            block = Records()
+            for document in documents:
+                block.append(*document)
+                if len(block) == self.interval:
+                    self._write_block(block, files, entries)
+                    block = Records()
+            if len(block):
+                self._write_block(block, files, entries)
+        stamps = tuple(
+            file_stamp(os.path.join(self.path, filename))
+            for _, filename, _ in TABLES
+        )
+        write_index(self.path, entries, stamps)
+
+    @staticmethod
+    def _write_block(block, files, entries):
+        entries.append((block.ids[0], ) + tuple(
+            csvfile.tell() for _, csvfile in files
+        ))
+        for table, csvfile in files:
+            csvfile.write(block.to_csv(table))
+
+
+def _read_rows(filename, start, stop):
+    with open(filename, 'rb') as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(stop - start)
+    return csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+
+
+def lookup(path, id):
+    '''Найти строки документов с заданным id в отсортированных результатах
+    (см. SortedCSVWriter).
+
+    Блоки, которые могут содержать id, находятся двоичным поиском по
+    индексу, поэтому читаются только они, а не файлы целиком.
+
+    :param str path: путь до папки с результатами.
+    :param str id: значение var типа id.
+
+    :returns: dict {'vars': [(id, level)], 'objects': [(id, name)]}.
+    :raises: ParserError.
+    '''
+    result = {}
+    with read_index(path) as index:
+        first = max(bisect.bisect_left(index, id) - 1, 0)
+        last = bisect.bisect_right(index, id)
+        for column, ((table, filename, _), stamp) in enumerate(
+                zip(TABLES, index.stamps)):
+            filename = os.path.join(path, filename)
+            try:
+                if file_stamp(filename) != stamp:
+                    raise ParserError(
+                        'Index file {} does not match {}, rerun parse with '
+                        '--sorted'.format(INDEX_FILENAME, os.path.basename(
+                            filename))
+                    )
+                rows = []
+                if first < last:
+                    start = index.offsets(first)[column]
+                    stop = (index.offsets(last)[column]
+                            if last < len(index) else stamp[0])
+                    rows = _read_rows(filename, start, stop)
+                result[table] = [tuple(row) for row in rows if row[0] == id]
+            except IOError as error:
+                raise ParserError(str(error))
+    return result
@@ -0,0 +1,230 @@
+import json
+import os
+from collections import Counter
+from functools import partial
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.parser import (
+    ParserError, RejectsReport, list_archives, parse_archives)
+
+DEFAULT_TOP = 10
+DEFAULT_NAMES_CAPACITY = 4096
+
+
+def _level_key(level):
+    '''Ключ сортировки значений level: сначала числа по возрастанию, затем
+    остальные строки.'''
+    try:
+        return 0, int(level), level
+    except ValueError:
+        return 1, 0, level
+
+
+class Stats:
+    '''Сводная статистика результатов разбора.
+
+    Статистика частей архивов собирается в процессах пула и объединяется в
+    родительском процессе (см. merge), поэтому результаты разбора не
+    передаются между процессами и не записываются на диск.
+
+    Количество каждого значения level и каждого количества объектов в
+    документе подсчитывается точно. Наименования объектов почти не
+    повторяются, поэтому для них хранится сводка Мисры-Гриса не более чем
+    из capacity наименований. Сводка считает вхождения наименований, а не
+    документы, поэтому names_error не превышает objects / (capacity + 1):
+    наименования, встречающиеся чаще objects / (capacity + 1) раз,
+    гарантированно в ней присутствуют, а их количество занижено не более
+    чем на names_error.
+
+    :param int capacity: количество хранимых наименований объектов.
+    '''
+
+    def __init__(self, capacity=DEFAULT_NAMES_CAPACITY):
+        self.capacity = capacity
+        self.documents = 0
+        self.levels = Counter()
+        self.sizes = Counter()
+        self.names = Counter()
+        self.names_error = 0
+        self.archives = {}
+
+    @property
+    def objects(self):
+        '''Общее количество объектов.'''
+        return sum(size * count for size, count in self.sizes.items())
+
+    def add(self, records):
+        '''Учесть результаты разбора.
+
+        :param Records records: результаты разбора.
+        '''
+        self.documents += len(records.ids)
+        self.levels.update(records.levels)
+        self.sizes.update(records.sizes)
+        self.names.update(records.names)
+        self.prune()
+
+    def merge(self, other):
+        '''Добавить статистику, собранную в другом процессе.
+
+        :param Stats other: добавляемая статистика.
+        '''
+        self.documents += other.documents
+        self.levels.update(other.levels)
+        self.sizes.update(other.sizes)
+        self.names.update(other.names)
+        self.names_error += other.names_error
+        for archive, documents in other.archives.items():
+            self.archives[archive] = self.archives.get(archive, 0) + documents
+        self.prune()
+
+    def prune(self):
+        '''Оставить в сводке наименований не более capacity наименований.
+
+        Из всех количеств вычитается (capacity + 1)-е по величине
+        количество, наименования с неположительным количеством удаляются.
+        '''
+        if len(self.names) <= self.capacity:
+            return
+        threshold = sorted(self.names.values(), reverse=True)[self.capacity]
+        self.names = Counter({
+            name: count - threshold
+            for name, count in self.names.items() if count > threshold
+        })
+        self.names_error += threshold
+
+    def top_names(self, top=DEFAULT_TOP):
+        '''Получить самые частые наименования объектов.
+
+        :param int top: количество наименований.
+
+        :returns: list пар (наименование, количество) по убыванию
+                  количества.
+        '''
+        names = sorted(self.names.items(), key=lambda x: (-x[1], x[0]))
+        return names[:top]
+
+    def to_dict(self, top=DEFAULT_TOP):
+        '''Получить статистику в виде dict для сохранения в JSON.
+
+        :param int top: количество самых частых наименований объектов.
+        '''
+        return {
+            'documents': self.documents,
+            'objects': self.objects,
+            'levels': [
+                [level, self.levels[level]]
+                for level in sorted(self.levels, key=_level_key)
+            ],
+            'objects_per_document': [
+                [size, self.sizes[size]] for size in sorted(self.sizes)
+            ],
+            'top_names': [list(x) for x in self.top_names(top)],
+            'names_error': self.names_error,
+            'archives': [
+                [archive, self.archives[archive]]
+                for archive in sorted(self.archives)
+            ],
+        }
+
+
+def accumulate(capacity, result):
+    '''Собрать статистику результата разбора части архива.
+
+    Вызывается в процессе пула (см. parse_chunk).
+
+    :param int capacity: количество хранимых наименований объектов.
+    :param Records result: результат parse_archive.
+
+    :returns: dict со статистикой по ключу stats и отклоненными
+              документами по ключу rejects.
+    '''
+    started = metrics.start()
+    stats = Stats(capacity)
+    stats.add(result)
+    metrics.stop('aggregate', started)
+    return {'stats': stats, 'rejects': result.rejects}
+
+
+def collect_stats(path, on_error='raise', quarantine=None,
+                  capacity=DEFAULT_NAMES_CAPACITY, **options):
+    '''Собрать статистику документов zip архивов папки за один проход, не
+    сохраняя результаты разбора.
+
+    :param str path: путь до папки с архивами.
+    :param str on_error: действие при ошибке разбора (см.
+                         parser.do_task_two).
+    :param str quarantine: путь до папки карантина.
+    :param int capacity: количество хранимых наименований объектов (см.
+                         Stats).
+    :param options: параметры обработки архивов (см. parse_archives).
+
+    :returns: пара (Stats, collections.Counter с количеством отклонений по
+              видам ошибок).
+    :raises: ParserError.
+    '''
+    archive_paths = list_archives(path)
+    stats = Stats(capacity)
+    stats.archives = {os.path.basename(x): 0 for x in archive_paths}
+    report = RejectsReport(path, on_error, quarantine)
+    with report:
+        results = parse_archives(
+            archive_paths, on_error=on_error,
+            store=partial(accumulate, capacity), **options
+        )
+        for chunk, result in results:
+            part = result['stats']
+            part.archives = {os.path.basename(chunk.path): part.documents}
+            stats.merge(part)
+            report.write(result)
+    return stats, report.counts
+
+
+def format_stats(stats, top=DEFAULT_TOP):
+    '''Сформировать текстовый отчет статистики.
+
+    :param Stats stats: статистика.
+    :param int top: количество самых частых наименований объектов.
+
+    :returns: str с отчетом.
+    '''
+    report = stats.to_dict(top)
+    lines = [
+        '{:<16}{:>12}'.format('documents', report['documents']),
+        '{:<16}{:>12}'.format('objects', report['objects']),
+        '{:<16}{:>12}'.format('archives', len(report['archives'])),
+    ]
+    sections = (
+        ('level', 'documents', report['levels']),
+        ('objects', 'documents', report['objects_per_document']),
+        ('object_name', 'count', report['top_names']),
+        ('archive', 'documents', report['archives']),
+    )
+    for key, value, rows in sections:
+        width = max([len(key)] + [len(str(x)) for x, _ in rows]) + 2
+        lines.append('')
+        lines.append('{:<{width}}{:>12}'.format(key, value, width=width))
+        for row in rows:
+            lines.append('{:<{width}}{:>12}'.format(*row, width=width))
+    if report['names_error']:
+        lines.append('')
+        lines.append('object_name counts may be underestimated by up to '
+                     '{}'.format(report['names_error']))
+    return '\n'.join(lines)
+
+
+def save_stats(path, stats, top=DEFAULT_TOP):
+    '''Сохранить статистику в JSON файл.
+
+    :param str path: путь до JSON файла.
+    :param Stats stats: статистика.
+    :param int top: количество самых частых наименований объектов.
+
+    :raises: ParserError.
+    '''
+    try:
+        with open(path, 'w') as json_file:
+            json.dump(stats.to_dict(top), json_file, indent=2,
+                      sort_keys=True)
+    except IOError as error:
+        raise ParserError(str(error))
@@ -0,0 +1,349 @@
+import bz2
+import io
+import lzma
+import multiprocessing as mp
+import os
+import struct
+import sys
+import zlib
+from contextlib import ExitStack
+from functools import partial
+from zipfile import (
+    ZIP_BZIP2, ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile)
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.aio import parse_members
+from ngenix_demo_task.parser import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_XML_PARSER, MEMBER_ERRORS, ZIP_READERS,
+    CSVWriter, ParserError, XMLBuffer, ZIPParserError, imap_window,
+    init_worker, list_archives, parse_xml_file)
+
+READ_SIZE = 64 * 1024
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_DESCRIPTOR = struct.Struct('<3L')
+_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+_END_SIGNATURES = (b'PK\x01\x02', b'PK\x05\x06')
+_DECOMPRESSORS = {
+    ZIP_DEFLATED: partial(zlib.decompressobj, -15),
+    ZIP_BZIP2: bz2.BZ2Decompressor,
+}
+
+
+class _Input:
+    '''Чтение потока с возможностью вернуть прочитанные данные.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def read(self, size):
+        '''Прочитать ровно size байт.
+
+        :raises: BadZipFile, если поток закончился раньше.
+        '''
+        while len(self.buffer) < size:
+            self.buffer += self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_some(self):
+        '''Прочитать очередную порцию данных.
+
+        :raises: BadZipFile, если поток закончился.
+        '''
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+            return data
+        return self._fill()
+
+    def _fill(self):
+        data = self.stream.read(READ_SIZE)
+        if not data:
+            raise BadZipFile('Truncated zip stream')
+        return data
+
+    def unread(self, data):
+        '''Вернуть данные в начало потока.'''
+        self.buffer = bytes(data) + self.buffer
+
+    def drain(self):
+        '''Дочитать поток до конца.'''
+        self.buffer = b''
+        while self.stream.read(READ_SIZE):
+            pass
+
+
+def _read_stored(source):
+    '''Прочитать несжатые данные неизвестного размера, за которыми следует
+    дескриптор данных с сигнатурой.
+
+    Конец данных определяется по сигнатуре дескриптора, crc и размер из
+    которого совпадают с прочитанными данными.
+    '''
+    data = bytearray()
+    start = 0
+    while True:
+        data += source.read_some()
+        while True:
+            position = data.find(_DESCRIPTOR_SIGNATURE, start)
+            if position < 0:
+                start = max(len(data) - len(_DESCRIPTOR_SIGNATURE) + 1, 0)
+                break
+            end = position + 4 + _DESCRIPTOR.size
+            if end > len(data):
+                start = position
+                break
+            crc, compress_size, file_size = _DESCRIPTOR.unpack_from(
+                data, position + 4
+            )
+            content = bytes(data[:position])
+            if file_size == position and zlib.crc32(content) == crc:
+                source.unread(data[end:])
+                return content, crc
+            start = position + 1
+
+
+def _read_compressed(source, decompressor):
+    '''Распаковать сжатые данные неизвестного размера до конца потока
+    сжатия.'''
+    chunks = []
+    while not decompressor.eof:
+        chunks.append(decompressor.decompress(source.read_some()))
+    source.unread(decompressor.unused_data)
+    return b''.join(chunks)
+
+
+def _read_descriptor(source):
+    '''Прочитать дескриптор данных и получить из него crc.'''
+    head = source.read(4)
+    if head == _DESCRIPTOR_SIGNATURE:
+        head = source.read(4)
+    source.read(_DESCRIPTOR.size - 4)
+    return struct.unpack('<L', head)[0]
+
+
+def read_stream_members(stream):
+    '''Читать файлы zip архива из потока последовательно, не перемещаясь
+    по нему.
+
+    Центральный каталог в конце архива не используется: файлы читаются по
+    локальным заголовкам, поэтому архив можно читать из канала, а в памяти
+    находится только текущий файл. Поддерживаются файлы без сжатия и
+    сжатые deflate и bzip2, в том числе с размерами в дескрипторе данных
+    после содержимого (такие архивы записывает zipfile в поток).
+
+    :param stream: двоичный file-like объект.
+
+    :returns: генератор пар (имя файла, XMLBuffer).
+    :raises: BadZipFile.
+    '''
+    source = _Input(stream)
+    while True:
+        try:
+            signature = source.read(4)
+        except BadZipFile:
+            raise BadZipFile('File is not a zip file')
+        if signature in _END_SIGNATURES:
+            source.drain()
+            return
+        if signature != _LOCAL_HEADER_SIGNATURE:
+            raise BadZipFile('Bad magic number for file header')
+        header = _LOCAL_HEADER.unpack(
+            signature + source.read(_LOCAL_HEADER.size - 4)
+        )
+        flags, method = header[3:5]
+        crc, compress_size = header[7:9]
+        filename = source.read(header[10])
+        source.read(header[11])
+        filename = filename.decode('utf-8' if flags & 0x800 else 'cp437')
+        if flags & 0x1:
+            raise BadZipFile('Encrypted file {}'.format(filename))
+        if method != ZIP_STORED and method not in _DECOMPRESSORS:
+            raise BadZipFile('Unsupported compression method {} for file {}'
+                             .format(method, filename))
+        started = metrics.start()
+        if not flags & 0x8:
+            content = source.read(compress_size)
+            if method != ZIP_STORED:
+                decompressor = _DECOMPRESSORS[method]()
+                content = decompressor.decompress(content)
+        elif method == ZIP_STORED:
+            content, crc = _read_stored(source)
+        else:
+            content = _read_compressed(source, _DECOMPRESSORS[method]())
+            crc = _read_descriptor(source)
+        metrics.stop('decompress', started)
+        if zlib.crc32(content) != crc:
+            raise BadZipFile('Bad CRC-32 for file {}'.format(filename))
+        metrics.count('bytes', len(content))
+        yield filename, XMLBuffer(filename, content)
+
+
+def _seekable(stream):
+    try:
+        return stream.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _read_archive(stream):
+    '''Читать файлы zip архива из двоичного потока с произвольным
+    доступом.'''
+    with ZipFile(stream, 'r') as archive:
+        for info in archive.infolist():
+            metrics.count('bytes', info.file_size)
+            with archive.open(info, 'r') as xml_file:
+                yield info.filename, xml_file
+
+
+def _read_member(xml_file):
+    '''Прочитать содержимое файла архива целиком.
+
+    zipfile распаковывает файл и проверяет его crc по мере чтения, поэтому
+    ошибки поврежденного файла должны возникнуть до передачи его
+    содержимого дальше.
+
+    :param xml_file: file-like объект или XMLBuffer.
+
+    :returns: XMLBuffer.
+    :raises: BadZipFile.
+    '''
+    if isinstance(xml_file, XMLBuffer):
+        return xml_file
+    try:
+        return XMLBuffer(xml_file.name, xml_file.read())
+    except MEMBER_ERRORS as error:
+        raise BadZipFile('Bad compressed data in {}: {}'.format(
+            xml_file.name, error))
+
+
+def read_source(source, zip_reader='zipfile'):
+    '''Читать файлы zip архивов из источника.
+
+    :param source: путь до zip архива или папки с архивами, двоичный поток,
+                   bytes с содержимым архива, либо - или None для чтения из
+                   стандартного ввода. Поток без произвольного доступа
+                   (например, канал) читается последовательно (см.
+                   read_stream_members).
+    :param str zip_reader: способ чтения архивов, заданных путем (см.
+                           parse_archive).
+
+    :returns: генератор троек (имя архива, имя файла, XMLBuffer).
+    :raises: ParserError.
+    '''
+    if source is None or source == '-':
+        source = sys.stdin.buffer
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    name = getattr(source, 'name', '<stream>')
+    if isinstance(source, (str, os.PathLike)):
+        name = os.fspath(source)
+    try:
+        if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+            for path in list_archives(source):
+                for file, xml_file in ZIP_READERS[zip_reader](path):
+                    yield path, file, _read_member(xml_file)
+            return
+        if isinstance(source, (str, os.PathLike)):
+            members = ZIP_READERS[zip_reader](source)
+        elif _seekable(source):
+            members = _read_archive(source)
+        else:
+            members = read_stream_members(source)
+        for file, xml_file in members:
+            yield name, file, _read_member(xml_file)
+    except (BadZipFile, zlib.error, EOFError, lzma.LZMAError) as error:
+        raise ZIPParserError('ZIP file {} is corrupted: {}'.format(
+            name, error))
+    except IOError as error:
+        raise ParserError(str(error))
+
+
+def iter_records(source, xml_parser=DEFAULT_XML_PARSER, zip_reader='zipfile'):
+    '''Разбирать xml документы zip архивов по одному.
+
+    Документы читаются и разбираются по мере получения значений, поэтому
+    потребление памяти не зависит от размера архивов, а результаты не
+    нужно записывать на диск.
+
+    Пример::
+
+        with open('archive.zip', 'rb') as stream:
+            for document in iter_records(stream):
+                print(document.id, document.level, document.objects)
+
+    :param source: источник архивов (см. read_source).
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param str zip_reader: способ чтения архивов (см. read_source).
+
+    :returns: генератор records.Document.
+    :raises: ParserError.
+    '''
+    for name, file, xml_file in read_source(source, zip_reader):
+        if '.xml' not in file:
+            raise ZIPParserError('ZIP file {} is corrupted'.format(name))
+        yield from parse_xml_file(xml_file, xml_parser).documents()
+
+
+def _batches(source, chunk_size, zip_reader):
+    '''Сгруппировать файлы источника в части для разбора в пуле процессов.
+
+    :returns: генератор list пар (имя файла, содержимое).
+    '''
+    batch = []
+    size = 0
+    for name, file, xml_file in read_source(source, zip_reader):
+        content = bytes(xml_file.data)
+        batch.append((file, content))
+        size += len(content)
+        if size >= chunk_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def do_task_two_stream(path, source=None, writer=CSVWriter, window=None,
+                       xml_parser=DEFAULT_XML_PARSER, workers=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, zip_reader='zipfile'):
+    '''Обработать zip архив из источника согласно заданию №2, например из
+    канала на стандартном вводе.
+
+    Файлы архива читаются последовательно и группируются в части по
+    chunk_size байт, которые разбираются в пуле процессов; в памяти
+    находится не более window частей.
+
+    :param str path: путь до папки, в которую нужно сохранить результаты.
+    :param source: источник архивов (см. read_source).
+    :param writer: класс записи результатов (см. do_task_two).
+    :param int window: максимальное количество частей в работе
+                       (По умолчанию: удвоенное количество процессов).
+    :param str xml_parser: способ разбора xml документов (см. parse_xml_file).
+    :param int workers: количество процессов (По умолчанию: количество
+                        процессоров).
+    :param int chunk_size: желаемый размер части в байтах.
+    :param str zip_reader: способ чтения архивов (см. read_source).
+
+    :raises: ParserError.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    with ExitStack() as stack:
+        output = stack.enter_context(writer(path))
+        task = partial(parse_members, '<stream>', xml_parser=xml_parser,
+                       encode=output.encoded, store=output.store,
+                       validate=output.validate)
+        if metrics.enabled():
+            task = partial(metrics.profiled, task)
+        pool = stack.enter_context(mp.Pool(workers, initializer=init_worker))
+        batches = _batches(source, chunk_size, zip_reader)
+        results = imap_window(pool, task, batches, window)
+        if metrics.enabled():
+            results = metrics.collect(results)
+        for result in results:
+            output.write(result)
@@ -0,0 +1,249 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import threading
+from contextlib import contextmanager
+
+from ngenix_demo_task.manifest import do_task_two_incremental
+from ngenix_demo_task.parser import ParserError
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct('iIII')
+
+
+def _is_archive(filename):
+    return filename.endswith('.zip') and not filename.startswith('.')
+
+
+def _list_archives(path):
+    return set(x for x in os.listdir(path) if _is_archive(x))
+
+
+def _signature(path, filename):
+    try:
+        stat = os.stat(os.path.join(path, filename))
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+class PollingWatcher:
+    '''Обнаружение записанных архивов периодическим опросом папки.
+
+    Архив считается записанным, если его размер и время изменения не
+    изменились между двумя опросами.
+    '''
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.signatures = {}
+        self.reported = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def poll(self, stop):
+        '''Дождаться очередного опроса папки.
+
+        :param threading.Event stop: событие остановки ожидания.
+
+        :returns: tuple (имена записанных архивов, имена удаленных архивов).
+        '''
+        stop.wait(self.interval)
+        completed, signatures = set(), {}
+        for filename in _list_archives(self.path):
+            signature = _signature(self.path, filename)
+            if signature is None:
+                continue
+            signatures[filename] = signature
+            if (self.signatures.get(filename) == signature and
+                    self.reported.get(filename) != signature):
+                completed.add(filename)
+                self.reported[filename] = signature
+        removed = set(self.reported) - set(signatures)
+        for filename in removed:
+            del self.reported[filename]
+        self.signatures = signatures
+        return completed, removed
+
+
+class InotifyWatcher:
+    '''Обнаружение записанных архивов через inotify (только Linux).
+
+    Архив считается записанным после закрытия открытого на запись файла
+    (IN_CLOSE_WRITE) или перемещения файла в папку (IN_MOVED_TO). Архивы,
+    находившиеся в папке до запуска, считаются записанными.
+    '''
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.fd = None
+        self.initial = set()
+
+    @staticmethod
+    def available():
+        '''Проверить, поддерживается ли inotify в текущей системе.'''
+        library = ctypes.util.find_library('c')
+        if library is None:
+            return False
+        return hasattr(ctypes.CDLL(library), 'inotify_init1')
+
+    def __enter__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        path = os.fsencode(self.path)
+        if libc.inotify_add_watch(fd, path, self.mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, 'inotify_add_watch failed', self.path)
+        self.fd = fd
+        self.initial = _list_archives(self.path)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)
+        self.fd = None
+
+    def poll(self, stop):
+        '''Дождаться событий inotify.
+
+        :param threading.Event stop: событие остановки ожидания.
+
+        :returns: tuple (имена записанных архивов, имена удаленных архивов).
+        '''
+        completed, removed = self.initial, set()
+        self.initial = set()
+        if completed:
+            return completed, removed
+        readable, _, _ = select.select([self.fd], [], [], self.interval)
+        if not readable:
+            return completed, removed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return completed, removed
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                completed |= _list_archives(self.path)
+                continue
+            filename = os.fsdecode(name)
+            if not _is_archive(filename):
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                completed.add(filename)
+                removed.discard(filename)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.add(filename)
+                completed.discard(filename)
+        return completed, removed
+
+
+def create_watcher(path, interval=1.0, polling=False):
+    '''Создать наблюдателя за папкой: inotify, если он доступен, иначе
+    периодический опрос.
+
+    :param str path: путь до папки с архивами.
+    :param float interval: интервал опроса в секундах.
+    :param bool polling: всегда использовать периодический опрос.
+    '''
+    if not polling and InotifyWatcher.available():
+        return InotifyWatcher(path, interval)
+    return PollingWatcher(path, interval)
+
+
+@contextmanager
+def stop_on_signals(stop, signums=(signal.SIGTERM, )):
+    '''Устанавливать событие stop при получении сигналов.
+
+    Обработчики устанавливаются только в главном потоке и восстанавливаются
+    при выходе из контекста.
+    '''
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = {}
+    for signum in signums:
+        previous[signum] = signal.signal(signum, lambda *args: stop.set())
+    try:
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def _ingest(path, ready, options):
+    archive_paths = [os.path.join(path, x) for x in sorted(ready)]
+    do_task_two_incremental(path, archive_paths, **options)
+
+
+def watch_folder(path, stop=None, interval=1.0, polling=False, log=None,
+                 **options):
+    '''Непрерывно обрабатывать zip архивы, появляющиеся в папке.
+
+    Каждый записанный архив разбирается один раз, его строки дописываются
+    в csv файлы (см. do_task_two_incremental). Архив, который не удалось
+    разобрать, пропускается до следующего изменения. Работа завершается
+    после установки события stop либо получения SIGTERM; начатая обработка
+    архивов при этом доводится до конца.
+
+    :param str path: путь до папки с архивами.
+    :param threading.Event stop: событие остановки.
+    :param float interval: интервал опроса папки в секундах.
+    :param bool polling: использовать периодический опрос вместо inotify.
+    :param log: функция для вывода сообщений.
+    :param options: параметры обработки архивов (см. parse_archives).
+
+    :raises: ParserError.
+    '''
+    stop = stop or threading.Event()
+    log = log or (lambda message: None)
+    ready, failed = set(), {}
+    watcher = create_watcher(path, interval, polling)
+    with stop_on_signals(stop), watcher:
+        while not stop.is_set():
+            completed, removed = watcher.poll(stop)
+            ready -= removed
+            for filename in removed:
+                failed.pop(filename, None)
+            completed = set(
+                x for x in completed
+                if failed.get(x, True) != _signature(path, x)
+            )
+            if not completed and not removed:
+                continue
+            for filename in completed:
+                failed.pop(filename, None)
+            candidates = ready | completed
+            try:
+                _ingest(path, candidates, options)
+                ready = candidates
+            except ParserError:
+                for filename in sorted(completed - ready):
+                    try:
+                        _ingest(path, ready | {filename}, options)
+                        ready.add(filename)
+                    except ParserError as error:
+                        log('Skipping {}: {}'.format(filename, error))
+                        failed[filename] = _signature(path, filename)
+            log('Processed {} archives'.format(len(ready)))
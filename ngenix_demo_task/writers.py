@@ -0,0 +1,188 @@
+import abc
+import os
+import re
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.parser import CSVWriter, ParserError, XMLParserError
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+# Значения level, которые pyarrow приводит к int32.
+_LEVEL = re.compile(r'-?[0-9]+')
+_INT32_MIN = -2 ** 31
+_INT32_MAX = 2 ** 31 - 1
+
+
+def check_level(id, level):
+    '''Проверить, что level документа можно сохранить как int32.
+
+    Вызывается для каждого документа в процессах пула (см.
+    parser.parse_archive), поэтому документ с нечисловым level отклоняется
+    так же, как поврежденный xml документ, а не прерывает запись пакета.
+
+    :param str id: значение var типа id.
+    :param str level: значение var типа level.
+
+    :raises: XMLParserError.
+    '''
+    if (_LEVEL.fullmatch(level) is None or
+            not _INT32_MIN <= int(level) <= _INT32_MAX):
+        raise XMLParserError(
+            'Level {!r} of document {} is not a 32-bit integer'.format(
+                level, id)
+        )
+
+
+def _schemas():
+    '''Схемы таблиц vars и objects.
+
+    level хранится целым числом. id в таблице objects повторяется для
+    каждого объекта документа, поэтому хранится словарем; в таблице vars
+    каждый id встречается один раз, и словарь только увеличил бы размер.
+    '''
+    vars_schema = pyarrow.schema([
+        ('id', pyarrow.string()),
+        ('level', pyarrow.int32()),
+    ])
+    objects_schema = pyarrow.schema([
+        ('id', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ('object_name', pyarrow.string()),
+    ])
+    return {'vars': vars_schema, 'objects': objects_schema}
+
+
+class ColumnarWriter(abc.ABC):
+    '''Базовый класс записи результатов разбора в колоночном формате.
+
+    Строки накапливаются по столбцам и записываются пакетами по batch_size
+    строк.
+
+    :param str path: путь до папки в которой нужно сохранить файлы.
+    :param int batch_size: количество строк в пакете.
+    '''
+
+    extension = None
+    encoded = False
+    store = None
+    validate = staticmethod(check_level)
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.schemas = None
+        self.sinks = {}
+        self.columns = {}
+
+    @abc.abstractmethod
+    def open_sink(self, path, schema):
+        '''Открыть файл таблицы на запись.'''
+
+    def __enter__(self):
+        if pyarrow is None:
+            raise ParserError(
+                'pyarrow is required for {} output'.format(self.extension)
+            )
+        self.schemas = _schemas()
+        try:
+            for table, schema in self.schemas.items():
+                filename = '{}.{}'.format(table, self.extension)
+                self.sinks[table] = self.open_sink(
+                    os.path.join(self.path, filename), schema
+                )
+                self.columns[table] = ([], [])
+        except (IOError, pyarrow.ArrowException) as error:
+            self.close()
+            raise ParserError(str(error))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                for table in self.sinks:
+                    self.flush(table)
+        finally:
+            self.close()
+
+    def close(self):
+        '''Закрыть файлы таблиц.'''
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks = {}
+
+    def write(self, result):
+        '''Записать результат разбора части архива.
+
+        :param Records result: результат parse_archive.
+        '''
+        started = metrics.start()
+        for table in self.sinks:
+            keys, values = self.columns[table]
+            if table == 'vars':
+                keys.extend(result.ids)
+                values.extend(result.levels)
+            else:
+                keys.extend(result.object_ids())
+                values.extend(result.names)
+            if len(keys) >= self.batch_size:
+                self.flush(table)
+        metrics.stop('write', started)
+
+    def flush(self, table):
+        '''Записать накопленные строки таблицы одним пакетом.
+
+        :raises: ParserError.
+        '''
+        keys, values = self.columns[table]
+        if not keys:
+            return
+        schema = self.schemas[table]
+        try:
+            arrays = [
+                pyarrow.array(keys, pyarrow.string()),
+                pyarrow.array(values, pyarrow.string()),
+            ]
+            arrays = [
+                array.cast(field.type) for array, field in zip(arrays, schema)
+            ]
+            batch = pyarrow.record_batch(arrays, schema=schema)
+            self.sinks[table].write_batch(batch)
+        except pyarrow.ArrowInvalid as error:
+            raise ParserError('Bad {} value: {}'.format(table, error))
+        except (IOError, pyarrow.ArrowException) as error:
+            raise ParserError(str(error))
+        self.columns[table] = ([], [])
+
+
+class ParquetWriter(ColumnarWriter):
+    '''Запись результатов разбора в файлы vars.parquet и objects.parquet.
+    Каждый пакет записывается отдельной группой строк.'''
+
+    extension = 'parquet'
+
+    def open_sink(self, path, schema):
+        return pyarrow.parquet.ParquetWriter(path, schema)
+
+
+class ArrowWriter(ColumnarWriter):
+    '''Запись результатов разбора в файлы vars.arrows и objects.arrows в
+    потоковом формате Arrow IPC. Словарь id передается с каждым пакетом,
+    поэтому потребление памяти не зависит от общего количества id.'''
+
+    extension = 'arrows'
+
+    def open_sink(self, path, schema):
+        return pyarrow.ipc.new_stream(path, schema)
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter,
+}
@@ -8,10 +8,14 @@ ngenix-demo-task
 from setuptools import find_packages, setup
 
 install_requires = [
-    'click==6.6',
-    'lxml==3.6.0',
+    'click>=7.0',
+    'lxml>=4.2.0',
 ]
 
+extras_require = {
+    'arrow': ['pyarrow'],
+}
+
 
 setup(
     name='ngenix-demo-task',
@@ -31,8 +35,16 @@ setup(
         ]
     },
 
+    python_requires='>=3.7',
+
     classifiers=[
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Environment :: Console',
         'Private :: Do Not Upload'
     ],
@@ -40,5 +52,6 @@ setup(
     keywords='Ngenix',
     packages=find_packages(exclude=('tests', 'tests.*')),
 
-    install_requires=install_requires
+    install_requires=install_requires,
+    extras_require=extras_require
 )
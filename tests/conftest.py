@@ -0,0 +1,18 @@
+import os.path
+import shutil
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+@pytest.fixture
+def folder(tmpdir):
+    '''Фикстура папки с копиями валидных zip архивов: в каждом документе
+    id равен helloworld.
+    '''
+    folder = tmpdir.mkdir('good')
+    for filename in os.listdir(os.path.join(DATA_DIR, 'good')):
+        shutil.copy(os.path.join(DATA_DIR, 'good', filename), str(folder))
+    return str(folder)
@@ -0,0 +1,141 @@
+import csv
+import os.path
+import shutil
+
+from unittest import mock
+
+import pytest
+
+from ngenix_demo_task import parser
+from ngenix_demo_task.aio import (
+    _process, do_task_two_async, parse_members, read_chunk)
+from ngenix_demo_task.parser import (
+    ArchiveChunk, CSVWriter, ParserError, XMLParserError, ZIPParserError,
+    do_task_two, parse_chunk)
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+def read_csv(path, filename):
+    with open(os.path.join(path, filename)) as csvfile:
+        return list(csv.reader(csvfile))
+
+
+class TestReadChunk:
+    '''read_chunk'''
+
+    def test_ok(self):
+        '''возвращает имена и содержимое файлов части архива.'''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        members = read_chunk(ArchiveChunk(path, 1, 2))
+        assert len(members) == 1
+        assert members[0][0].endswith('.xml')
+        assert members[0][1].startswith(b'<')
+
+    def test_corrupted(self):
+        '''возвращает ошибку ZIPParserError, если архив поврежден.'''
+        path = os.path.join(DATA_DIR, 'corrupted.zip')
+        with pytest.raises(ZIPParserError):
+            read_chunk(ArchiveChunk(path, 0, None))
+
+
+class TestParseMembers:
+    '''parse_members'''
+
+    def test_ok(self):
+        '''возвращает тот же результат, что и parse_chunk.'''
+        chunk = ArchiveChunk(os.path.join(DATA_DIR, 'test.zip'), 0, None)
+        result = parse_members(chunk.path, read_chunk(chunk))
+        assert result == parse_chunk(chunk)
+
+    def test_not_xml(self):
+        '''возвращает ошибку ZIPParserError, если среди файлов есть не xml
+        файл.
+        '''
+        with pytest.raises(ZIPParserError):
+            parse_members('test.zip', [('readme.txt', b'')])
+
+    def test_bad_xml(self):
+        '''возвращает ошибку XMLParserError с именем файла, если xml файл
+        поврежден.
+        '''
+        with pytest.raises(XMLParserError) as excinfo:
+            parse_members('test.zip', [('bad.xml', b'<root>')])
+        assert 'bad.xml' in str(excinfo.value)
+
+    def test_validate(self):
+        '''возвращает ошибку XMLParserError, если документ не прошел
+        проверку validate.
+        '''
+        def validate(id, level):
+            raise XMLParserError('Bad level {}'.format(level))
+
+        chunk = ArchiveChunk(os.path.join(DATA_DIR, 'test.zip'), 0, None)
+        with pytest.raises(XMLParserError) as excinfo:
+            parse_members(chunk.path, read_chunk(chunk), validate=validate)
+        assert 'Bad level 42' in str(excinfo.value)
+
+
+class TestDoTaskTwoAsync:
+    '''do_task_two_async'''
+
+    @pytest.mark.parametrize('window, workers, chunk_size, readers', [
+        (None, None, 1024 * 1024, 4),
+        (1, 1, 1024 * 1024, 1),
+        (2, 2, 1, 3),
+    ])
+    def test_ok(self, folder, tmpdir, window, workers, chunk_size, readers):
+        '''записывает те же csv файлы, что и do_task_two.'''
+        do_task_two_async(folder, window=window, workers=workers,
+                          chunk_size=chunk_size, readers=readers)
+        expected = str(tmpdir.mkdir('expected'))
+        for filename in os.listdir(folder):
+            shutil.copy(os.path.join(folder, filename), expected)
+        do_task_two(expected, workers=1)
+        for filename in ('vars.csv', 'objects.csv'):
+            assert read_csv(folder, filename) == read_csv(expected, filename)
+        assert len(read_csv(folder, 'vars.csv')) == 5
+
+    def test_window(self, folder):
+        '''держит в работе не более window частей и планирует части по мере
+        обработки.
+        '''
+        events = []
+
+        def plan_chunks(*args):
+            for chunk in parser.plan_chunks(*args):
+                events.append('plan')
+                yield chunk
+
+        async def process(*args):
+            events.append('start')
+            assert events.count('start') - events.count('write') <= 2
+            return await _process(*args)
+
+        class Writer(CSVWriter):
+            def write(self, result):
+                events.append('write')
+                super().write(result)
+
+        with mock.patch('ngenix_demo_task.aio.plan_chunks', plan_chunks):
+            with mock.patch('ngenix_demo_task.aio._process', process):
+                do_task_two_async(folder, Writer, window=2, workers=1,
+                                  chunk_size=1)
+        assert events.count('write') == 4
+        assert events.index('write') < len(events) - events[::-1].index(
+            'plan')
+
+    def test_bad_archive(self, folder):
+        '''возвращает ошибку ParserError, если архив не удалось разобрать.'''
+        shutil.copy(os.path.join(DATA_DIR, 'not_only_xml.zip'), folder)
+        with pytest.raises(ParserError) as excinfo:
+            do_task_two_async(folder, workers=2, chunk_size=1)
+        assert 'not_only_xml.zip' in str(excinfo.value)
+
+    def test_empty(self):
+        '''вызывает ошибку ParserError, если в папке нет zip файлов.'''
+        path = os.path.join(DATA_DIR, 'empty')
+        with pytest.raises(ParserError) as excinfo:
+            do_task_two_async(path)
+        assert 'No zip files found' in str(excinfo.value)
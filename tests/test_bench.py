@@ -0,0 +1,98 @@
+import json
+import os
+import os.path
+
+import pytest
+
+from ngenix_demo_task.bench import (
+    BenchmarkError, format_results, parse_sizes, run_benchmarks, run_isolated,
+    save_results)
+from ngenix_demo_task.parser import XML_PARSERS
+
+
+class TestParseSizes:
+    '''parse_sizes'''
+
+    def test_ok(self):
+        '''возвращает пары (количество архивов, количество документов).'''
+        assert parse_sizes('10x100,2X5') == ((10, 100), (2, 5))
+
+    @pytest.mark.parametrize('text', ['10', '10x', 'x10', '0x10', '1x2x3'])
+    def test_bad_sizes(self, text):
+        '''возвращает ошибку BenchmarkError, если формат размера неверен.'''
+        with pytest.raises(BenchmarkError):
+            parse_sizes(text)
+
+
+def allocate():
+    data = bytearray(128 * 1024 * 1024)
+    data[::4096] = b'x' * len(data[::4096])
+
+
+def fail():
+    raise ValueError('Test')
+
+
+def crash():
+    os._exit(3)
+
+
+class TestRunIsolated:
+    '''run_isolated'''
+
+    def test_peak_rss(self):
+        '''возвращает пик памяти только выполненного замера.'''
+        seconds, large, _ = run_isolated(allocate)
+        assert seconds > 0
+        seconds, small, _ = run_isolated(object)
+        assert small + 64 * 1024 < large
+
+    def test_error(self):
+        '''передает исключение замеряемой функции.'''
+        with pytest.raises(ValueError):
+            run_isolated(fail)
+
+    def test_crash(self):
+        '''возвращает ошибку BenchmarkError, если процесс завершился без
+        результата.
+        '''
+        with pytest.raises(BenchmarkError) as excinfo:
+            run_isolated(crash)
+        assert 'exited with code 3' in str(excinfo.value)
+
+
+class TestRunBenchmarks:
+    '''run_benchmarks'''
+
+    def test_ok(self, tmpdir):
+        '''выполняет замеры и сохраняет результаты в JSON файл.'''
+        path = str(tmpdir.mkdir('bench'))
+        report = run_benchmarks(path, sizes=((2, 5), ), workers=2)
+        assert os.listdir(path) == []
+        benchmarks = set(x['benchmark'] for x in report['results'])
+        assert benchmarks == {
+            'render_xml', 'generate_zip', 'do_task_one', 'parse_xml_file',
+            'parse_archive', 'do_task_two'
+        }
+        for result in report['results']:
+            assert result['size'] == '2x5'
+            assert result['seconds'] > 0
+            assert result['bytes'] > 0
+        parse = [
+            x for x in report['results'] if x['benchmark'] == 'do_task_two'
+        ]
+        assert [x['documents'] for x in parse] == [10] * len(XML_PARSERS)
+        report_path = os.path.join(path, 'bench.json')
+        save_results(report_path, report)
+        with open(report_path, 'r') as json_file:
+            assert json.load(json_file) == report
+        assert 'do_task_two' in format_results(report)
+
+    def test_keep(self, tmpdir):
+        '''оставляет наборы архивов, если передан параметр keep.'''
+        path = str(tmpdir.mkdir('bench'))
+        run_benchmarks(path, sizes=((1, 3), ), workers=1, keep=True)
+        corpus = os.path.join(path, '1x3')
+        assert sorted(os.listdir(corpus)) == [
+            '0.zip', 'objects.csv', 'vars.csv'
+        ]
@@ -1,12 +1,21 @@
+import io
+import json
 import os
 from unittest import mock
+from zipfile import ZipFile
 
 import pytest
 from click.testing import CliRunner
 
+from ngenix_demo_task import metrics
 from ngenix_demo_task.cli import main
+from ngenix_demo_task.cluster import ClusterError
 from ngenix_demo_task.generator import GeneratorError
-from ngenix_demo_task.parser import ParserError
+from ngenix_demo_task.parser import CSVWriter, ParserError
+from ngenix_demo_task.shards import ShardedCSVWriter
+from ngenix_demo_task.sorting import SortedCSVWriter
+from ngenix_demo_task.stats import Stats
+from ngenix_demo_task.writers import ParquetWriter
 
 
 class TestCLI:
@@ -41,6 +50,70 @@ class TestCLI:
         args, kwargs = task_one_mock.call_args
         assert '/tmp' in args
 
+    @mock.patch('ngenix_demo_task.cli.do_task_one')
+    def test_generate_with_workers(self, task_one_mock, runner):
+        '''generate передает в do_task_one количество процессов.'''
+        task_one_mock.return_value = None
+        result = runner.invoke(main, ['generate', '-w', '4'])
+        assert result.exit_code == 0
+        args, kwargs = task_one_mock.call_args
+        assert kwargs['workers'] == 4
+
+    @mock.patch('ngenix_demo_task.cli.do_task_one')
+    def test_generate_with_options(self, task_one_mock, runner):
+        '''generate передает в do_task_one параметры набора архивов.'''
+        task_one_mock.return_value = None
+        result = runner.invoke(main, [
+            'generate', '-n', '10', '-d', '1000', '--max-objects', '8',
+            '--objects-distribution', 'triangular', '--compression', 'lzma',
+            '--seed', '42'
+        ])
+        assert result.exit_code == 0
+        args, kwargs = task_one_mock.call_args
+        assert kwargs['quantity'] == 10
+        assert kwargs['documents'] == 1000
+        assert kwargs['compression'] == 'lzma'
+        assert kwargs['data_options']['max_objects'] == 8
+        assert kwargs['data_options']['distribution'] == 'triangular'
+        assert kwargs['seed'] == 42
+
+    def test_generate_stdout(self, runner):
+        '''generate записывает архив в стандартный вывод, если передан путь
+        -.
+        '''
+        result = runner.invoke(main, ['generate', '-o', '-', '-d', '3'])
+        assert result.exit_code == 0
+        with ZipFile(io.BytesIO(result.stdout_bytes), 'r') as archive:
+            assert archive.namelist() == ['0.xml', '1.xml', '2.xml']
+
+    def test_generate_stdout_archives(self, runner):
+        '''generate завершается с ошибкой, если в стандартный вывод нужно
+        записать несколько архивов.
+        '''
+        result = runner.invoke(main, ['generate', '-o', '-', '-n', '2'])
+        assert result.exit_code == 2
+
+    def test_generate_bad_compresslevel(self, runner):
+        '''generate завершается с ошибкой, если уровень сжатия не
+        поддерживается методом сжатия.
+        '''
+        result = runner.invoke(main, [
+            'generate', '-o', '-', '--compression', 'deflated',
+            '--compresslevel', '42',
+        ])
+        assert result.exit_code == 1
+        assert 'Compression level of deflated must be from 0 to 9' in (
+            result.output)
+
+    def test_generate_too_many_objects(self, runner):
+        '''generate завершается с ошибкой, если документы содержали бы больше
+        объектов, чем допускает разбор.
+        '''
+        result = runner.invoke(main, [
+            'generate', '-o', '-', '--max-objects', '11',
+        ])
+        assert result.exit_code == 2
+
     @mock.patch('ngenix_demo_task.cli.do_task_one')
     def test_generate_fail(self, task_one_mock, runner):
         '''generate завершается с ошибкой, если ошибка произошла в do_task_one.
@@ -61,6 +134,7 @@ class TestCLI:
         assert task_two_mock.call_count == 1
         args, kwargs = task_two_mock.call_args
         assert os.getcwd() in args
+        assert kwargs['xml_parser'] == 'fast'
 
     @mock.patch('ngenix_demo_task.cli.do_task_two')
     def test_parse_with_folder(self, task_two_mock, runner):
@@ -74,6 +148,242 @@ class TestCLI:
         args, kwargs = task_two_mock.call_args
         assert '/tmp' in args
 
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_with_workers(self, task_two_mock, runner):
+        '''parse передает в do_task_two количество процессов и размер части
+        архива.
+        '''
+        task_two_mock.return_value = None
+        result = runner.invoke(
+            main, ['parse', '-w', '3', '--chunk-size', '64K']
+        )
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['workers'] == 3
+        assert kwargs['chunk_size'] == 64 * 1024
+        assert kwargs['zip_reader'] == 'zipfile'
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_zip_reader(self, task_two_mock, runner):
+        '''parse передает в do_task_two способ чтения архивов.'''
+        task_two_mock.return_value = None
+        result = runner.invoke(main, ['parse', '--zip-reader', 'mmap'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['zip_reader'] == 'mmap'
+
+    @pytest.mark.parametrize('size', ['0', 'abc', '-1M'])
+    def test_parse_bad_chunk_size(self, size, runner):
+        '''parse завершается с ошибкой, если размер части архива некорректен.
+        '''
+        result = runner.invoke(main, ['parse', '--chunk-size', size])
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two_incremental')
+    def test_parse_incremental(self, incremental_mock, runner):
+        '''parse вызывает do_task_two_incremental, если передан флаг
+        --incremental.
+        '''
+        incremental_mock.return_value = None
+        result = runner.invoke(main, ['parse', '--incremental', '-o', '/tmp'])
+        assert result.exit_code == 0
+        assert incremental_mock.call_count == 1
+        args, kwargs = incremental_mock.call_args
+        assert '/tmp' in args
+
+    @mock.patch('ngenix_demo_task.cli.watch_folder')
+    def test_parse_watch(self, watch_mock, runner):
+        '''parse вызывает watch_folder, если передан флаг --watch.'''
+        watch_mock.return_value = None
+        result = runner.invoke(main, [
+            'parse', '--watch', '--polling', '--poll-interval', '0.5',
+            '-o', '/tmp'
+        ])
+        assert result.exit_code == 0
+        assert watch_mock.call_count == 1
+        args, kwargs = watch_mock.call_args
+        assert '/tmp' in args
+        assert kwargs['polling'] is True
+        assert kwargs['interval'] == 0.5
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_format(self, task_two_mock, runner):
+        '''parse передает в do_task_two класс записи результатов.'''
+        task_two_mock.return_value = None
+        result = runner.invoke(main, ['parse', '-f', 'parquet'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['writer'].func is ParquetWriter
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_shards(self, task_two_mock, runner):
+        '''parse передает в do_task_two класс записи по частям.'''
+        task_two_mock.return_value = None
+        result = runner.invoke(
+            main, ['parse', '--shards', '4', '--no-parts-manifest']
+        )
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['writer'].func is ShardedCSVWriter
+        assert kwargs['writer'].keywords == {'shards': 4, 'manifest': False}
+
+    def test_parse_shards_format(self, runner):
+        '''parse завершается с ошибкой, если --shards передан не для csv.'''
+        result = runner.invoke(main, ['parse', '--shards', '2', '-f', 'arrow'])
+        assert result.exit_code == 2
+
+    def test_parse_format_incremental(self, runner):
+        '''parse завершается с ошибкой, если формат отличается от csv в
+        режиме --incremental.
+        '''
+        result = runner.invoke(main, ['parse', '-f', 'arrow', '--incremental'])
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two_async')
+    def test_parse_engine(self, task_two_mock, runner):
+        '''parse вызывает do_task_two_async, если выбран способ обработки
+        async.
+        '''
+        task_two_mock.return_value = None
+        result = runner.invoke(main, ['parse', '--engine', 'async', '-w', '2'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['workers'] == 2
+        assert kwargs['writer'] is CSVWriter
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_on_error(self, task_two_mock, runner):
+        '''parse передает в do_task_two действие при ошибке и выводит
+        количество отклонений.
+        '''
+        task_two_mock.return_value = {'xml': 2}
+        result = runner.invoke(main, ['parse', '--on-error', 'quarantine',
+                                      '--quarantine', '/tmp/q'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['on_error'] == 'quarantine'
+        assert kwargs['quarantine'] == '/tmp/q'
+        assert 'Rejected: xml=2' in result.output
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_duplicates(self, task_two_mock, runner):
+        '''parse передает в do_task_two режим проверки уникальности id и
+        выводит количество повторных id.
+        '''
+        task_two_mock.return_value = {'duplicate': 3}
+        result = runner.invoke(main, ['parse', '--duplicates', 'drop'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['duplicates'] == 'drop'
+        assert 'Duplicate ids: 3' in result.output
+        assert 'Rejected' not in result.output
+
+    def test_parse_duplicates_shards(self, runner):
+        '''parse завершается с ошибкой, если уникальность id проверяется
+        при записи по частям.
+        '''
+        result = runner.invoke(
+            main, ['parse', '--duplicates', 'report', '--shards', '2']
+        )
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_parse_sorted(self, task_two_mock, runner):
+        '''parse передает в do_task_two запись отсортированных результатов
+        с заданным объемом памяти.
+        '''
+        task_two_mock.return_value = None
+        result = runner.invoke(main, ['parse', '--sorted',
+                                      '--sort-memory', '2M'])
+        assert result.exit_code == 0
+        args, kwargs = task_two_mock.call_args
+        assert kwargs['writer'].func is SortedCSVWriter
+        assert kwargs['writer'].keywords == {'memory': 2 * 1024 * 1024}
+
+    @pytest.mark.parametrize('option', [
+        ['--shards', '2'], ['--format', 'parquet'], ['--incremental'],
+    ])
+    def test_parse_sorted_usage(self, runner, option):
+        '''parse завершается с ошибкой, если сортировка выбрана вместе с
+        несовместимыми параметрами.
+        '''
+        result = runner.invoke(main, ['parse', '--sorted'] + option)
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.lookup')
+    def test_lookup(self, lookup_mock, runner):
+        '''lookup выводит строки документа в формате csv.'''
+        lookup_mock.return_value = {
+            'vars': [('x', '1')], 'objects': [('x', 'a'), ('x', 'b,c')],
+        }
+        result = runner.invoke(main, ['lookup', '-o', '/tmp', 'x'])
+        assert result.exit_code == 0
+        lookup_mock.assert_called_once_with('/tmp', 'x')
+        assert result.output.splitlines() == [
+            'id,level', 'x,1', 'id,object_name', 'x,a', 'x,"b,c"'
+        ]
+
+    @mock.patch('ngenix_demo_task.cli.lookup')
+    def test_lookup_not_found(self, lookup_mock, runner):
+        '''lookup завершается с ошибкой, если документ не найден.'''
+        lookup_mock.return_value = {'vars': [], 'objects': []}
+        result = runner.invoke(main, ['lookup', 'x'])
+        assert result.exit_code == 1
+        assert 'Id x not found' in result.output
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two_stream')
+    def test_parse_stdin(self, task_stream_mock, runner):
+        '''parse вызывает do_task_two_stream, если передан источник -.'''
+        task_stream_mock.return_value = None
+        result = runner.invoke(main, ['parse', '-o', '/tmp', '-'])
+        assert result.exit_code == 0
+        args, kwargs = task_stream_mock.call_args
+        assert '/tmp' in args
+        assert kwargs['source'] == '-'
+        assert kwargs['writer'] is CSVWriter
+
+    def test_parse_stdin_incremental(self, runner):
+        '''parse завершается с ошибкой, если источник передан в режиме
+        --incremental.
+        '''
+        result = runner.invoke(main, ['parse', '--incremental', '-'])
+        assert result.exit_code == 2
+
+    def test_parse_on_error_incremental(self, runner):
+        '''parse завершается с ошибкой, если ошибки пропускаются в режиме
+        --incremental.
+        '''
+        result = runner.invoke(
+            main, ['parse', '--on-error', 'skip', '--incremental']
+        )
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two')
+    def test_profile(self, task_two_mock, runner, tmpdir):
+        '''выводит и сохраняет метрики, если передан флаг --profile.'''
+        def task(*args, **kwargs):
+            metrics.count('documents', 7)
+        task_two_mock.side_effect = task
+        path = str(tmpdir.join('metrics.json'))
+        try:
+            result = runner.invoke(
+                main, ['--profile', '--profile-output', path, 'parse']
+            )
+        finally:
+            metrics.enable(False)
+            metrics.reset()
+        assert result.exit_code == 0
+        assert 'documents' in result.output
+        with open(path) as json_file:
+            assert json.load(json_file)['counters'] == {'documents': 7}
+
+    def test_parse_engine_watch(self, runner):
+        '''parse завершается с ошибкой, если способ обработки async выбран
+        в режиме --watch.
+        '''
+        result = runner.invoke(main, ['parse', '--engine', 'async', '--watch'])
+        assert result.exit_code == 2
+
     @mock.patch('ngenix_demo_task.cli.do_task_one')
     def test_parse_fail(self, task_one_mock, runner):
         '''parse завершается с ошибкой, если ошибка произошла в do_task_two.
@@ -83,6 +393,78 @@ class TestCLI:
         assert result.exit_code == 1
         assert "Error" in result.output
 
+    @mock.patch('ngenix_demo_task.cli.save_stats')
+    @mock.patch('ngenix_demo_task.cli.collect_stats')
+    def test_stats(self, stats_mock, save_mock, runner):
+        '''stats выводит статистику, собранную collect_stats, и сохраняет ее
+        в JSON файл.
+        '''
+        stats = Stats()
+        stats.documents = 5
+        stats_mock.return_value = (stats, {'zip': 1})
+        result = runner.invoke(main, ['stats', '-o', '/tmp', '--top', '3',
+                                      '--on-error', 'skip',
+                                      '--report', '/tmp/stats.json'])
+        assert result.exit_code == 0
+        args, kwargs = stats_mock.call_args
+        assert '/tmp' in args
+        assert kwargs['on_error'] == 'skip'
+        save_mock.assert_called_once_with('/tmp/stats.json', stats, 3)
+        assert 'documents' in result.output
+        assert 'Rejected: zip=1' in result.output
+
+    @mock.patch('ngenix_demo_task.cli.collect_stats')
+    def test_stats_fail(self, stats_mock, runner):
+        '''stats завершается с ошибкой, если ошибка произошла в
+        collect_stats.
+        '''
+        stats_mock.side_effect = ParserError('Test')
+        result = runner.invoke(main, ['stats'])
+        assert result.exit_code == 1
+        assert 'Test' in result.output
+
+    @mock.patch('ngenix_demo_task.cli.do_task_two_cluster')
+    def test_coordinator(self, cluster_mock, runner):
+        '''coordinator вызывает do_task_two_cluster с адресом и параметрами
+        заданий.
+        '''
+        cluster_mock.return_value = 4
+        result = runner.invoke(main, ['coordinator', '-o', '/tmp',
+                                      '--bind', '0.0.0.0:9000',
+                                      '--tasks', '3', '--retries', '0'])
+        assert result.exit_code == 0
+        args, kwargs = cluster_mock.call_args
+        assert args == ('/tmp', ('0.0.0.0', 9000))
+        assert kwargs['tasks'] == 3
+        assert kwargs['retries'] == 0
+        assert 'Processed 4 documents' in result.output
+
+    def test_coordinator_bad_address(self, runner):
+        '''coordinator завершается с ошибкой, если адрес некорректен.'''
+        result = runner.invoke(main, ['coordinator', '--bind', 'host:port'])
+        assert result.exit_code == 2
+
+    @mock.patch('ngenix_demo_task.cli.run_worker')
+    def test_worker(self, worker_mock, runner):
+        '''worker вызывает run_worker с адресом координатора.'''
+        worker_mock.return_value = 2
+        result = runner.invoke(main, ['worker', '--connect', '9000',
+                                      '-w', '2', '--name', 'node'])
+        assert result.exit_code == 0
+        args, kwargs = worker_mock.call_args
+        assert args == (('127.0.0.1', 9000), )
+        assert kwargs['name'] == 'node'
+        assert kwargs['workers'] == 2
+        assert 'Completed 2 tasks' in result.output
+
+    @mock.patch('ngenix_demo_task.cli.run_worker')
+    def test_worker_fail(self, worker_mock, runner):
+        '''worker завершается с ошибкой, если координатор недоступен.'''
+        worker_mock.side_effect = ClusterError('Test')
+        result = runner.invoke(main, ['worker'])
+        assert result.exit_code == 1
+        assert 'Test' in result.output
+
     @mock.patch('ngenix_demo_task.cli.do_task_two')
     @mock.patch('ngenix_demo_task.cli.do_task_one')
     def test_cycle(self, task_one_mock, task_two_mock, runner):
@@ -127,3 +509,22 @@ class TestCLI:
         result = runner.invoke(main, ['cycle', ])
         assert result.exit_code == 1
         assert "Error" in result.output
+
+    @mock.patch('ngenix_demo_task.cli.save_results')
+    @mock.patch('ngenix_demo_task.cli.run_benchmarks')
+    def test_bench(self, bench_mock, save_mock, runner):
+        '''bench выполняет замеры и сохраняет отчет в папку output.'''
+        bench_mock.return_value = {'results': []}
+        result = runner.invoke(
+            main, ['bench', '-o', '/tmp', '--sizes', '1x10,2x20']
+        )
+        assert result.exit_code == 0
+        args, kwargs = bench_mock.call_args
+        assert args == ('/tmp', ((1, 10), (2, 20)))
+        args, kwargs = save_mock.call_args
+        assert args == ('/tmp/bench.json', {'results': []})
+
+    def test_bench_bad_sizes(self, runner):
+        '''bench завершается с ошибкой, если размеры наборов некорректны.'''
+        result = runner.invoke(main, ['bench', '--sizes', '10'])
+        assert result.exit_code == 2
@@ -0,0 +1,284 @@
+import filecmp
+import io
+import multiprocessing as mp
+import os.path
+import shutil
+import socket
+import threading
+from unittest import mock
+
+import pytest
+
+from ngenix_demo_task.cluster import (
+    ClusterError, Coordinator, parse_address, receive_message, run_worker,
+    send_message, split_archives)
+from ngenix_demo_task.parser import ParserError, do_task_two
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+def start_workers(address, count):
+    workers = [
+        mp.Process(target=run_worker, args=(address, ),
+                   kwargs={'workers': 1})
+        for _ in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def take_task(address):
+    '''Подключиться к координатору и получить задание, не выполняя его.'''
+    sock = socket.create_connection(address)
+    send_message(sock, {'type': 'ready', 'worker': 'fake'})
+    message, _ = receive_message(sock.makefile('rb'))
+    return sock, message
+
+
+class TestParseAddress:
+    '''parse_address'''
+
+    @pytest.mark.parametrize('address, expected', [
+        ('example.com:80', ('example.com', 80)),
+        ('8000', ('127.0.0.1', 8000)),
+        (':8000', ('127.0.0.1', 8000)),
+    ])
+    def test_ok(self, address, expected):
+        '''возвращает пару (host, port).'''
+        assert parse_address(address) == expected
+
+    def test_bad(self):
+        '''возвращает ошибку ClusterError, если порт не число.'''
+        with pytest.raises(ClusterError):
+            parse_address('localhost:http')
+
+
+class TestMessages:
+    '''send_message, receive_message'''
+
+    def test_ok(self):
+        '''передает заголовок и данные сообщений.'''
+        left, right = socket.socketpair()
+        with left, right:
+            send_message(left, {'type': 'data'}, b'a,b\r\n')
+            send_message(left, {'type': 'result'})
+            stream = right.makefile('rb')
+            assert receive_message(stream) == ({'type': 'data'}, b'a,b\r\n')
+            assert receive_message(stream) == ({'type': 'result'}, b'')
+
+    def test_closed(self):
+        '''возвращает ошибку ClusterError, если соединение закрыто.'''
+        with pytest.raises(ClusterError):
+            receive_message(io.BytesIO(b'\x05\x00'))
+
+
+class TestSplitArchives:
+    '''split_archives'''
+
+    def test_default(self):
+        '''выдает каждый архив отдельным заданием.'''
+        assert split_archives(['a', 'b']) == [['a'], ['b']]
+
+    def test_count(self, tmpdir):
+        '''делит архивы подряд на задания примерно равного размера.'''
+        paths = []
+        for name, size in (('a', 100), ('b', 10), ('c', 10), ('d', 80),
+                           ('e', 1)):
+            path = tmpdir.join(name)
+            path.write(b'x' * size, mode='wb')
+            paths.append(str(path))
+        tasks = split_archives(paths, 2)
+        assert sum(tasks, []) == paths
+        assert [len(x) for x in tasks] == [1, 4]
+        a, b, c, d, e = paths
+        assert split_archives(paths, 4) == [[a], [b, c], [d, e]]
+        assert split_archives(paths, 5) == [[a], [b], [c], [d], [e]]
+
+
+class TestCoordinator:
+    '''Coordinator, run_worker'''
+
+    def expected(self, folder, tmpdir):
+        do_task_two(folder, workers=1)
+        expected = str(tmpdir.mkdir('expected'))
+        for filename in ('vars.csv', 'objects.csv'):
+            shutil.move(os.path.join(folder, filename), expected)
+        return expected
+
+    def assert_same(self, folder, expected):
+        for filename in ('vars.csv', 'objects.csv'):
+            assert filecmp.cmp(os.path.join(folder, filename),
+                               os.path.join(expected, filename),
+                               shallow=False)
+
+    @pytest.mark.parametrize('tasks, workers', [(None, 2), (1, 1)])
+    def test_ok(self, folder, tmpdir, tasks, workers):
+        '''записывает те же результаты, что и do_task_two, и удаляет
+        временные файлы.
+        '''
+        expected = self.expected(folder, tmpdir)
+        messages = []
+        with Coordinator(folder, ('127.0.0.1', 0), tasks,
+                         log=messages.append) as coordinator:
+            processes = start_workers(coordinator.address, workers)
+            assert coordinator.run() == 4
+        for process in processes:
+            process.join(10)
+            assert process.exitcode == 0
+        self.assert_same(folder, expected)
+        assert sorted(os.listdir(folder)) == [
+            '0.zip', '1.zip', 'objects.csv', 'vars.csv'
+        ]
+        assert len(messages) == len(coordinator.tasks)
+
+    def test_retry_disconnected(self, folder, tmpdir):
+        '''выдает повторно задание обработчика, разорвавшего соединение.'''
+        expected = self.expected(folder, tmpdir)
+        messages = []
+        with Coordinator(folder, ('127.0.0.1', 0),
+                         log=messages.append) as coordinator:
+            thread = threading.Thread(target=coordinator.run)
+            thread.start()
+            sock, message = take_task(coordinator.address)
+            assert message['type'] == 'task'
+            sock.close()
+            processes = start_workers(coordinator.address, 1)
+            thread.join(30)
+        for process in processes:
+            process.join(10)
+        self.assert_same(folder, expected)
+        assert 'failed on fake, retrying' in messages[0]
+
+    def test_retry_timeout(self, folder, tmpdir):
+        '''выдает повторно задание, если обработчик не отвечает дольше
+        timeout.
+        '''
+        expected = self.expected(folder, tmpdir)
+        with Coordinator(folder, ('127.0.0.1', 0), timeout=0.2,
+                         retries=1) as coordinator:
+            thread = threading.Thread(target=coordinator.run)
+            thread.start()
+            sock, message = take_task(coordinator.address)
+            processes = start_workers(coordinator.address, 1)
+            thread.join(30)
+            sock.close()
+        for process in processes:
+            process.join(10)
+        self.assert_same(folder, expected)
+
+    @pytest.mark.parametrize('header', [
+        {'type': 'data'},
+        {'type': 'result', 'documents': 'many'},
+        {'type': 'error'},
+        {'type': 'unknown'},
+        [1, 2],
+    ])
+    def test_retry_bad_message(self, folder, tmpdir, header):
+        '''выдает повторно задание обработчика, приславшего некорректное
+        сообщение, и закрывает его соединение.
+        '''
+        expected = self.expected(folder, tmpdir)
+        messages = []
+        with Coordinator(folder, ('127.0.0.1', 0),
+                         log=messages.append) as coordinator:
+            thread = threading.Thread(target=coordinator.run)
+            thread.start()
+            sock, message = take_task(coordinator.address)
+            if isinstance(header, dict):
+                header = dict(header, task=message['task'])
+            send_message(sock, header)
+            assert sock.recv(1) == b''
+            sock.close()
+            processes = start_workers(coordinator.address, 1)
+            thread.join(30)
+            assert not thread.is_alive()
+        for process in processes:
+            process.join(10)
+        self.assert_same(folder, expected)
+        assert 'failed on fake, retrying' in messages[0]
+
+    def test_failed(self, folder):
+        '''прерывает обработку, если задание не выполнено после всех
+        попыток.
+        '''
+        shutil.copy(os.path.join(DATA_DIR, 'corrupted.zip'), folder)
+        messages = []
+        with Coordinator(folder, ('127.0.0.1', 0), retries=1,
+                         log=messages.append) as coordinator:
+            processes = start_workers(coordinator.address, 1)
+            with pytest.raises(ParserError) as excinfo:
+                coordinator.run()
+        for process in processes:
+            process.join(10)
+        assert 'failed after 2 attempts' in str(excinfo.value)
+        assert 'corrupted.zip' in str(excinfo.value)
+        assert len([x for x in messages if 'retrying' in x]) == 1
+        assert not os.path.exists(os.path.join(folder, 'vars.csv'))
+
+    def test_empty(self):
+        '''возвращает ошибку ParserError, если в папке нет zip файлов.'''
+        with pytest.raises(ParserError):
+            Coordinator(os.path.join(DATA_DIR, 'empty'))
+
+
+class TestRunWorker:
+    '''run_worker'''
+
+    def test_pool(self, folder):
+        '''создает один пул процессов на все задания соединения.'''
+        with Coordinator(folder, ('127.0.0.1', 0)) as coordinator:
+            thread = threading.Thread(target=coordinator.run)
+            thread.start()
+            with mock.patch('ngenix_demo_task.cluster.mp.Pool',
+                            wraps=mp.Pool) as pool_mock:
+                assert run_worker(coordinator.address, workers=1) == 2
+            thread.join(30)
+        assert pool_mock.call_count == 1
+
+    def test_missing_archive(self, folder):
+        '''сообщает координатору об ошибке задания с несуществующим архивом
+        и продолжает выполнять задания.
+        '''
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            completed = []
+            thread = threading.Thread(target=lambda: completed.append(
+                run_worker(server.getsockname(), workers=1)))
+            thread.start()
+            sock, _ = server.accept()
+            sock.settimeout(30)
+            with sock:
+                stream = sock.makefile('rb')
+                assert receive_message(stream)[0]['type'] == 'ready'
+                missing = os.path.join(folder, 'missing.zip')
+                send_message(sock, {
+                    'type': 'task', 'task': 0, 'archives': [missing],
+                })
+                message, _ = receive_message(stream)
+                assert message['type'] == 'error'
+                assert 'missing.zip' in message['message']
+                send_message(sock, {
+                    'type': 'task', 'task': 1,
+                    'archives': [os.path.join(folder, '0.zip')],
+                })
+                while message['type'] != 'result':
+                    message, _ = receive_message(stream)
+                assert message == {
+                    'type': 'result', 'task': 1, 'documents': 2,
+                }
+                send_message(sock, {'type': 'done'})
+                thread.join(30)
+        assert completed == [1]
+
+    def test_unavailable(self):
+        '''возвращает ошибку ClusterError, если координатор недоступен.'''
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        sock.close()
+        with pytest.raises(ClusterError) as excinfo:
+            run_worker(address)
+        assert 'is unavailable' in str(excinfo.value)
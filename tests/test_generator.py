@@ -1,12 +1,20 @@
+import filecmp
+import io
+import os
 import os.path
+import re
+import threading
+import zlib
+from random import Random
 from unittest import mock
-from zipfile import ZipFile
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile
 
 import pytest
 
 from ngenix_demo_task.generator import (
-    GeneratorError, XMLGeneratorError, do_task_one, generate_data,
-    generate_zip, render_xml)
+    RENDERERS, GeneratorError, StreamWriter, XMLGeneratorError, archive_name,
+    check_data_options, do_task_one, do_task_one_stream, generate_data,
+    generate_zip, render_xml, render_xml_template)
 
 TESTS_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(TESTS_DIR, 'data')
@@ -28,9 +36,79 @@ class TestGenerateData:
         result_b = generate_data()
         assert result_a != result_b
 
+    @pytest.mark.parametrize('distribution', ['uniform', 'triangular'])
+    def test_options(self, distribution):
+        '''возвращает набор данных в заданных границах.'''
+        for _ in range(100):
+            id, level, objects = generate_data(
+                min_objects=7, max_objects=9, min_level=-5, max_level=-3,
+                distribution=distribution
+            )
+            assert 7 <= len(objects) <= 9
+            assert -5 <= level <= -3
+
+    def test_triangular(self):
+        '''генерирует с треугольным распределением в среднем больше
+        объектов, чем с равномерным, и чаще всего max_objects объектов.
+        '''
+        counts = {}
+        for distribution in ('uniform', 'triangular'):
+            rng = Random(0)
+            counts[distribution] = [
+                len(generate_data(distribution=distribution, rng=rng)[2])
+                for _ in range(2000)
+            ]
+        assert sum(counts['triangular']) > sum(counts['uniform']) * 1.1
+        triangular = counts['triangular']
+        assert max(set(triangular), key=triangular.count) == 10
+        assert min(triangular) >= 1
+
+    def test_seeded(self):
+        '''возвращает одинаковые наборы данных при одинаковом начальном
+        значении генератора случайных чисел.
+        '''
+        rng_a, rng_b = Random(42), Random(42)
+        result_a = [generate_data(rng=rng_a) for _ in range(10)]
+        result_b = [generate_data(rng=rng_b) for _ in range(10)]
+        assert result_a == result_b
+        assert len(set(x[0] for x in result_a)) == 10
+        for id, level, objects in result_a:
+            assert re.fullmatch('[0-9a-f]{32}', id)
+            assert 1 <= level <= 100
+            assert 1 <= len(objects) <= 10
+            for name in objects:
+                assert re.fullmatch('[0-9a-f]{32}', name)
+        assert generate_data(rng=Random(43)) != result_a[0]
+
+
+class TestCheckDataOptions:
+    '''check_data_options'''
+
+    def test_ok(self):
+        '''не возвращает ошибки, если параметры корректны.'''
+        check_data_options(min_objects=5, max_objects=5, min_level=0,
+                           max_level=0, distribution='triangular')
+
+    @pytest.mark.parametrize('options', [
+        {'min_objects': 0},
+        {'min_objects': 11},
+        {'max_objects': 11},
+        {'min_level': 101},
+        {'distribution': 'normal'},
+    ])
+    def test_bad_options(self, options):
+        '''возвращает ошибку GeneratorError, если параметры некорректны.'''
+        with pytest.raises(GeneratorError):
+            check_data_options(**options)
+
 
 class TestRenderXML:
-    '''render_xml'''
+    '''render_xml, render_xml_template'''
+
+    @pytest.fixture(params=sorted(RENDERERS))
+    def render(self, request):
+        '''Фикстура способа формирования xml документа.'''
+        return RENDERERS[request.param]
 
     @pytest.fixture
     def data(self):
@@ -52,21 +130,39 @@ class TestRenderXML:
         )
         return document
 
-    def test_ok(self, data, document):
+    def test_ok(self, render, data, document):
         '''генерирует содержимое xml документа согласно переданным аргументам.
         '''
-        render = render_xml(*data)
-        assert render == document
+        result = render(*data)
+        assert result == document
 
-    def test_empty_objects(self, data, document):
+    def test_empty_objects(self, render, data, document):
         '''возвращает ошибку ValueError в случае, если в качестве параметра
         objects передан пустой итерируемый объект.
         '''
         data = ('helloworld', 42, [])
         with pytest.raises(XMLGeneratorError) as excinfo:
-            render_xml(*data)
+            render(*data)
         assert str(excinfo.value) == 'Document must have at least one object'
 
+    @pytest.mark.parametrize('value', [
+        '&<>"\'', '\t\n\r', ']]>', 'é\u2028\U0001F600', '\x7f\x85', 0,
+    ])
+    def test_escaping(self, value):
+        '''экранирует значения атрибутов одинаково при любом способе
+        формирования.
+        '''
+        data = (value, value, [value, value])
+        assert render_xml_template(*data) == render_xml(*data)
+
+    @pytest.mark.parametrize('value', ['\x00', '\x1f', '\ufffe'])
+    def test_invalid_chars(self, render, value):
+        '''возвращает ошибку ValueError, если значение недопустимо в xml
+        документе.
+        '''
+        with pytest.raises(ValueError):
+            render('helloworld', 42, [value])
+
 
 class TestGenerateZIP:
     '''generate_zip'''
@@ -91,14 +187,15 @@ class TestGenerateZIP:
         )
         return document
 
+    @pytest.mark.parametrize('renderer', sorted(RENDERERS))
     @mock.patch('ngenix_demo_task.generator.generate_data')
-    def test_ok(self, data_mock, tmpdir, data, document):
+    def test_ok(self, data_mock, tmpdir, data, document, renderer):
         '''генерирует валидный zip архив с данными полученными из
         generate_data.
         '''
         data_mock.return_value = data
         path = str(tmpdir.mkdir('archives').join('test.zip'))
-        generate_zip(path, xml_documents_quantity=2)
+        generate_zip(path, xml_documents_quantity=2, renderer=renderer)
         control = os.path.join(DATA_DIR, 'test.zip')
         test_info, control_info = [], []
         with ZipFile(path, 'r') as test_zip:
@@ -108,18 +205,123 @@ class TestGenerateZIP:
         for info_a, info_b in zip(test_info, control_info):
             assert info_a.CRC == info_b.CRC
 
+    @pytest.mark.parametrize('compression, compresslevel, compress_type', [
+        ('stored', None, ZIP_STORED),
+        ('deflated', 1, ZIP_DEFLATED),
+        ('bzip2', 1, ZIP_BZIP2),
+        ('lzma', None, ZIP_LZMA),
+    ])
+    def test_compression(self, tmpdir, compression, compresslevel,
+                         compress_type):
+        '''генерирует zip архив с заданным методом сжатия.'''
+        path = str(tmpdir.mkdir('archives').join('test.zip'))
+        generate_zip(path, xml_documents_quantity=3, compression=compression,
+                     compresslevel=compresslevel,
+                     data_options={'min_objects': 2, 'max_objects': 2})
+        with ZipFile(path, 'r') as archive:
+            infos = archive.infolist()
+            assert len(infos) == 3
+            for info in infos:
+                assert info.compress_type == compress_type
+                content = archive.read(info)
+                assert content.count(b'<object ') == 2
+
+    def test_stream(self):
+        '''записывает zip архив в поток без перемещения по нему.'''
+        stream = mock.Mock(wraps=io.BytesIO(), spec=['write', 'flush'])
+        generate_zip(stream, xml_documents_quantity=3,
+                     compression='deflated', buffer_size=1)
+        content = stream._mock_wraps.getvalue()
+        with ZipFile(io.BytesIO(content), 'r') as archive:
+            assert archive.namelist() == ['0.xml', '1.xml', '2.xml']
+            assert archive.testzip() is None
+
+    def test_fifo(self, tmpdir):
+        '''записывает zip архив в именованный канал.'''
+        path = str(tmpdir.join('test.zip'))
+        os.mkfifo(path)
+        chunks = []
+
+        def read():
+            with open(path, 'rb') as fifo:
+                chunks.append(fifo.read())
+        reader = threading.Thread(target=read)
+        reader.start()
+        generate_zip(path, xml_documents_quantity=2, seed=1)
+        reader.join()
+        with ZipFile(io.BytesIO(chunks[0]), 'r') as archive:
+            assert archive.testzip() is None
+
+    def test_overwrite(self, tmpdir):
+        '''возвращает ошибку GeneratorError, если архив существует и
+        перезаписывать его нельзя.
+        '''
+        path = tmpdir.join('test.zip')
+        path.write(b'old', mode='wb')
+        with pytest.raises(GeneratorError) as excinfo:
+            generate_zip(str(path), xml_documents_quantity=2, overwrite=False)
+        assert 'already exists' in str(excinfo.value)
+        assert path.read(mode='rb') == b'old'
+        generate_zip(str(path), xml_documents_quantity=2)
+        assert path.read(mode='rb') != b'old'
+
+    @pytest.mark.parametrize('error', [
+        IOError('Test'), ValueError('Test'), zlib.error('Test'),
+    ])
     @mock.patch('ngenix_demo_task.generator.ZipFile')
-    def test_system_error(self, zip_mock, tmpdir):
+    def test_system_error(self, zip_mock, tmpdir, error):
         '''возвращает ошибку GeneratorError, если при записи zip файла возникла
-        системная ошибка.
+        системная ошибка или ошибка сжатия.
         '''
-        zip_mock.side_effect = IOError('Test')
+        zip_mock.side_effect = error
         path = str(tmpdir.mkdir('archives').join('test.zip'))
         with pytest.raises(GeneratorError) as excinfo:
             generate_zip(path, xml_documents_quantity=2)
         assert 'Test' in str(excinfo.value)
 
 
+class TestStreamWriter:
+    '''StreamWriter'''
+
+    def test_buffer(self):
+        '''передает данные в поток блоками не меньше размера буфера.'''
+        stream = mock.Mock(wraps=io.BytesIO())
+        output = StreamWriter(stream, buffer_size=4)
+        for data in (b'ab', b'cd', b'e', b'f'):
+            output.write(data)
+        assert output.tell() == 6
+        assert stream.write.call_count == 1
+        output.flush()
+        assert stream.write.call_count == 2
+        assert stream._mock_wraps.getvalue() == b'abcdef'
+
+    def test_partial_write(self):
+        '''дописывает данные, если поток записал их не полностью.'''
+        chunks = []
+
+        def write(data):
+            chunks.append(bytes(data[:2]))
+            return len(chunks[-1])
+        output = StreamWriter(mock.Mock(write=write), buffer_size=10)
+        output.write(b'abcde')
+        output.flush()
+        assert chunks == [b'ab', b'cd', b'e']
+
+
+class TestArchiveName:
+    '''archive_name'''
+
+    @pytest.mark.parametrize('archive_number, quantity, expected', [
+        (0, 1, '0.zip'),
+        (7, 10, '7.zip'),
+        (7, 11, '07.zip'),
+        (42, 1000, '042.zip'),
+    ])
+    def test_ok(self, archive_number, quantity, expected):
+        '''дополняет номер архива нулями до ширины наибольшего номера.'''
+        assert archive_name(archive_number, quantity) == expected
+
+
 class TestDoTaskOne:
     '''do_task_one'''
 
@@ -129,8 +331,98 @@ class TestDoTaskOne:
         '''
         zip_mock.return_value = None
         path = str(tmpdir.mkdir('archives'))
-        do_task_one(path, quantity=50)
+        do_task_one(path, quantity=50, workers=1)
         assert zip_mock.call_count == 50
         args, kwargs = zip_mock.call_args
         assert path in args[0]
         assert 'zip' in args[0]
+        args, kwargs = zip_mock.call_args_list[0]
+        assert args[0] == os.path.join(path, '00.zip')
+
+    def test_options(self, tmpdir):
+        '''генерирует набор zip архивов заданной формы.'''
+        path = str(tmpdir.mkdir('archives'))
+        do_task_one(path, quantity=2, workers=1, documents=5,
+                    compression='deflated',
+                    data_options={'min_objects': 3, 'max_objects': 3})
+        assert sorted(os.listdir(path)) == ['0.zip', '1.zip']
+        with ZipFile(os.path.join(path, '0.zip'), 'r') as archive:
+            assert len(archive.namelist()) == 5
+            assert archive.read('4.xml').count(b'<object ') == 3
+
+    @pytest.mark.parametrize('options', [
+        {'compression': 'zstd'},
+        {'compression': 'deflated', 'compresslevel': 42},
+        {'compression': 'bzip2', 'compresslevel': 0},
+        {'compression': 'stored', 'compresslevel': 1},
+        {'compression': 'lzma', 'compresslevel': 1},
+        {'data_options': {'min_objects': 2, 'max_objects': 1}},
+    ])
+    def test_bad_options(self, tmpdir, options):
+        '''возвращает ошибку GeneratorError, если параметры некорректны.'''
+        path = str(tmpdir.mkdir('archives'))
+        with pytest.raises(GeneratorError):
+            do_task_one(path, quantity=1, workers=1, **options)
+        assert os.listdir(path) == []
+
+    def test_existing(self, tmpdir):
+        '''возвращает ошибку GeneratorError и не перезаписывает архивы, если
+        архив с именем из набора уже существует.
+        '''
+        path = str(tmpdir.mkdir('archives'))
+        do_task_one(path, quantity=2, workers=1, documents=5, seed=1)
+        tmpdir.join('archives', '0.zip').write(b'old', mode='wb')
+        with pytest.raises(GeneratorError) as excinfo:
+            do_task_one(path, quantity=2, workers=1, documents=5, seed=2)
+        assert 'already exists' in str(excinfo.value)
+        assert tmpdir.join('archives', '0.zip').read(mode='rb') == b'old'
+        assert sorted(os.listdir(path)) == ['0.zip', '1.zip']
+
+    def test_seeded(self, tmpdir):
+        '''генерирует побайтно одинаковые наборы архивов при одинаковом
+        начальном значении генератора случайных чисел независимо от
+        количества процессов.
+        '''
+        paths = [str(tmpdir.mkdir(name)) for name in ('a', 'b', 'c')]
+        do_task_one(paths[0], quantity=3, workers=1, documents=10, seed=7)
+        do_task_one(paths[1], quantity=3, workers=2, documents=10, seed=7)
+        do_task_one(paths[2], quantity=3, workers=1, documents=10, seed=8)
+        filenames = ['0.zip', '1.zip', '2.zip']
+        match, mismatch, errors = filecmp.cmpfiles(
+            paths[0], paths[1], filenames, shallow=False
+        )
+        assert match == filenames
+        match, mismatch, errors = filecmp.cmpfiles(
+            paths[0], paths[2], filenames, shallow=False
+        )
+        assert mismatch == filenames
+        assert not filecmp.cmp(os.path.join(paths[0], '0.zip'),
+                               os.path.join(paths[0], '1.zip'),
+                               shallow=False)
+
+    def test_stream(self, tmpdir):
+        '''do_task_one_stream записывает в поток первый архив набора.'''
+        path = str(tmpdir)
+        do_task_one(path, quantity=2, workers=1, documents=5, seed=3)
+        stream = io.BytesIO()
+        do_task_one_stream(stream, documents=5, seed=3)
+        with open(os.path.join(path, '0.zip'), 'rb') as archive:
+            assert stream.getvalue() == archive.read()
+
+    def test_stream_bad_options(self):
+        '''do_task_one_stream возвращает ошибку GeneratorError, если
+        параметры некорректны.
+        '''
+        stream = io.BytesIO()
+        with pytest.raises(GeneratorError):
+            do_task_one_stream(stream, compression='zstd')
+        assert stream.getvalue() == b''
+
+    def test_workers(self, tmpdir):
+        '''генерирует zip архивы в пуле процессов.'''
+        path = str(tmpdir.mkdir('archives'))
+        do_task_one(path, quantity=3, workers=2)
+        assert sorted(os.listdir(path)) == ['0.zip', '1.zip', '2.zip']
+        for filename in os.listdir(path):
+            with ZipFile(os.path.join(path, filename), 'r') as archive:
+                assert len(archive.namelist()) == 100
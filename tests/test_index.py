@@ -0,0 +1,44 @@
+import uuid
+
+from ngenix_demo_task.index import IdIndex, id_digests, iter_digests
+
+
+class TestDigests:
+    '''id_digests, iter_digests'''
+
+    def test_ok(self):
+        '''вычисляет 128-битные хеши id.'''
+        digests = id_digests(['a', 'b', 'a'])
+        assert len(digests) == 3 * 16
+        pairs = list(iter_digests(digests))
+        assert pairs[0] == pairs[2] != pairs[1]
+        assert list(iter_digests(id_digests([]))) == []
+
+
+class TestIdIndex:
+    '''IdIndex'''
+
+    def test_add(self):
+        '''сообщает, был ли хеш в множестве.'''
+        index = IdIndex()
+        assert index.add(1, 2) is True
+        assert index.add(1, 2) is False
+        assert index.add(2, 1) is True
+        assert len(index) == 2
+
+    def test_zero(self):
+        '''принимает нулевой хеш, обозначающий пустую ячейку.'''
+        index = IdIndex()
+        assert index.add(0, 0) is True
+        assert index.add(0, 0) is False
+        assert len(index) == 1
+
+    def test_grow(self):
+        '''увеличивает таблицу, сохраняя добавленные хеши.'''
+        index = IdIndex(capacity=4)
+        ids = [uuid.uuid4().hex for _ in range(1000)]
+        digests = list(iter_digests(id_digests(ids)))
+        assert all(index.add(*x) for x in digests)
+        assert not any(index.add(*x) for x in digests)
+        assert len(index) == 1000
+        assert 1000 <= 3 * len(index.slots) // 8
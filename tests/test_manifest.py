@@ -0,0 +1,193 @@
+import csv
+import json
+import os.path
+from unittest import mock
+
+import pytest
+
+from ngenix_demo_task.generator import generate_zip
+from ngenix_demo_task.manifest import (
+    STATE_DIR, do_task_two_incremental, load_manifest, plan_update,
+    save_manifest)
+from ngenix_demo_task.parser import ParserError, do_task_two, parse_archives
+
+
+def read_csv(path, filename):
+    with open(os.path.join(path, filename), 'r') as csvfile:
+        return list(csv.reader(csvfile))
+
+
+class TestDoTaskTwoIncremental:
+    '''do_task_two_incremental'''
+
+    @pytest.fixture
+    def folder(self, tmpdir):
+        '''Фикстура папки с воспроизводимыми zip архивами.'''
+        folder = str(tmpdir.mkdir('archives'))
+        for number in range(3):
+            path = os.path.join(folder, '{}.zip'.format(number))
+            generate_zip(path, xml_documents_quantity=5, seed=number)
+        return folder
+
+    def expected(self, folder, tmpdir):
+        '''Результат полной обработки архивов папки do_task_two.'''
+        control = str(tmpdir.mkdir('control'))
+        for filename in os.listdir(folder):
+            if filename.endswith('.zip'):
+                os.link(os.path.join(folder, filename),
+                        os.path.join(control, filename))
+        do_task_two(control, workers=1)
+        return (read_csv(control, 'vars.csv'),
+                read_csv(control, 'objects.csv'))
+
+    def result(self, folder):
+        return (read_csv(folder, 'vars.csv'), read_csv(folder, 'objects.csv'))
+
+    def test_first_run(self, folder, tmpdir):
+        '''при первом запуске формирует те же csv файлы, что и do_task_two.'''
+        do_task_two_incremental(folder, workers=1)
+        assert self.result(folder) == self.expected(folder, tmpdir)
+        archives = load_manifest(folder)
+        assert sorted(archives) == ['0.zip', '1.zip', '2.zip']
+        for entry in archives.values():
+            assert entry['vars'] == 5
+            assert entry['objects'] >= 5
+
+    def test_unchanged(self, folder):
+        '''не разбирает архивы повторно, если они не изменились.'''
+        do_task_two_incremental(folder, workers=1)
+        before = self.result(folder)
+        with mock.patch('ngenix_demo_task.manifest.parse_archives') as parse:
+            do_task_two_incremental(folder, workers=1)
+        assert parse.call_count == 0
+        assert self.result(folder) == before
+
+    def test_added(self, folder, tmpdir):
+        '''разбирает только новые архивы и дописывает их строки.'''
+        do_task_two_incremental(folder, workers=1)
+        generate_zip(os.path.join(folder, '3.zip'), 5, seed=3)
+        with mock.patch('ngenix_demo_task.manifest.parse_archives',
+                        wraps=parse_archives) as parse:
+            do_task_two_incremental(folder, workers=1)
+        args, kwargs = parse.call_args
+        assert args[0] == [os.path.join(folder, '3.zip')]
+        assert self.result(folder) == self.expected(folder, tmpdir)
+
+    def test_deleted(self, folder, tmpdir):
+        '''удаляет строки удаленных архивов.'''
+        do_task_two_incremental(folder, workers=1)
+        os.remove(os.path.join(folder, '1.zip'))
+        do_task_two_incremental(folder, workers=1)
+        assert self.result(folder) == self.expected(folder, tmpdir)
+        assert sorted(load_manifest(folder)) == ['0.zip', '2.zip']
+        parts = os.listdir(os.path.join(folder, STATE_DIR, 'parts'))
+        assert len(parts) == 4
+
+    def test_modified(self, folder, tmpdir):
+        '''разбирает повторно измененные архивы.'''
+        do_task_two_incremental(folder, workers=1)
+        generate_zip(os.path.join(folder, '0.zip'), 7, seed=10)
+        do_task_two_incremental(folder, workers=1)
+        vars, objects = self.result(folder)
+        assert len(vars) == 1 + 7 + 5 + 5
+        assert (vars, objects) == self.expected(folder, tmpdir)
+
+    def test_renamed(self, folder, tmpdir):
+        '''не разбирает повторно переименованные архивы.'''
+        do_task_two_incremental(folder, workers=1)
+        os.rename(os.path.join(folder, '0.zip'),
+                  os.path.join(folder, '9.zip'))
+        with mock.patch('ngenix_demo_task.manifest.parse_archives') as parse:
+            do_task_two_incremental(folder, workers=1)
+        assert parse.call_count == 0
+        assert self.result(folder) == self.expected(folder, tmpdir)
+
+    @pytest.mark.parametrize('generate', [True, False])
+    def test_interrupted(self, folder, tmpdir, generate):
+        '''не дублирует строки, если запуск прерван после записи csv
+        файлов, но до сохранения манифеста.
+        '''
+        do_task_two_incremental(folder, workers=1)
+        if generate:
+            generate_zip(os.path.join(folder, '3.zip'), 5, seed=3)
+        else:
+            os.remove(os.path.join(folder, '1.zip'))
+
+        def interrupt(path, archives, outputs=None):
+            if outputs is not None:
+                raise ParserError('Test')
+            save_manifest(path, archives)
+
+        with mock.patch('ngenix_demo_task.manifest.save_manifest',
+                        side_effect=interrupt):
+            with pytest.raises(ParserError):
+                do_task_two_incremental(folder, workers=1)
+        do_task_two_incremental(folder, workers=1)
+        assert self.result(folder) == self.expected(folder, tmpdir)
+
+    def test_outputs_truncated(self, folder, tmpdir):
+        '''пересобирает csv файлы, если они короче записанных в манифесте.
+        '''
+        do_task_two_incremental(folder, workers=1)
+        with open(os.path.join(folder, 'vars.csv'), 'r+b') as csvfile:
+            csvfile.truncate(10)
+        do_task_two_incremental(folder, workers=1)
+        assert self.result(folder) == self.expected(folder, tmpdir)
+
+    def test_outputs_removed(self, folder, tmpdir):
+        '''пересобирает csv файлы, если они были удалены.'''
+        do_task_two_incremental(folder, workers=1)
+        os.remove(os.path.join(folder, 'objects.csv'))
+        do_task_two_incremental(folder, workers=1)
+        assert self.result(folder) == self.expected(folder, tmpdir)
+
+    def test_corrupted_manifest(self, folder):
+        '''возвращает ошибку ParserError, если манифест поврежден.'''
+        do_task_two_incremental(folder, workers=1)
+        manifest = os.path.join(folder, STATE_DIR, 'manifest.json')
+        with open(manifest, 'w') as manifest_file:
+            manifest_file.write('{')
+        with pytest.raises(ParserError) as excinfo:
+            do_task_two_incremental(folder, workers=1)
+        assert 'is corrupted' in str(excinfo.value)
+
+    def test_manifest_version(self, folder):
+        '''игнорирует манифест другой версии.'''
+        do_task_two_incremental(folder, workers=1)
+        manifest = os.path.join(folder, STATE_DIR, 'manifest.json')
+        with open(manifest, 'w') as manifest_file:
+            json.dump({'version': 0, 'archives': {}}, manifest_file)
+        assert load_manifest(folder) == {}
+
+
+class TestPlanUpdate:
+    '''plan_update'''
+
+    def test_touched(self, tmpdir):
+        '''не разбирает повторно архив, у которого изменилось только время
+        изменения.
+        '''
+        folder = str(tmpdir.mkdir('archives'))
+        path = os.path.join(folder, '0.zip')
+        generate_zip(path, xml_documents_quantity=1, seed=0)
+        current, added, pending, modified = plan_update([path], {})
+        assert (added, pending, modified) == (['0.zip'], [path], False)
+        os.utime(path, (0, 0))
+        current, added, pending, modified = plan_update([path], current)
+        assert (added, pending, modified) == ([], [], False)
+        assert current['0.zip']['mtime'] == 0
+
+    def test_removed_during_update(self, tmpdir):
+        '''считает удаленным архив, который исчез после получения списка
+        архивов.
+        '''
+        folder = str(tmpdir.mkdir('archives'))
+        paths = [os.path.join(folder, x) for x in ('0.zip', '1.zip')]
+        for path in paths:
+            generate_zip(path, xml_documents_quantity=1, seed=0)
+        current, added, pending, modified = plan_update(paths, {})
+        for path in paths:
+            os.remove(path)
+        result = plan_update(paths, current)
+        assert result == ({}, [], [], True)
+        assert plan_update(paths, {}) == ({}, [], [], False)
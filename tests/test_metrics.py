@@ -0,0 +1,139 @@
+import json
+import os.path
+
+import pytest
+
+from ngenix_demo_task import metrics
+from ngenix_demo_task.generator import do_task_one
+from ngenix_demo_task.parser import do_task_two, parse_archive
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+@pytest.fixture
+def enabled():
+    '''Фикстура включенного сбора метрик.'''
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.enable(False)
+    metrics.reset()
+
+
+class TestMetrics:
+    '''start, stop, count, snapshot, merge'''
+
+    def test_disabled(self):
+        '''не собирает метрики, если сбор выключен.'''
+        metrics.reset()
+        started = metrics.start()
+        assert started is None
+        metrics.stop('stage', started)
+        metrics.count('documents')
+        assert metrics.snapshot() == {'timers': {}, 'counters': {}}
+
+    def test_enabled(self, enabled):
+        '''суммирует время и количество вызовов этапов и счетчики.'''
+        for _ in range(3):
+            metrics.stop('stage', metrics.start())
+        metrics.count('bytes', 10)
+        metrics.count('bytes', 5)
+        snapshot = metrics.snapshot()
+        assert snapshot['timers']['stage'][0] == 3
+        assert snapshot['timers']['stage'][1] >= 0
+        assert snapshot['counters'] == {'bytes': 15}
+
+    def test_merge(self, enabled):
+        '''добавляет метрики другого процесса.'''
+        metrics.count('documents', 2)
+        metrics.merge({
+            'timers': {'stage': [2, 1.5]},
+            'counters': {'documents': 3, 'errors': 1},
+        })
+        metrics.merge({'timers': {'stage': [1, 0.5]}, 'counters': {}})
+        assert metrics.snapshot() == {
+            'timers': {'stage': [3, 2.0]},
+            'counters': {'documents': 5, 'errors': 1},
+        }
+
+    def test_profiled(self, enabled):
+        '''возвращает результат вызова вместе с его метриками.'''
+        def task(value):
+            metrics.count('documents', value)
+            return value * 2
+        results = [metrics.profiled(task, x) for x in (1, 2)]
+        assert results[1] == (4, {'timers': {}, 'counters': {'documents': 2}})
+        metrics.reset()
+        assert list(metrics.collect(results)) == [2, 4]
+        assert metrics.snapshot()['counters'] == {'documents': 3}
+
+
+class TestInstrumentation:
+    '''Сбор метрик парсером и генератором.'''
+
+    def test_parse_archive(self, enabled):
+        '''считает документы, байты и время этапов разбора архива.'''
+        parse_archive(os.path.join(DATA_DIR, 'test.zip'), 'tree')
+        snapshot = metrics.snapshot()
+        assert snapshot['counters']['documents'] == 2
+        assert snapshot['counters']['bytes'] > 0
+        assert snapshot['timers']['xml_parse'][0] == 2
+        assert snapshot['timers']['validate'][0] == 2
+        assert snapshot['timers']['zip_open'][0] == 1
+
+    def test_do_task_two(self, enabled, folder):
+        '''собирает метрики процессов пула.'''
+        do_task_two(folder, workers=2, chunk_size=1)
+        snapshot = metrics.snapshot()
+        assert snapshot['counters']['documents'] == 4
+        assert snapshot['timers']['result_wait'][0] == 4
+        assert snapshot['timers']['encode'][0] == 4
+        assert snapshot['timers']['write'][0] == 4
+
+    def test_do_task_one(self, enabled, tmpdir):
+        '''собирает метрики генерации архивов в процессах пула.'''
+        do_task_one(str(tmpdir), quantity=3, workers=2, documents=5)
+        snapshot = metrics.snapshot()
+        assert snapshot['counters']['archives'] == 3
+        assert snapshot['counters']['documents'] == 15
+        assert snapshot['timers']['render'][0] == 15
+
+
+class TestSave:
+    '''format_table, format_prometheus, save'''
+
+    SNAPSHOT = {
+        'timers': {'xml_parse': [4, 0.5]},
+        'counters': {'documents': 4},
+    }
+
+    def test_table(self):
+        '''формирует таблицу этапов и счетчиков.'''
+        table = metrics.format_table(self.SNAPSHOT, 1.0)
+        assert 'xml_parse' in table
+        assert '125000.0' in table
+        assert 'wall time: 1.000 s' in table
+
+    def test_json(self, tmpdir):
+        '''сохраняет метрики в JSON.'''
+        path = str(tmpdir.join('metrics.json'))
+        metrics.save(path, self.SNAPSHOT, 1.0)
+        with open(path) as json_file:
+            assert json.load(json_file) == dict(self.SNAPSHOT, wall=1.0)
+
+    def test_prometheus(self, tmpdir):
+        '''сохраняет метрики в формате Prometheus.'''
+        path = str(tmpdir.join('metrics.prom'))
+        metrics.save(path, self.SNAPSHOT)
+        with open(path) as prom_file:
+            lines = prom_file.read().splitlines()
+        assert 'ndt_stage_seconds_total{stage="xml_parse"} 0.5' in lines
+        assert 'ndt_stage_calls_total{stage="xml_parse"} 4' in lines
+        assert 'ndt_documents_total 4' in lines
+
+    def test_system_error(self, tmpdir):
+        '''возвращает ошибку MetricsError, если файл не удалось записать.'''
+        path = str(tmpdir.join('missing', 'metrics.json'))
+        with pytest.raises(metrics.MetricsError):
+            metrics.save(path, self.SNAPSHOT)
@@ -1,26 +1,52 @@
+import csv
 import filecmp
+import io
+import json
+import multiprocessing as mp
 import os.path
+import random
+import shutil
+from functools import partial
 from unittest import mock
+from zipfile import ZipFile
 
 import pytest
 
+from ngenix_demo_task import metrics, parser
+from ngenix_demo_task.generator import (
+    COMPRESSIONS, RENDERERS, generate_data, generate_zip)
+from ngenix_demo_task.index import id_digests
 from ngenix_demo_task.parser import (
-    ParserError, XMLParserError, ZIPParserError, do_task_two, parse_archive,
-    parse_xml_file, render_objects_csv, render_vars_csv)
+    ArchiveChunk, CSVWriter, DuplicatesReport, EncodedTable, ParserError,
+    XMLBuffer, XMLParserError, ZIPParserError, do_task_two, encode_result,
+    imap_window, parse_archive, parse_chunk, parse_xml_file, plan_chunks,
+    render_objects_csv, render_vars_csv)
+from ngenix_demo_task.records import Records, Reject
+from ngenix_demo_task.shards import ShardedCSVWriter
 
 TESTS_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(TESTS_DIR, 'data')
 
 
+def read_data(filename):
+    with open(os.path.join(DATA_DIR, filename), 'rb') as data_file:
+        return data_file.read()
+
+
 class TestParseXMLFile:
     '''parse_xml_file'''
 
-    def test_ok(self):
-        '''возвращает словарь с данными разбора, если xml файл валиден.'''
+    @pytest.fixture(params=['tree', 'iter', 'fast'])
+    def xml_parser(self, request):
+        '''Фикстура способа разбора xml документов.'''
+        return request.param
+
+    def test_ok(self, xml_parser):
+        '''возвращает результаты разбора, если xml файл валиден.'''
         path = os.path.join(DATA_DIR, 'good.xml')
         result = {}
         with open(path, 'r') as xml_file:
-            result = parse_xml_file(xml_file)
+            result = parse_xml_file(xml_file, xml_parser)
         expected = {
             'vars': [('helloworld', '42'), ],
             'objects': [
@@ -29,7 +55,7 @@ class TestParseXMLFile:
                 ('helloworld', 'three')
             ]
         }
-        assert result == expected
+        assert result.to_dict() == expected
 
     @pytest.mark.parametrize('filename, message', [
         ('bad_syntax.xml', 'is corrupted'),
@@ -40,26 +66,174 @@ class TestParseXMLFile:
         ('no_objects.xml', 'no elements of type object'),
         ('too_many_objects.xml', 'more than ten elements of type object'),
     ])
-    def test_bad_xml(self, filename, message):
+    def test_bad_xml(self, filename, message, xml_parser):
         '''возвращает ошибку XMLParserError с соответствующим сообщением, если
         файл не соответствует формату.
         '''
         path = os.path.join(DATA_DIR, filename)
         with pytest.raises(XMLParserError) as excinfo:
             with open(path, 'r') as xml_file:
-                parse_xml_file(xml_file)
+                parse_xml_file(xml_file, xml_parser)
+        assert message in str(excinfo.value)
+
+    @pytest.mark.parametrize('document', [
+        b'<root><objects><object name="a"/></objects>'
+        b'<var name="level" value="1"/><var name="id" value="x"/></root>',
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects><object name="a"><object name="b"/></object></objects>'
+        b'<objects><object name="c"/></objects><object name="d"/></root>',
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects><var name="id" value="y"/><object name="a"/></objects>'
+        b'<!-- <object name="b"/> --></root>',
+        b'<?xml version="1.0" encoding="utf-8"?>\n<root>\n'
+        b'  <var name="id" value="x"/>\r\n\t<var name="level" value="1"/>'
+        b'<objects> <object name="a"/> <object name="b"/> </objects></root>\n',
+        b'<root><var name="id" value="a &amp; b"/>'
+        b'<var name="level" value="1"/>'
+        b'<objects><object name="&#x41;"/></objects></root>',
+        b"<root><var name='id' value='x'/><var name=\"level\" value=\"1\"/>"
+        b'<objects><object name="a"/></objects></root>',
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects><object name="a"/><!-- x --></objects></root>',
+        b'<root><var name="id" value="\xd0\xb8\xd0\xb4"/>'
+        b'<var name="level" value="1"/>'
+        b'<objects><object name="\xe2\x80\xa8"/></objects></root>',
+    ])
+    def test_parsers_agree(self, document):
+        '''возвращает одинаковый результат при любом способе разбора.'''
+        tree = parse_xml_file(io.BytesIO(document), 'tree')
+        iter = parse_xml_file(io.BytesIO(document), 'iter')
+        fast = parse_xml_file(io.BytesIO(document), 'fast')
+        assert tree == iter == fast
+        for xml_parser in ('tree', 'iter', 'fast'):
+            buffer = XMLBuffer('test.xml', memoryview(document))
+            assert parse_xml_file(buffer, xml_parser) == tree
+
+    def test_iter_buffer(self):
+        '''разбирает документ в памяти способом iter, не строя полного
+        дерева.
+        '''
+        path = os.path.join(DATA_DIR, 'good.xml')
+        buffer = XMLBuffer('good.xml', read_data('good.xml'))
+        with open(path, 'r') as xml_file:
+            expected = parse_xml_file(xml_file, 'tree')
+        with mock.patch('ngenix_demo_task.parser.etree.fromstring',
+                        side_effect=AssertionError):
+            assert parse_xml_file(buffer, 'iter') == expected
+
+    @pytest.mark.parametrize('document', [
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects></objects></root>',
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects>' + b'<object name="a"/>' * 11 + b'</objects></root>',
+        b'<root><var name="id" value="\xff"/><var name="level" value="1"/>'
+        b'<objects><object name="a"/></objects></root>',
+        b'<root><var name="id" value="\xef\xbf\xbe"/>'
+        b'<var name="level" value="1"/>'
+        b'<objects><object name="a"/></objects></root>',
+        b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+        b'<objects><object name="a"/></objects></root><root/>',
+        b'<root xmlns="urn:x"><var name="id" value="x"/>'
+        b'<var name="level" value="1"/>'
+        b'<objects><object name="a"/></objects></root>',
+        b'<?xml version="1.0" encoding="koi8-r"?>'
+        b'<root><var name="id" value="\xc9"/><var name="level" value="1"/>'
+        b'<objects><object name="a"/></objects></root>',
+    ])
+    def test_fast_errors_agree(self, document):
+        '''возвращает тот же результат или ту же ошибку, что и разбор lxml,
+        если документ отличается от ожидаемой формы.
+        '''
+        try:
+            expected = parse_xml_file(XMLBuffer('test.xml', document), 'iter')
+        except XMLParserError as error:
+            with pytest.raises(XMLParserError) as excinfo:
+                parse_xml_file(XMLBuffer('test.xml', document), 'fast')
+            assert str(excinfo.value) == str(error)
+        else:
+            result = parse_xml_file(XMLBuffer('test.xml', document), 'fast')
+            assert result == expected
+
+    @pytest.mark.parametrize('renderer', sorted(RENDERERS))
+    def test_fast_generated(self, renderer):
+        '''разбирает документы генератора без разбора lxml.'''
+        rng = random.Random(0)
+        metrics.enable()
+        metrics.reset()
+        try:
+            for _ in range(100):
+                document = RENDERERS[renderer](*generate_data(rng=rng))
+                buffer = XMLBuffer('test.xml', document.encode('utf-8'))
+                fast = parse_xml_file(buffer, 'fast')
+                assert fast == parse_xml_file(buffer, 'tree')
+            assert 'fallbacks' not in metrics.snapshot()['counters']
+        finally:
+            metrics.enable(False)
+            metrics.reset()
+
+    def test_fast_fallback(self):
+        '''разбирает документы другой формы способом tree и учитывает их в
+        метриках.
+        '''
+        document = (
+            b'<root><!-- --><var name="id" value="x"/>'
+            b'<var name="level" value="1"/>'
+            b'<objects><object name="a"/></objects></root>'
+        )
+        metrics.enable()
+        metrics.reset()
+        try:
+            with mock.patch('ngenix_demo_task.parser._parse_xml_tree',
+                            wraps=parser._parse_xml_tree) as tree_mock:
+                parse_xml_file(XMLBuffer('test.xml', document), 'fast')
+            assert tree_mock.call_count == 1
+            assert metrics.snapshot()['counters']['fallbacks'] == 1
+        finally:
+            metrics.enable(False)
+            metrics.reset()
+
+    def test_buffer_bad_syntax(self, xml_parser):
+        '''возвращает ошибку XMLParserError с именем файла, если документ в
+        памяти поврежден.
+        '''
+        with pytest.raises(XMLParserError) as excinfo:
+            parse_xml_file(XMLBuffer('test.xml', b'<root>'), xml_parser)
+        assert 'test.xml is corrupted' in str(excinfo.value)
+
+    @pytest.mark.parametrize('document, message', [
+        (b'<root><var name="id"/><var name="level" value="1"/>'
+         b'<objects><object name="a"/></objects></root>',
+         'var element of type id without value'),
+        (b'<root><var name="id" value="x"/><var name="level"/>'
+         b'<objects><object name="a"/></objects></root>',
+         'var element of type level without value'),
+        (b'<root><var name="id" value="x"/><var name="level" value="1"/>'
+         b'<objects><object name="a"/><object/></objects></root>',
+         'element of type object without name'),
+    ])
+    def test_missing_attribute(self, document, message, xml_parser):
+        '''возвращает ошибку XMLParserError, если у элемента нет нужного
+        атрибута.
+        '''
+        with pytest.raises(XMLParserError) as excinfo:
+            parse_xml_file(XMLBuffer('test.xml', document), xml_parser)
         assert message in str(excinfo.value)
 
 
 class TestParseArchive:
     '''parse_archive'''
 
-    def test_ok(self):
-        '''возвращает словарь с данными разбора, если zip архив валиден и
+    @pytest.fixture(params=['zipfile', 'mmap'])
+    def zip_reader(self, request):
+        '''Фикстура способа чтения архива.'''
+        return request.param
+
+    def test_ok(self, zip_reader):
+        '''возвращает результаты разбора, если zip архив валиден и
         соответствует формату.
         '''
         path = os.path.join(DATA_DIR, 'test.zip')
-        result = parse_archive(path)
+        result = parse_archive(path, zip_reader=zip_reader)
         expected = {
             'vars': [('helloworld', '42'), ('helloworld', '42')],
             'objects': [
@@ -71,31 +245,287 @@ class TestParseArchive:
                 ('helloworld', 'three')
             ]
         }
-        assert result == expected
+        assert result.to_dict() == expected
 
-    def test_empty(self):
-        '''возвращает словарь с данными разбора, если zip пуст.'''
+    def test_empty(self, zip_reader):
+        '''возвращает результаты разбора, если zip пуст.'''
         path = os.path.join(DATA_DIR, 'empty.zip')
-        result = parse_archive(path)
+        result = parse_archive(path, zip_reader=zip_reader)
         expected = {
             'vars': [],
             'objects': []
         }
-        assert result == expected
+        assert result.to_dict() == expected
 
     @pytest.mark.parametrize('filename', [
         'corrupted.zip',
         'not_only_xml.zip'
     ])
-    def test_bad_zip(self, filename):
+    def test_bad_zip(self, filename, zip_reader):
         '''возвращает ошибку XMLParserError с соответствующим сообщением, если
         файл не соответствует формату.
         '''
         path = os.path.join(DATA_DIR, filename)
         with pytest.raises(ZIPParserError) as excinfo:
-            parse_archive(path)
+            parse_archive(path, zip_reader=zip_reader)
         assert 'is corrupted' in str(excinfo.value)
 
+    def test_skip_member(self, zip_reader):
+        '''пропускает файлы, не являющиеся xml, и возвращает остальные
+        результаты, если ошибки пропускаются.
+        '''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        result = parse_archive(path, zip_reader=zip_reader, on_error='skip')
+        assert len(result) == 2
+        assert [x.kind for x in result.rejects] == ['member']
+        assert result.rejects[0].archive == path
+
+    def test_skip_xml(self, tmpdir, zip_reader):
+        '''пропускает документы, не соответствующие формату, если ошибки
+        пропускаются.
+        '''
+        path = str(tmpdir.join('test.zip'))
+        with ZipFile(path, 'w') as archive:
+            archive.writestr('1.xml', read_data('good.xml'))
+            archive.writestr('2.xml', read_data('no_var_id.xml'))
+            archive.writestr('3.xml', read_data('bad_syntax.xml'))
+            archive.writestr('4.xml', read_data('good.xml'))
+        result = parse_archive(path, zip_reader=zip_reader, on_error='skip')
+        assert len(result) == 2
+        assert [(x.kind, x.member) for x in result.rejects] == [
+            ('xml', '2.xml'), ('xml', '3.xml')
+        ]
+        assert 'no var element of type id' in result.rejects[0].message
+
+    def test_skip_zip(self, zip_reader):
+        '''отклоняет поврежденный архив целиком, если ошибки пропускаются.
+        '''
+        path = os.path.join(DATA_DIR, 'corrupted.zip')
+        result = parse_archive(path, zip_reader=zip_reader, on_error='skip')
+        assert len(result) == 0
+        assert result.rejects == [Reject('zip', path, None, mock.ANY)]
+
+    @pytest.mark.parametrize('compression', sorted(COMPRESSIONS))
+    def test_compression(self, tmpdir, compression):
+        '''возвращает одинаковые результаты при любом способе чтения и
+        сжатия архива.
+        '''
+        path = str(tmpdir.join('test.zip'))
+        generate_zip(path, 10, compression=compression, seed=0)
+        expected = parse_archive(path, zip_reader='zipfile')
+        assert len(expected) == 10
+        assert parse_archive(path, zip_reader='mmap') == expected
+        assert parse_archive(path, zip_reader='mmap', start=3, stop=5) == (
+            parse_archive(path, zip_reader='zipfile', start=3, stop=5)
+        )
+
+    @pytest.mark.parametrize('content', [b'', b'PK\x03\x04'])
+    def test_mmap_empty_file(self, tmpdir, content):
+        '''возвращает ошибку ZIPParserError, если файл архива пуст или
+        обрезан.
+        '''
+        path = tmpdir.join('test.zip')
+        path.write_binary(content)
+        with pytest.raises(ZIPParserError):
+            parse_archive(str(path), zip_reader='mmap')
+
+    @pytest.mark.parametrize('compression', ['stored', 'deflated'])
+    def test_mmap_bad_crc(self, tmpdir, compression):
+        '''возвращает ошибку ZIPParserError, если данные файла архива
+        повреждены.
+        '''
+        path = str(tmpdir.join('test.zip'))
+        generate_zip(path, 1, compression=compression, seed=0)
+        with ZipFile(path) as archive:
+            info = archive.infolist()[0]
+        with open(path, 'r+b') as stream:
+            stream.seek(info.header_offset + 30 + len(info.filename) + 20)
+            byte = stream.read(1)
+            stream.seek(-1, os.SEEK_CUR)
+            stream.write(bytes([byte[0] ^ 0xff]))
+        with pytest.raises(ZIPParserError):
+            parse_archive(path, zip_reader='mmap')
+
+    @pytest.mark.parametrize('xml_parser', ['tree', 'iter', 'fast'])
+    def test_skip_missing_attribute(self, tmpdir, xml_parser):
+        '''пропускает документ без атрибута name у элемента object.'''
+        path = str(tmpdir.join('test.zip'))
+        with ZipFile(path, 'w') as archive:
+            archive.writestr('bad.xml', (
+                '<root><var name="id" value="x"/><var name="level" '
+                'value="1"/><objects><object/></objects></root>'
+            ))
+        result = parse_archive(path, xml_parser, on_error='skip')
+        assert len(result) == 0
+        assert [x.kind for x in result.rejects] == ['xml']
+        assert 'without name' in result.rejects[0].message
+
+    def corrupt_member(self, path, compression):
+        generate_zip(path, 1, compression=compression, seed=0)
+        with ZipFile(path) as archive:
+            info = archive.infolist()[0]
+        with open(path, 'r+b') as stream:
+            stream.seek(info.header_offset + 30 + len(info.filename))
+            stream.write(b'\xff' * min(info.compress_size, 64))
+
+    @pytest.mark.parametrize('compression', ['deflated', 'bzip2', 'lzma'])
+    @pytest.mark.parametrize('xml_parser', ['tree', 'iter', 'fast'])
+    def test_bad_compressed_data(self, tmpdir, compression, xml_parser,
+                                 zip_reader):
+        '''добавляет в rejects запись zip или возвращает ошибку
+        ZIPParserError, если сжатые данные файла архива повреждены.
+        '''
+        path = str(tmpdir.join('test.zip'))
+        self.corrupt_member(path, compression)
+        result = parse_archive(path, xml_parser, zip_reader=zip_reader,
+                               on_error='skip')
+        assert [x.kind for x in result.rejects] == ['zip']
+        with pytest.raises(ZIPParserError):
+            parse_archive(path, xml_parser, zip_reader=zip_reader)
+
+
+class TestPlanChunks:
+    '''plan_chunks'''
+
+    @pytest.mark.parametrize('chunk_size, expected', [
+        (1, [(0, 1), (1, 2)]),
+        (159, [(0, 1), (1, 2)]),
+        (160, [(0, 2)]),
+        (1024 * 1024, [(0, 2)]),
+    ])
+    def test_ok(self, chunk_size, expected):
+        '''разбивает архивы на части согласно размерам файлов в архиве.'''
+        paths = [
+            os.path.join(DATA_DIR, 'test.zip'),
+            os.path.join(DATA_DIR, 'empty.zip'),
+        ]
+        chunks = list(plan_chunks(paths, chunk_size))
+        assert chunks == [
+            ArchiveChunk(paths[0], start, stop) for start, stop in expected
+        ]
+
+    def test_bad_zip(self):
+        '''возвращает ошибку ZIPParserError, если архив поврежден.'''
+        path = os.path.join(DATA_DIR, 'corrupted.zip')
+        with pytest.raises(ZIPParserError) as excinfo:
+            list(plan_chunks([path]))
+        assert 'is corrupted' in str(excinfo.value)
+
+    def test_bad_zip_skip(self):
+        '''передает поврежденный архив одной частью, если ошибки
+        пропускаются.
+        '''
+        path = os.path.join(DATA_DIR, 'corrupted.zip')
+        assert list(plan_chunks([path], on_error='skip')) == [
+            ArchiveChunk(path, 0, None)
+        ]
+
+
+class TestParseChunk:
+    '''parse_chunk'''
+
+    def test_ok(self):
+        '''возвращает результаты разбора части архива.'''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        result = parse_chunk(ArchiveChunk(path, 1, 2))
+        expected = {
+            'vars': [('helloworld', '42')],
+            'objects': [
+                ('helloworld', 'one'),
+                ('helloworld', 'two'),
+                ('helloworld', 'three')
+            ]
+        }
+        assert result.to_dict() == expected
+
+    def test_encode(self):
+        '''возвращает результат, закодированный в csv, если передан флаг
+        encode.
+        '''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        result = parse_chunk(ArchiveChunk(path, 1, 2), encode=True)
+        assert result['vars'] == EncodedTable(1, b'helloworld,42\r\n')
+        assert result['objects'].rows == 3
+
+    def test_bad_zip(self):
+        '''возвращает ошибку ZIPParserError, если часть архива содержит не
+        только xml файлы.
+        '''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        with pytest.raises(ZIPParserError):
+            parse_chunk(ArchiveChunk(path, 1, 3))
+
+    def test_digest(self):
+        '''передает хеши id с закодированным результатом, если передан флаг
+        digest.
+        '''
+        path = os.path.join(DATA_DIR, 'not_only_xml.zip')
+        result = parse_chunk(ArchiveChunk(path, 1, 2), encode=True,
+                             digest=True)
+        assert result['digests'] == id_digests(['helloworld'])
+        result = parse_chunk(ArchiveChunk(path, 1, 2), digest=True)
+        assert isinstance(result, Records)
+
+
+class TestEncodeResult:
+    '''encode_result'''
+
+    def test_ok(self):
+        '''кодирует строки таблиц в csv с экранированием.'''
+        records = Records()
+        records.append('hello', '42', ['a,b', 'ы'])
+        result = encode_result(records)
+        assert result == {
+            'vars': EncodedTable(1, b'hello,42\r\n'),
+            'objects': EncodedTable(
+                2, 'hello,"a,b"\r\nhello,ы\r\n'.encode('utf-8')
+            ),
+            'rejects': [],
+        }
+
+    def test_empty(self):
+        '''возвращает пустые буферы для пустых таблиц.'''
+        result = encode_result(Records())
+        assert result == {
+            'vars': EncodedTable(0, b''), 'objects': EncodedTable(0, b''),
+            'rejects': [],
+        }
+
+
+class TestCSVWriter:
+    '''CSVWriter'''
+
+    def test_ok(self, tmpdir):
+        '''записывает одинаковые csv файлы для закодированных и
+        незакодированных результатов.
+        '''
+        path = str(tmpdir)
+        result = Records()
+        result.append('hello', '42', ['one'])
+        result.append('world', '42', ['a,b', 'two'])
+        expected = {
+            'vars.csv': b'id,level\r\nhello,42\r\nworld,42\r\n',
+            'objects.csv': b'id,object_name\r\nhello,one\r\n'
+                           b'world,"a,b"\r\nworld,two\r\n',
+        }
+        for encoded in (result, encode_result(result)):
+            with CSVWriter(path) as output:
+                output.write(encoded)
+            for filename, content in expected.items():
+                with open(os.path.join(path, filename), 'rb') as csvfile:
+                    assert csvfile.read() == content
+
+    @mock.patch('ngenix_demo_task.parser.open')
+    def test_system_error(self, open_mock, tmpdir):
+        '''возвращает ошибку ParserError, если при открытии csv файла
+        возникла системная ошибка.
+        '''
+        open_mock.side_effect = IOError('Test')
+        with pytest.raises(ParserError) as excinfo:
+            with CSVWriter(str(tmpdir)):
+                pass
+        assert 'Test' in str(excinfo.value)
+
 
 class TestRenderVarsCSV:
     '''render_vars_csv'''
@@ -150,34 +580,26 @@ class TestRenderObjectsCSV:
 class TestDoTaskTwo:
     '''do_task_two'''
 
-    @mock.patch('ngenix_demo_task.parser.render_vars_csv')
-    @mock.patch('ngenix_demo_task.parser.render_objects_csv')
-    def test_ok(self, objects_mock, vars_mock):
+    @pytest.mark.parametrize('window, workers, chunk_size', [
+        (None, None, 1024 * 1024),
+        (1, 1, 1024 * 1024),
+        (None, 2, 1),
+    ])
+    def test_ok(self, folder, window, workers, chunk_size):
         '''обрабатывает содержимое папки с zip архивами согласно заданию №2.'''
-        path = os.path.join(DATA_DIR, 'good')
-        objects_mock.return_value = None
-        vars_mock.return_value = None
-        do_task_two(path)
-        vars = [
-            ('helloworld', '42'), ('helloworld', '42'), ('helloworld', '42'),
-            ('helloworld', '42')
-        ]
-        assert vars_mock.call_count == 1
-        args, kwargs = vars_mock.call_args
-        assert path in args
-        assert vars in args
-        objects = [
-            ('helloworld', 'one'), ('helloworld', 'two'),
-            ('helloworld', 'three'), ('helloworld', 'one'),
-            ('helloworld', 'two'), ('helloworld', 'three'),
-            ('helloworld', 'one'), ('helloworld', 'two'),
-            ('helloworld', 'three'), ('helloworld', 'one'),
-            ('helloworld', 'two'), ('helloworld', 'three')
-        ]
-        assert objects_mock.call_count == 1
-        args, kwargs = objects_mock.call_args
-        assert path in args
-        assert objects in args
+        do_task_two(folder, window=window, workers=workers,
+                    chunk_size=chunk_size)
+        with open(os.path.join(folder, 'vars.csv')) as csvfile:
+            vars = list(csv.reader(csvfile))
+        assert vars[0] == ['id', 'level']
+        assert vars[1:] == [['helloworld', '42']] * 4
+        with open(os.path.join(folder, 'objects.csv')) as csvfile:
+            objects = list(csv.reader(csvfile))
+        assert objects[0] == ['id', 'object_name']
+        assert objects[1:] == [
+            ['helloworld', 'one'], ['helloworld', 'two'],
+            ['helloworld', 'three']
+        ] * 4
 
     def test_empty(self):
         '''вызывает ошибку ParserError, если в папке нет zip файлов.'''
@@ -185,3 +607,168 @@ class TestDoTaskTwo:
         with pytest.raises(ParserError) as excinfo:
             do_task_two(path)
         assert 'No zip files found' in str(excinfo.value)
+
+    def add_bad_archives(self, folder):
+        shutil.copy(os.path.join(DATA_DIR, 'not_only_xml.zip'), folder)
+        shutil.copy(os.path.join(DATA_DIR, 'corrupted.zip'), folder)
+
+    def test_raise(self, folder):
+        '''прерывает обработку, если архив не удалось разобрать.'''
+        self.add_bad_archives(folder)
+        with pytest.raises(ZIPParserError):
+            do_task_two(folder, workers=1)
+        assert not os.path.exists(os.path.join(folder, 'rejects.csv'))
+
+    @pytest.mark.parametrize('chunk_size', [1, 1024 * 1024])
+    def test_skip(self, folder, chunk_size):
+        '''записывает все валидные строки и отчет об отклоненных документах,
+        если ошибки пропускаются.
+        '''
+        self.add_bad_archives(folder)
+        rejected = do_task_two(folder, workers=2, chunk_size=chunk_size,
+                               on_error='skip')
+        assert rejected == {'member': 1, 'zip': 1}
+        with open(os.path.join(folder, 'vars.csv')) as csvfile:
+            assert len(list(csv.reader(csvfile))) == 1 + 4 + 2
+        with open(os.path.join(folder, 'rejects.csv')) as csvfile:
+            rejects = list(csv.reader(csvfile))
+        assert rejects[0] == ['kind', 'archive', 'member', 'message']
+        assert sorted(x[:2] for x in rejects[1:]) == [
+            ['member', 'not_only_xml.zip'], ['zip', 'corrupted.zip']
+        ]
+        assert os.path.exists(os.path.join(folder, 'corrupted.zip'))
+        assert not os.path.exists(os.path.join(folder, 'quarantine'))
+
+    def add_damaged_archive(self, folder):
+        '''Добавить архив, последний файл которого поврежден.'''
+        path = os.path.join(folder, '2.zip')
+        generate_zip(path, 5, compression='deflated', seed=0)
+        with ZipFile(path) as archive:
+            info = archive.infolist()[-1]
+        with open(path, 'r+b') as stream:
+            stream.seek(info.header_offset + 30 + len(info.filename))
+            stream.write(b'\xff' * min(info.compress_size, 64))
+
+    @pytest.mark.parametrize('chunk_size', [1, 1024 * 1024])
+    @pytest.mark.parametrize('duplicates', ['allow', 'drop'])
+    @pytest.mark.parametrize('on_error', ['skip', 'quarantine'])
+    def test_damaged_partway(self, folder, tmpdir, chunk_size, duplicates,
+                             on_error):
+        '''не записывает строки архива, поврежденного после первых файлов.
+        '''
+        self.add_damaged_archive(folder)
+        quarantine = str(tmpdir.join('quarantine'))
+        rejected = do_task_two(folder, workers=2, chunk_size=chunk_size,
+                               on_error=on_error, quarantine=quarantine,
+                               duplicates=duplicates)
+        assert rejected['zip'] == 1
+        with open(os.path.join(folder, 'vars.csv')) as csvfile:
+            vars = list(csv.reader(csvfile))[1:]
+        with open(os.path.join(folder, 'objects.csv')) as csvfile:
+            objects = list(csv.reader(csvfile))[1:]
+        assert set(x[0] for x in vars + objects) == {'helloworld'}
+
+    def test_damaged_partway_stored(self, folder):
+        '''не сохраняет в процессах пула строки архива, поврежденного после
+        первых файлов.
+        '''
+        self.add_damaged_archive(folder)
+        rejected = do_task_two(folder, partial(ShardedCSVWriter, shards=2),
+                               workers=2, chunk_size=1, on_error='skip')
+        assert rejected == {'zip': 1}
+        with open(os.path.join(folder, 'parts.json')) as manifest:
+            assert json.load(manifest)['tables']['vars']['rows'] == 4
+
+    def test_quarantine(self, folder, tmpdir):
+        '''помещает отклоненные файлы и поврежденные архивы в папку
+        карантина.
+        '''
+        self.add_bad_archives(folder)
+        quarantine = str(tmpdir.join('quarantine'))
+        rejected = do_task_two(folder, workers=1, on_error='quarantine',
+                               quarantine=quarantine)
+        assert rejected == {'member': 1, 'zip': 1}
+        with open(os.path.join(folder, 'rejects.csv')) as csvfile:
+            member = [x for x in csv.reader(csvfile) if x[0] == 'member'][0]
+        assert os.path.isfile(
+            os.path.join(quarantine, 'not_only_xml.zip', member[2])
+        )
+        assert os.path.isfile(os.path.join(quarantine, 'corrupted.zip'))
+        assert not os.path.exists(os.path.join(folder, 'corrupted.zip'))
+        assert os.path.exists(os.path.join(folder, 'not_only_xml.zip'))
+
+
+class TestDuplicates:
+    '''DuplicatesReport, do_task_two с проверкой уникальности id'''
+
+    def read(self, folder, filename):
+        with open(os.path.join(folder, filename)) as csvfile:
+            return list(csv.reader(csvfile))[1:]
+
+    @pytest.mark.parametrize('chunk_size', [1, 1024 * 1024])
+    def test_report(self, folder, chunk_size):
+        '''записывает повторные id в duplicates.csv, не изменяя
+        результаты.
+        '''
+        rejected = do_task_two(folder, workers=2, chunk_size=chunk_size,
+                               duplicates='report')
+        assert rejected == {'duplicate': 3}
+        assert len(self.read(folder, 'vars.csv')) == 4
+        assert self.read(folder, 'duplicates.csv') == [
+            ['helloworld', '0.zip'],
+            ['helloworld', '1.zip'],
+            ['helloworld', '1.zip'],
+        ]
+
+    def test_drop(self, folder):
+        '''оставляет в результатах только первое вхождение id.'''
+        rejected = do_task_two(folder, workers=2, chunk_size=1,
+                               duplicates='drop')
+        assert rejected == {'duplicate': 3}
+        assert self.read(folder, 'vars.csv') == [['helloworld', '42']]
+        assert len(self.read(folder, 'objects.csv')) == 3
+        assert len(self.read(folder, 'duplicates.csv')) == 3
+
+    def test_allow(self, folder):
+        '''не проверяет id по умолчанию.'''
+        assert do_task_two(folder, workers=1) == {}
+        assert not os.path.exists(os.path.join(folder, 'duplicates.csv'))
+
+    def test_check(self, tmpdir):
+        '''проверяет id результатов и закодированных результатов с
+        хешами id.
+        '''
+        path = str(tmpdir)
+        first, second = Records(), Records()
+        first.append('a', '1', ['one'])
+        second.append('b', '2', ['two'])
+        second.append('a', '3', ['three'])
+        chunk = ArchiveChunk('a.zip', 0, None)
+        with DuplicatesReport(path, 'report') as index:
+            assert index.check(chunk, first) is first
+            encoded = encode_result(second)
+            encoded['digests'] = id_digests(second.ids)
+            result = index.check(chunk, encoded)
+        assert result['vars'].rows == 2
+        assert 'digests' not in result
+        assert index.count == 1
+        assert self.read(path, 'duplicates.csv') == [['a', 'a.zip']]
+
+    def test_stored(self, folder):
+        '''возвращает ошибку ParserError для результатов, сохраняемых
+        процессами пула.
+        '''
+        with pytest.raises(ParserError):
+            do_task_two(folder, writer=ShardedCSVWriter, duplicates='report')
+
+
+class TestImapWindow:
+    '''imap_window'''
+
+    @pytest.mark.parametrize('window', [1, 2, 10])
+    def test_ok(self, window):
+        '''возвращает результаты в порядке аргументов при любом размере окна.
+        '''
+        with mp.Pool(2) as pool:
+            result = list(imap_window(pool, abs, range(-5, 5), window))
+        assert result == [abs(x) for x in range(-5, 5)]
@@ -0,0 +1,93 @@
+import pickle
+
+import pytest
+
+from ngenix_demo_task.records import Document, Records, encode_csv
+
+
+@pytest.fixture
+def records():
+    '''Фикстура результатов разбора двух документов.'''
+    records = Records()
+    records.append('a', '1', ['one', 'two'])
+    records.append('b', 'ы', ['three'])
+    return records
+
+
+class TestRecords:
+    '''Records'''
+
+    def test_rows(self, records):
+        '''формирует строки таблиц vars и objects из столбцов.'''
+        assert len(records) == 2
+        assert records.to_dict() == {
+            'vars': [('a', '1'), ('b', 'ы')],
+            'objects': [('a', 'one'), ('a', 'two'), ('b', 'three')],
+        }
+        assert records.count('vars') == 2
+        assert records.count('objects') == 3
+
+    def test_extend(self, records):
+        '''добавляет результаты других документов в конец.'''
+        other = Records()
+        other.append('c', '3', ['four'])
+        records.extend(other)
+        assert list(records.vars())[-1] == ('c', '3')
+        assert list(records.objects())[-1] == ('c', 'four')
+        assert list(records.sizes) == [2, 1, 1]
+
+    def test_documents(self, records):
+        '''возвращает результаты по документам.'''
+        records.append('c', '3', [])
+        assert list(records.documents()) == [
+            Document('a', '1', ('one', 'two')),
+            Document('b', 'ы', ('three', )),
+            Document('c', '3', ()),
+        ]
+
+    def test_drop(self, records):
+        '''исключает документы с указанными номерами вместе с объектами.'''
+        records.append('c', '3', ['four'])
+        records.rejects.append('reject')
+        result = records.drop([0, 2])
+        assert result.to_dict() == {
+            'vars': [('b', 'ы')],
+            'objects': [('b', 'three')],
+        }
+        assert result.rejects == ['reject']
+        assert len(records) == 3
+
+    def test_pop(self, records):
+        '''удаляет последний документ вместе с объектами.'''
+        records.append('c', '3', [])
+        records.pop()
+        records.pop()
+        assert records.to_dict() == {
+            'vars': [('a', '1')],
+            'objects': [('a', 'one'), ('a', 'two')],
+        }
+
+    def test_to_csv(self, records):
+        '''формирует содержимое csv файла таблицы.'''
+        assert records.to_csv('vars') == encode_csv(records.vars())
+        assert records.to_csv('objects') == (
+            b'a,one\r\na,two\r\nb,three\r\n'
+        )
+
+    @pytest.mark.parametrize('documents', [
+        [],
+        [('a', '1', [])],
+        [('a', '1', ['one', 'two']), ('b', 'ы', ['three']), ('', '', [''])],
+    ])
+    def test_bytes(self, documents):
+        '''восстанавливает результаты из двоичного представления.'''
+        records = Records()
+        for document in documents:
+            records.append(*document)
+        assert Records.from_bytes(records.to_bytes()) == records
+        assert pickle.loads(pickle.dumps(records)) == records
+
+    def test_bad_table(self, records):
+        '''вызывает ошибку KeyError для неизвестной таблицы.'''
+        with pytest.raises(KeyError):
+            records.rows('unknown')
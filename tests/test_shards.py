@@ -0,0 +1,114 @@
+import csv
+import json
+import os.path
+
+import pytest
+
+from ngenix_demo_task.aio import do_task_two_async
+from ngenix_demo_task.parser import ParserError, do_task_two
+from ngenix_demo_task.records import Records
+from ngenix_demo_task.shards import (
+    PARTS_FILENAME, ShardedCSVWriter, part_path, shard_of, split_records,
+    store_shards)
+
+
+def read_parts(path, table, shards):
+    rows = []
+    for shard in range(shards):
+        with open(part_path(path, table, shard)) as csvfile:
+            part = list(csv.reader(csvfile))
+        rows.extend(part[1:])
+    return rows
+
+
+class TestSplitRecords:
+    '''shard_of, split_records'''
+
+    def test_shard_of(self):
+        '''возвращает номер части, не зависящий от процесса.'''
+        assert shard_of('a', 4) == 3
+        assert shard_of('a', 1) == 0
+
+    def test_split(self):
+        '''помещает документ и его объекты в часть по номеру id.'''
+        result = Records()
+        result.append('a', '1', ['one', 'two'])
+        result.append('b', '2', [])
+        result.append('c', '3', ['three'])
+        parts = split_records(result, 2)
+        assert sum(len(x) for x in parts) == 3
+        for shard, part in enumerate(parts):
+            for id in part.ids:
+                assert shard_of(id, 2) == shard
+        objects = sorted(x for part in parts for x in part.objects())
+        assert objects == [('a', 'one'), ('a', 'two'), ('c', 'three')]
+
+
+class TestShardedCSVWriter:
+    '''ShardedCSVWriter, store_shards'''
+
+    def test_ok(self, tmpdir):
+        '''записывает строки в части таблиц и список частей.'''
+        path = str(tmpdir)
+        result = Records()
+        result.append('a', '1', ['one', 'two'])
+        result.append('b', '20', ['three'])
+        with ShardedCSVWriter(path, shards=3) as output:
+            output.write(store_shards(path, 3, result))
+        assert sorted(read_parts(path, 'vars', 3)) == [
+            ['a', '1'], ['b', '20']
+        ]
+        assert sorted(read_parts(path, 'objects', 3)) == [
+            ['a', 'one'], ['a', 'two'], ['b', 'three']
+        ]
+        with open(os.path.join(path, PARTS_FILENAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        assert manifest['shards'] == 3
+        objects = manifest['tables']['objects']
+        assert objects['header'] == ['id', 'object_name']
+        assert objects['rows'] == 3
+        assert objects['parts'] == [
+            {'path': os.path.join('objects', 'part-00000.csv'), 'rows': 2},
+            {'path': os.path.join('objects', 'part-00001.csv'), 'rows': 0},
+            {'path': os.path.join('objects', 'part-00002.csv'), 'rows': 1},
+        ]
+
+    def test_stale_parts(self, tmpdir):
+        '''удаляет части предыдущего запуска с большим количеством частей.
+        '''
+        path = str(tmpdir)
+        with ShardedCSVWriter(path, shards=4):
+            pass
+        with ShardedCSVWriter(path, shards=2, manifest=False):
+            pass
+        assert sorted(os.listdir(os.path.join(path, 'vars'))) == [
+            'part-00000.csv', 'part-00001.csv'
+        ]
+        assert not os.path.exists(os.path.join(path, PARTS_FILENAME))
+
+    def test_system_error(self, tmpdir):
+        '''возвращает ошибку ParserError, если файл части не существует.'''
+        result = Records()
+        result.append('a', '1', [])
+        with pytest.raises(ParserError):
+            store_shards(str(tmpdir), 2, result)
+
+
+class TestDoTaskTwo:
+    '''do_task_two, do_task_two_async с ShardedCSVWriter'''
+
+    @pytest.mark.parametrize('task', [do_task_two, do_task_two_async])
+    def test_ok(self, folder, task):
+        '''строки всех архивов записываются процессами пула в части.'''
+        do_task_two(folder, workers=1)
+        with open(os.path.join(folder, 'objects.csv')) as csvfile:
+            expected = sorted(list(csv.reader(csvfile))[1:])
+        writer = ShardedCSVWriter
+        task(folder, writer=lambda path: writer(path, shards=3), workers=2,
+             chunk_size=1)
+        assert len(read_parts(folder, 'vars', 3)) == 4
+        assert sorted(read_parts(folder, 'objects', 3)) == expected
+        with open(os.path.join(folder, PARTS_FILENAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        assert manifest['tables']['vars']['rows'] == 4
+        assert manifest['tables']['objects']['rows'] == 12
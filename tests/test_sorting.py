@@ -0,0 +1,198 @@
+import csv
+import os.path
+from unittest import mock
+
+import pytest
+
+from ngenix_demo_task.parser import ParserError, do_task_two
+from ngenix_demo_task.records import Records
+from ngenix_demo_task.sorting import (
+    INDEX_FILENAME, SortedCSVWriter, file_stamp, lookup, merge_runs,
+    read_index, read_run, write_run)
+
+
+def read_csv(path, filename):
+    with open(os.path.join(path, filename), newline='') as csvfile:
+        return [tuple(row) for row in csv.reader(csvfile)]
+
+
+def make_records(*documents):
+    records = Records()
+    for document in documents:
+        records.append(*document)
+    return records
+
+
+DOCUMENTS = [
+    ('d', '4', ['d1']),
+    ('b', '2', ['b1', 'b,2']),
+    ('e', '5', ['e1']),
+    ('a', '1', ['a1']),
+    ('b', '3', ['b3']),
+    ('c', '"3"', ['c\n1', 'c2', 'c3']),
+]
+
+
+class TestRuns:
+    '''write_run, read_run, merge_runs'''
+
+    def test_ok(self, tmpdir):
+        '''объединяет отсортированные файлы с сохранением порядка
+        документов с одинаковыми id.
+        '''
+        first = str(tmpdir.join('first'))
+        second = str(tmpdir.join('second'))
+        write_run(first, [('a', '1', ['x']), ('b', '2', ['y', 'z'])])
+        write_run(second, [('a', '3', []), ('c', '4', ['w\n'])])
+        assert list(read_run(second)) == [('a', '3', []), ('c', '4', ['w\n'])]
+        assert list(merge_runs([first, second])) == [
+            ('a', '1', ['x']), ('a', '3', []), ('b', '2', ['y', 'z']),
+            ('c', '4', ['w\n']),
+        ]
+
+
+class TestSortedCSVWriter:
+    '''SortedCSVWriter'''
+
+    @pytest.mark.parametrize('memory, interval, fan_in', [
+        (1024 * 1024, 256, 64),
+        (1, 1, 64),
+        (1, 2, 2),
+    ])
+    def test_ok(self, tmpdir, memory, interval, fan_in):
+        '''записывает csv файлы, отсортированные по id, и удаляет
+        временные файлы.
+        '''
+        path = str(tmpdir)
+        with mock.patch('ngenix_demo_task.sorting.MAX_FAN_IN', fan_in):
+            with SortedCSVWriter(path, memory, interval) as output:
+                output.write(make_records(*DOCUMENTS[:3]))
+                output.write(make_records(*DOCUMENTS[3:]))
+        assert read_csv(path, 'vars.csv') == [
+            ('id', 'level'), ('a', '1'), ('b', '2'), ('b', '3'),
+            ('c', '"3"'), ('d', '4'), ('e', '5'),
+        ]
+        assert read_csv(path, 'objects.csv') == [
+            ('id', 'object_name'), ('a', 'a1'), ('b', 'b1'), ('b', 'b,2'),
+            ('b', 'b3'), ('c', 'c\n1'), ('c', 'c2'), ('c', 'c3'),
+            ('d', 'd1'), ('e', 'e1'),
+        ]
+        assert sorted(os.listdir(path)) == [
+            INDEX_FILENAME, 'objects.csv', 'vars.csv'
+        ]
+        with read_index(path) as index:
+            assert len(index) == -(-6 // interval)
+            assert list(index) == sorted(x[0] for x in DOCUMENTS)[::interval]
+            assert index.offsets(0) == (
+                len(b'id,level\r\n'), len(b'id,object_name\r\n')
+            )
+            assert index.stamps == (
+                file_stamp(os.path.join(path, 'vars.csv')),
+                file_stamp(os.path.join(path, 'objects.csv')),
+            )
+
+    def test_empty(self, tmpdir):
+        '''записывает только заголовки, если документов нет.'''
+        path = str(tmpdir)
+        with SortedCSVWriter(path):
+            pass
+        assert read_csv(path, 'vars.csv') == [('id', 'level')]
+        assert lookup(path, 'a') == {'vars': [], 'objects': []}
+
+    def test_error(self, tmpdir):
+        '''не записывает результаты и удаляет временные файлы, если при
+        разборе произошла ошибка.
+        '''
+        path = str(tmpdir)
+        with pytest.raises(ParserError):
+            with SortedCSVWriter(path, memory=1) as output:
+                output.write(make_records(*DOCUMENTS))
+                raise ParserError('Test')
+        assert os.listdir(path) == []
+
+    def test_do_task_two(self, folder):
+        '''записывает отсортированные результаты do_task_two.'''
+        do_task_two(folder, writer=SortedCSVWriter, workers=1)
+        assert read_csv(folder, 'vars.csv')[1:] == [
+            ('helloworld', '42')
+        ] * 4
+
+    def test_plain_parse_after_sorted(self, folder):
+        '''lookup возвращает ошибку после перезаписи результатов без
+        сортировки, даже если размер файлов не изменился.
+        '''
+        do_task_two(folder, writer=SortedCSVWriter, workers=1)
+        do_task_two(folder, workers=1)
+        with pytest.raises(ParserError) as excinfo:
+            lookup(folder, 'helloworld')
+        assert 'rerun parse with --sorted' in str(excinfo.value)
+
+
+class TestLookup:
+    '''lookup'''
+
+    @pytest.fixture(params=[1, 2, 256])
+    def path(self, request, tmpdir):
+        '''Фикстура папки с отсортированными результатами.'''
+        path = str(tmpdir)
+        with SortedCSVWriter(path, interval=request.param) as output:
+            output.write(make_records(*DOCUMENTS))
+        return path
+
+    @pytest.mark.parametrize('id, expected', [
+        ('a', {'vars': [('a', '1')], 'objects': [('a', 'a1')]}),
+        ('b', {
+            'vars': [('b', '2'), ('b', '3')],
+            'objects': [('b', 'b1'), ('b', 'b,2'), ('b', 'b3')],
+        }),
+        ('c', {
+            'vars': [('c', '"3"')],
+            'objects': [('c', 'c\n1'), ('c', 'c2'), ('c', 'c3')],
+        }),
+        ('e', {'vars': [('e', '5')], 'objects': [('e', 'e1')]}),
+        ('0', {'vars': [], 'objects': []}),
+        ('bb', {'vars': [], 'objects': []}),
+        ('f', {'vars': [], 'objects': []}),
+    ])
+    def test_ok(self, path, id, expected):
+        '''возвращает строки документов с заданным id.'''
+        assert lookup(path, id) == expected
+
+    def test_no_index(self, tmpdir):
+        '''возвращает ошибку ParserError, если индекса нет.'''
+        with pytest.raises(ParserError):
+            lookup(str(tmpdir), 'a')
+
+    @pytest.mark.parametrize('size', [0, 10, 60])
+    def test_corrupted(self, path, size):
+        '''возвращает ошибку ParserError, если индекс поврежден.'''
+        with open(os.path.join(path, INDEX_FILENAME), 'r+b') as index:
+            index.truncate(size)
+        with pytest.raises(ParserError) as excinfo:
+            lookup(path, 'a')
+        assert 'is corrupted' in str(excinfo.value)
+
+    def test_outdated(self, path):
+        '''возвращает ошибку ParserError, если csv файл изменен после
+        создания индекса.
+        '''
+        with open(os.path.join(path, 'vars.csv'), 'a') as csvfile:
+            csvfile.write('z,1\r\n')
+        with pytest.raises(ParserError) as excinfo:
+            lookup(path, 'a')
+        assert 'does not match vars.csv' in str(excinfo.value)
+
+    def test_overwritten(self, path):
+        '''возвращает ошибку ParserError, если csv файл перезаписан тем же
+        объемом данных после создания индекса.
+        '''
+        filename = os.path.join(path, 'vars.csv')
+        with open(filename, 'rb') as csvfile:
+            data = csvfile.read()
+        stat = os.stat(filename)
+        with open(filename, 'wb') as csvfile:
+            csvfile.write(data)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        with pytest.raises(ParserError) as excinfo:
+            lookup(path, 'a')
+        assert 'does not match vars.csv' in str(excinfo.value)
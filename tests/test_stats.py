@@ -0,0 +1,190 @@
+import json
+import os.path
+import shutil
+from collections import Counter
+from unittest import mock
+from zipfile import ZipFile
+
+import pytest
+
+from ngenix_demo_task.generator import generate_zip
+from ngenix_demo_task.parser import ParserError, ZIPParserError
+from ngenix_demo_task.records import Records
+from ngenix_demo_task.stats import (
+    Stats, accumulate, collect_stats, format_stats, save_stats)
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+def make_records(*documents):
+    records = Records()
+    for document in documents:
+        records.append(*document)
+    return records
+
+
+class TestStats:
+    '''Stats'''
+
+    def test_add(self):
+        '''подсчитывает level, количество объектов и наименования.'''
+        stats = Stats()
+        stats.add(make_records(
+            ('a', '2', ['x', 'y']),
+            ('b', '10', ['x']),
+            ('c', '2', ['z', 'x', 'y']),
+        ))
+        assert stats.documents == 3
+        assert stats.objects == 6
+        assert stats.levels == {'2': 2, '10': 1}
+        assert stats.sizes == {1: 1, 2: 1, 3: 1}
+        assert stats.top_names(2) == [('x', 3), ('y', 2)]
+        assert stats.names_error == 0
+
+    def test_merge(self):
+        '''объединяет статистику, собранную по частям.'''
+        documents = [
+            ('a', '1', ['x', 'y']), ('b', '2', ['x']), ('c', '1', ['y']),
+        ]
+        expected = Stats()
+        expected.add(make_records(*documents))
+        stats = Stats()
+        for document in documents:
+            part = Stats()
+            part.add(make_records(document))
+            part.archives = {'0.zip': 1}
+            stats.merge(part)
+        assert stats.to_dict() == dict(expected.to_dict(),
+                                       archives=[['0.zip', 3]])
+
+    def test_prune(self):
+        '''хранит не более capacity наименований и занижает их количество
+        не более чем на names_error.
+        '''
+        names = ['frequent'] * 50 + ['common'] * 20 + [
+            'rare{}'.format(x) for x in range(100)
+        ]
+        expected = Counter(names)
+        stats = Stats(capacity=4)
+        for offset in range(0, len(names), 7):
+            part = Stats(capacity=4)
+            part.add(make_records(('a', '1', names[offset:offset + 7])))
+            stats.merge(part)
+        assert len(stats.names) <= 4
+        assert [x for x, _ in stats.top_names(2)] == ['frequent', 'common']
+        assert stats.names_error <= stats.objects / (4 + 1)
+        for name, count in expected.items():
+            if count > stats.objects / (4 + 1):
+                assert name in stats.names
+        for name, count in stats.names.items():
+            assert expected[name] - stats.names_error <= count
+            assert count <= expected[name]
+
+    def test_levels_order(self):
+        '''сортирует level как числа, остальные значения после чисел.'''
+        stats = Stats()
+        stats.add(make_records(
+            ('a', '10', ['x']), ('b', 'high', ['x']), ('c', '9', ['x']),
+        ))
+        assert stats.to_dict()['levels'] == [['9', 1], ['10', 1], ['high', 1]]
+
+    def test_accumulate(self):
+        '''возвращает статистику и отклоненные документы части архива.'''
+        records = make_records(('a', '1', ['x']))
+        result = accumulate(16, records)
+        assert result['stats'].documents == 1
+        assert result['stats'].capacity == 16
+        assert result['rejects'] is records.rejects
+
+
+class TestCollectStats:
+    '''collect_stats'''
+
+    @pytest.mark.parametrize('chunk_size', [1, 1024 * 1024])
+    def test_ok(self, folder, chunk_size):
+        '''собирает статистику без записи csv файлов.'''
+        stats, rejected = collect_stats(folder, workers=2,
+                                        chunk_size=chunk_size)
+        assert not rejected
+        assert stats.to_dict() == {
+            'documents': 4,
+            'objects': 12,
+            'levels': [['42', 4]],
+            'objects_per_document': [[3, 4]],
+            'top_names': [['one', 4], ['three', 4], ['two', 4]],
+            'names_error': 0,
+            'archives': [['0.zip', 2], ['1.zip', 2]],
+        }
+        assert sorted(os.listdir(folder)) == ['0.zip', '1.zip']
+
+    def test_raise(self, folder):
+        '''прерывает обработку, если архив не удалось разобрать.'''
+        shutil.copy(os.path.join(DATA_DIR, 'corrupted.zip'), folder)
+        with pytest.raises(ZIPParserError):
+            collect_stats(folder, workers=1)
+
+    def test_skip(self, folder):
+        '''пропускает поврежденные архивы и записывает отчет о них.'''
+        shutil.copy(os.path.join(DATA_DIR, 'corrupted.zip'), folder)
+        stats, rejected = collect_stats(folder, on_error='skip', workers=1)
+        assert stats.documents == 4
+        assert dict(stats.to_dict()['archives'])['corrupted.zip'] == 0
+        assert rejected == {'zip': 1}
+        assert os.path.exists(os.path.join(folder, 'rejects.csv'))
+
+    def test_skip_damaged_partway(self, folder):
+        '''не учитывает документы архива, поврежденного после первых
+        файлов.
+        '''
+        path = os.path.join(folder, '2.zip')
+        generate_zip(path, 5, compression='deflated', seed=0)
+        with ZipFile(path) as archive:
+            info = archive.infolist()[-1]
+        with open(path, 'r+b') as stream:
+            stream.seek(info.header_offset + 30 + len(info.filename))
+            stream.write(b'\xff' * min(info.compress_size, 64))
+        stats, rejected = collect_stats(folder, on_error='skip', workers=2,
+                                        chunk_size=1)
+        assert rejected == {'zip': 1}
+        assert stats.documents == 4
+
+
+class TestFormatStats:
+    '''format_stats'''
+
+    def test_ok(self):
+        '''выводит итоги и таблицы статистики.'''
+        stats = Stats(capacity=1)
+        stats.add(make_records(('a', '7', ['x', 'x', 'y'])))
+        stats.archives = {'0.zip': 1}
+        text = format_stats(stats, top=1)
+        lines = text.splitlines()
+        assert lines[0].split() == ['documents', '1']
+        assert ['7', '1'] in [x.split() for x in lines]
+        assert ['x', '1'] in [x.split() for x in lines]
+        assert ['0.zip', '1'] in [x.split() for x in lines]
+        assert 'underestimated by up to 1' in text
+
+
+class TestSaveStats:
+    '''save_stats'''
+
+    def test_ok(self, tmpdir):
+        '''сохраняет статистику в JSON файл.'''
+        stats = Stats()
+        stats.add(make_records(('a', '7', ['x'])))
+        path = str(tmpdir.join('stats.json'))
+        save_stats(path, stats)
+        with open(path) as json_file:
+            assert json.load(json_file) == stats.to_dict()
+
+    @mock.patch('ngenix_demo_task.stats.open')
+    def test_system_error(self, open_mock, tmpdir):
+        '''возвращает ошибку ParserError, если при записи файла возникла
+        системная ошибка.
+        '''
+        open_mock.side_effect = IOError('Test')
+        with pytest.raises(ParserError) as excinfo:
+            save_stats(str(tmpdir.join('stats.json')), Stats())
+        assert 'Test' in str(excinfo.value)
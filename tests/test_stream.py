@@ -0,0 +1,251 @@
+import csv
+import io
+import os.path
+import sys
+from unittest import mock
+from zipfile import BadZipFile, ZipFile
+
+import pytest
+
+from ngenix_demo_task.generator import COMPRESSIONS, generate_zip
+from ngenix_demo_task.parser import (
+    ParserError, ZIPParserError, do_task_two, parse_archive)
+from ngenix_demo_task.records import Document
+from ngenix_demo_task.stream import (
+    do_task_two_stream, iter_records, read_stream_members)
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+DOCUMENT = Document('helloworld', '42', ('one', 'two', 'three'))
+
+
+class Pipe:
+    '''Поток без произвольного доступа, возвращающий данные малыми
+    порциями.'''
+
+    def __init__(self, data, size=7):
+        self.stream = io.BytesIO(data)
+        self.size = size
+
+    def read(self, size=-1):
+        return self.stream.read(min(size, self.size))
+
+
+def read_data(filename):
+    with open(os.path.join(DATA_DIR, filename), 'rb') as data_file:
+        return data_file.read()
+
+
+def generated(compression='stored', documents=5):
+    stream = io.BytesIO()
+    generate_zip(stream, xml_documents_quantity=documents,
+                 compression=compression, seed=1)
+    return stream.getvalue()
+
+
+def corrupted_crc():
+    data = bytearray(read_data('test.zip'))
+    position = data.index(b'helloworld')
+    data[position] = ord('j')
+    return bytes(data)
+
+
+class TestReadStreamMembers:
+    '''read_stream_members'''
+
+    @pytest.mark.parametrize('compression', ['stored', 'deflated', 'bzip2'])
+    def test_descriptor(self, compression):
+        '''читает архив, записанный в поток, с размерами в дескрипторах
+        данных.
+        '''
+        data = generated(compression)
+        members = [(x, bytes(y.data)) for x, y in
+                   read_stream_members(Pipe(data))]
+        with ZipFile(io.BytesIO(data)) as archive:
+            assert members == [
+                (x, archive.read(x)) for x in archive.namelist()
+            ]
+
+    @pytest.mark.parametrize('compression', ['stored', 'deflated', 'bzip2'])
+    def test_sizes(self, tmpdir, compression):
+        '''читает архив с размерами в локальных заголовках.'''
+        path = str(tmpdir.join('test.zip'))
+        with ZipFile(path, 'w', COMPRESSIONS[compression]) as archive:
+            archive.writestr('0.xml', read_data('good.xml'))
+            archive.writestr('1.xml', b'')
+        with open(path, 'rb') as stream:
+            members = [(x, bytes(y.data)) for x, y in
+                       read_stream_members(Pipe(stream.read()))]
+        assert members == [('0.xml', read_data('good.xml')), ('1.xml', b'')]
+
+    def test_drain(self):
+        '''дочитывает поток после центрального каталога.'''
+        stream = io.BytesIO(read_data('test.zip') + b'tail')
+        assert len(list(read_stream_members(stream))) == 2
+        assert stream.read() == b''
+
+    @pytest.mark.parametrize('data', [
+        b'',
+        b'not a zip',
+    ])
+    def test_not_zip(self, data):
+        '''возвращает ошибку BadZipFile, если поток не является архивом.'''
+        with pytest.raises(BadZipFile):
+            list(read_stream_members(io.BytesIO(data)))
+
+    @pytest.mark.parametrize('compression', ['stored', 'deflated'])
+    def test_truncated(self, compression):
+        '''возвращает ошибку BadZipFile, если поток обрывается.'''
+        data = generated(compression)
+        with pytest.raises(BadZipFile):
+            list(read_stream_members(io.BytesIO(data[:len(data) // 2])))
+
+    def test_bad_crc(self):
+        '''возвращает ошибку BadZipFile, если crc файла не совпадает.'''
+        with pytest.raises(BadZipFile) as excinfo:
+            list(read_stream_members(io.BytesIO(corrupted_crc())))
+        assert 'CRC' in str(excinfo.value)
+
+    def test_lzma(self):
+        '''возвращает ошибку BadZipFile для неподдерживаемого метода
+        сжатия.
+        '''
+        with pytest.raises(BadZipFile):
+            list(read_stream_members(Pipe(generated('lzma'))))
+
+
+class TestIterRecords:
+    '''iter_records'''
+
+    def test_path(self):
+        '''разбирает документы архива по пути.'''
+        path = os.path.join(DATA_DIR, 'test.zip')
+        assert list(iter_records(path)) == [DOCUMENT] * 2
+
+    @pytest.mark.parametrize('zip_reader', ['zipfile', 'mmap'])
+    def test_folder(self, zip_reader):
+        '''разбирает документы всех архивов папки.'''
+        path = os.path.join(DATA_DIR, 'good')
+        documents = list(iter_records(path, zip_reader=zip_reader))
+        assert documents == [DOCUMENT] * 4
+
+    def test_bytes(self):
+        '''разбирает документы архива из bytes.'''
+        data = generated()
+        expected = parse_archive(io.BytesIO(data)).to_dict()['vars']
+        documents = list(iter_records(data))
+        assert [(x.id, x.level) for x in documents] == expected
+
+    @pytest.mark.parametrize('seekable', [True, False])
+    def test_stream(self, seekable):
+        '''разбирает документы архива из двоичного потока.'''
+        data = read_data('test.zip')
+        stream = io.BytesIO(data) if seekable else Pipe(data)
+        assert list(iter_records(stream, 'tree')) == [DOCUMENT] * 2
+
+    def test_stdin(self):
+        '''читает архив из стандартного ввода.'''
+        stdin = mock.Mock(buffer=Pipe(read_data('test.zip')))
+        with mock.patch.object(sys, 'stdin', stdin):
+            assert list(iter_records('-')) == [DOCUMENT] * 2
+
+    def test_lazy(self):
+        '''разбирает документы по мере получения значений.'''
+        data = bytearray(generated(documents=3))
+        position = data.index(b'2.xml')
+        data[position + 10:] = b''
+        documents = iter_records(Pipe(bytes(data)))
+        assert len([next(documents), next(documents)]) == 2
+        with pytest.raises(ZIPParserError):
+            next(documents)
+
+    def test_not_only_xml(self):
+        '''возвращает ошибку ZIPParserError, если архив содержит не только
+        xml файлы.
+        '''
+        with pytest.raises(ZIPParserError):
+            list(iter_records(read_data('not_only_xml.zip')))
+
+    def test_missing(self, tmpdir):
+        '''возвращает ошибку ParserError, если файл не существует.'''
+        with pytest.raises(ParserError):
+            list(iter_records(str(tmpdir.join('missing.zip'))))
+
+    @pytest.mark.parametrize('zip_reader', ['zipfile', 'mmap'])
+    @pytest.mark.parametrize('seekable', [True, False])
+    def test_bad_crc(self, tmpdir, zip_reader, seekable):
+        '''возвращает ошибку ZIPParserError, если crc файла архива по пути
+        или в потоке не совпадает.
+        '''
+        path = str(tmpdir.join('badcrc.zip'))
+        with open(path, 'wb') as archive:
+            archive.write(corrupted_crc())
+        with pytest.raises(ZIPParserError):
+            list(iter_records(path, zip_reader=zip_reader))
+        with open(path, 'rb') as stream:
+            source = stream if seekable else Pipe(stream.read())
+            with pytest.raises(ZIPParserError):
+                list(iter_records(source))
+
+    def test_bad_compressed_data(self, tmpdir):
+        '''возвращает ошибку ZIPParserError, если сжатые данные файла архива
+        по пути повреждены.
+        '''
+        path = str(tmpdir.join('test.zip'))
+        data = bytearray(generated('deflated', documents=1))
+        with ZipFile(io.BytesIO(bytes(data))) as archive:
+            info = archive.infolist()[0]
+        offset = info.header_offset + 30 + len(info.filename.encode())
+        data[offset:offset + info.compress_size] = (
+            b'\xff' * info.compress_size)
+        with open(path, 'wb') as archive:
+            archive.write(data)
+        with pytest.raises(ZIPParserError):
+            list(iter_records(path))
+
+
+class TestDoTaskTwoStream:
+    '''do_task_two_stream'''
+
+    def read(self, folder, filename):
+        with open(os.path.join(folder, filename)) as csvfile:
+            return list(csv.reader(csvfile))
+
+    @pytest.mark.parametrize('chunk_size', [1, 1024 * 1024])
+    def test_ok(self, tmpdir, chunk_size):
+        '''записывает результаты разбора архива из потока.'''
+        folder = str(tmpdir.mkdir('folder'))
+        data = generated('deflated', documents=20)
+        with open(os.path.join(folder, '0.zip'), 'wb') as archive:
+            archive.write(data)
+        do_task_two(folder, workers=1)
+        output = str(tmpdir.mkdir('output'))
+        do_task_two_stream(output, Pipe(data, 4096), workers=2,
+                           chunk_size=chunk_size)
+        for filename in ('vars.csv', 'objects.csv'):
+            assert (self.read(output, filename) ==
+                    self.read(folder, filename))
+
+    def test_corrupted(self, tmpdir):
+        '''возвращает ошибку ZIPParserError, если архив поврежден.'''
+        path = os.path.join(DATA_DIR, 'corrupted.zip')
+        with pytest.raises(ZIPParserError):
+            do_task_two_stream(str(tmpdir), path, workers=1)
+
+    def test_bad_crc(self, tmpdir):
+        '''возвращает ошибку ZIPParserError, если crc файла архива по пути
+        не совпадает.
+        '''
+        path = str(tmpdir.join('badcrc.zip'))
+        with open(path, 'wb') as archive:
+            archive.write(corrupted_crc())
+        output = str(tmpdir.mkdir('output'))
+        with pytest.raises(ZIPParserError):
+            do_task_two_stream(output, path, workers=1)
+
+    def test_folder(self, tmpdir, folder):
+        '''записывает результаты разбора всех архивов папки.'''
+        output = str(tmpdir.mkdir('output'))
+        do_task_two_stream(output, folder, workers=1)
+        assert len(self.read(output, 'vars.csv')) == 1 + 4
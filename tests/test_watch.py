@@ -0,0 +1,128 @@
+import csv
+import os.path
+import shutil
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from ngenix_demo_task.generator import generate_zip
+from ngenix_demo_task.watch import (
+    InotifyWatcher, PollingWatcher, watch_folder)
+
+TESTS_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+
+def wait_for(condition, timeout=10):
+    '''Дождаться выполнения условия.'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def count_rows(path):
+    try:
+        with open(os.path.join(path, 'vars.csv'), 'r') as csvfile:
+            return len(list(csv.reader(csvfile))) - 1
+    except FileNotFoundError:
+        return None
+
+
+class TestPollingWatcher:
+    '''PollingWatcher'''
+
+    def test_ok(self, tmpdir):
+        '''сообщает о записанном архиве, когда его размер перестает меняться,
+        и об удаленном архиве.
+        '''
+        path = str(tmpdir.mkdir('archives'))
+        stop = threading.Event()
+        with PollingWatcher(path, interval=0) as watcher:
+            with open(os.path.join(path, '0.zip'), 'wb') as archive:
+                archive.write(b'PK')
+                assert watcher.poll(stop) == (set(), set())
+                archive.write(b'PK')
+                archive.flush()
+                assert watcher.poll(stop) == (set(), set())
+            assert watcher.poll(stop) == ({'0.zip'}, set())
+            assert watcher.poll(stop) == (set(), set())
+            os.remove(os.path.join(path, '0.zip'))
+            assert watcher.poll(stop) == (set(), {'0.zip'})
+
+
+@pytest.mark.skipif(not InotifyWatcher.available(),
+                    reason='inotify is not available')
+class TestInotifyWatcher:
+    '''InotifyWatcher'''
+
+    def test_ok(self, tmpdir):
+        '''сообщает об архивах в папке, закрытых после записи и удаленных
+        архивах.
+        '''
+        path = str(tmpdir.mkdir('archives'))
+        shutil.copy(os.path.join(DATA_DIR, 'test.zip'), path)
+        stop = threading.Event()
+        with InotifyWatcher(path, interval=0.1) as watcher:
+            assert watcher.poll(stop) == ({'test.zip'}, set())
+            assert watcher.poll(stop) == (set(), set())
+            with open(os.path.join(path, '0.zip'), 'wb') as archive:
+                archive.write(b'PK')
+                assert watcher.poll(stop) == (set(), set())
+            open(os.path.join(path, 'vars.csv'), 'w').close()
+            assert watcher.poll(stop) == ({'0.zip'}, set())
+            os.remove(os.path.join(path, 'test.zip'))
+            assert watcher.poll(stop) == (set(), {'test.zip'})
+
+
+class TestWatchFolder:
+    '''watch_folder'''
+
+    @pytest.mark.parametrize('polling', [True, False])
+    def test_ok(self, tmpdir, polling):
+        '''разбирает архивы по мере появления в папке, пропускает
+        поврежденные архивы и завершает работу по событию stop.
+        '''
+        path = str(tmpdir.mkdir('archives'))
+        generate_zip(os.path.join(path, '0.zip'), 3, seed=0)
+        stop, messages = threading.Event(), []
+        thread = threading.Thread(target=watch_folder, args=(path, ), kwargs={
+            'stop': stop, 'interval': 0.05, 'polling': polling,
+            'log': messages.append, 'workers': 1
+        })
+        thread.start()
+        try:
+            assert wait_for(lambda: count_rows(path) == 3)
+            shutil.copy(os.path.join(DATA_DIR, 'corrupted.zip'), path)
+            generate_zip(os.path.join(path, '1.zip'), 4, seed=1)
+            assert wait_for(lambda: count_rows(path) == 7)
+            assert wait_for(lambda: any(
+                'corrupted.zip' in x for x in messages
+            ))
+            os.remove(os.path.join(path, '0.zip'))
+            assert wait_for(lambda: count_rows(path) == 4)
+        finally:
+            stop.set()
+            thread.join(10)
+        assert not thread.is_alive()
+
+    def test_vanished(self, tmpdir):
+        '''пропускает архив, удаленный после события наблюдателя.'''
+        path = str(tmpdir.mkdir('archives'))
+        generate_zip(os.path.join(path, '0.zip'), 3, seed=0)
+        stop = threading.Event()
+
+        def poll(stop):
+            stop.set()
+            return {'0.zip', 'vanished.zip'}, set()
+        watcher = mock.MagicMock()
+        watcher.__enter__.return_value = watcher
+        watcher.poll.side_effect = poll
+        with mock.patch('ngenix_demo_task.watch.create_watcher',
+                        return_value=watcher):
+            watch_folder(path, stop=stop, workers=1)
+        assert count_rows(path) == 3
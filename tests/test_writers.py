@@ -0,0 +1,141 @@
+import os.path
+from functools import partial
+from zipfile import ZipFile
+
+import pytest
+
+from ngenix_demo_task.generator import generate_zip
+from ngenix_demo_task.parser import (
+    ParserError, XMLParserError, do_task_two)
+from ngenix_demo_task.records import Records
+from ngenix_demo_task.writers import (
+    ArrowWriter, ColumnarWriter, ParquetWriter, check_level)
+
+pyarrow = pytest.importorskip('pyarrow')
+pyarrow_ipc = pytest.importorskip('pyarrow.ipc')
+pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+
+RESULT = Records()
+RESULT.append('a', '1', ['one', 'two'])
+RESULT.append('b', '20', ['three'])
+
+
+def read_parquet(path, table):
+    return pyarrow_parquet.read_table(
+        os.path.join(path, '{}.parquet'.format(table))
+    )
+
+
+def read_arrow(path, table):
+    filename = os.path.join(path, '{}.arrows'.format(table))
+    with pyarrow_ipc.open_stream(filename) as reader:
+        return reader.read_all()
+
+
+@pytest.fixture(params=[
+    (ParquetWriter, read_parquet),
+    (ArrowWriter, read_arrow),
+])
+def writer(request):
+    '''Фикстура класса записи результатов и функции чтения таблицы.'''
+    return request.param
+
+
+class TestCheckLevel:
+    '''check_level'''
+
+    @pytest.mark.parametrize('level', ['0', '42', '-7', '2147483647'])
+    def test_ok(self, level):
+        '''пропускает level, который можно сохранить как int32.'''
+        check_level('a', level)
+
+    @pytest.mark.parametrize('level', [
+        'high', '', '+1', ' 1', '1.5', '2147483648', '-2147483649', '١',
+    ])
+    def test_bad(self, level):
+        '''возвращает ошибку XMLParserError для остальных значений.'''
+        with pytest.raises(XMLParserError) as excinfo:
+            check_level('a', level)
+        assert 'is not a 32-bit integer' in str(excinfo.value)
+
+
+class TestColumnarWriter:
+    '''ParquetWriter, ArrowWriter'''
+
+    def test_abstract(self, tmpdir):
+        '''базовый класс требует реализации open_sink.'''
+        with pytest.raises(TypeError):
+            ColumnarWriter(str(tmpdir))
+
+    @pytest.mark.parametrize('batch_size', [1, 2, 1000])
+    def test_ok(self, tmpdir, writer, batch_size):
+        '''сохраняет результаты разбора в типизированные таблицы.'''
+        writer_class, read = writer
+        path = str(tmpdir.mkdir('output'))
+        with writer_class(path, batch_size=batch_size) as output:
+            output.write(RESULT)
+            output.write(RESULT)
+        vars = read(path, 'vars')
+        assert vars.schema.field('level').type == pyarrow.int32()
+        assert vars.to_pydict() == {
+            'id': ['a', 'b', 'a', 'b'],
+            'level': [1, 20, 1, 20],
+        }
+        objects = read(path, 'objects')
+        assert pyarrow.types.is_dictionary(objects.schema.field('id').type)
+        assert objects.to_pydict() == {
+            'id': ['a', 'a', 'b'] * 2,
+            'object_name': ['one', 'two', 'three'] * 2,
+        }
+
+    def test_bad_level(self, tmpdir, writer):
+        '''возвращает ошибку ParserError, если level не является числом.'''
+        writer_class, read = writer
+        path = str(tmpdir.mkdir('output'))
+        with pytest.raises(ParserError) as excinfo:
+            with writer_class(path) as output:
+                records = Records()
+                records.append('a', 'high', [])
+                output.write(records)
+        assert 'Bad vars value' in str(excinfo.value)
+
+    def test_do_task_two(self, folder, writer):
+        '''используется do_task_two для записи результатов разбора.'''
+        writer_class, read = writer
+        path = folder
+        do_task_two(path, writer=partial(writer_class, batch_size=5),
+                    workers=1)
+        assert read(path, 'vars').num_rows == 4
+        assert read(path, 'objects').num_rows == 12
+        assert not os.path.exists(os.path.join(path, 'vars.csv'))
+
+    def bad_level_archive(self, folder):
+        generate_zip(os.path.join(folder, '2.zip'), 3, seed=0,
+                     data_options={'min_level': 1, 'max_level': 1})
+        with ZipFile(os.path.join(folder, '2.zip'), 'a') as archive:
+            archive.writestr('3.xml', (
+                '<root><var name="id" value="bad"/>'
+                '<var name="level" value="high"/>'
+                '<objects><object name="x"/></objects></root>'
+            ))
+
+    def test_do_task_two_skip_level(self, folder, writer):
+        '''отклоняет документы с нечисловым level при on_error=skip.'''
+        writer_class, read = writer
+        self.bad_level_archive(folder)
+        rejected = do_task_two(folder, writer=writer_class, workers=1,
+                               on_error='skip')
+        assert rejected == {'xml': 1}
+        vars = read(folder, 'vars').to_pydict()
+        assert len(vars['id']) == 4 + 3
+        assert 'bad' not in vars['id']
+        assert 'bad' not in read(folder, 'objects').to_pydict()['id']
+
+    def test_do_task_two_raise_level(self, folder, writer):
+        '''прерывает обработку документа с нечисловым level при
+        on_error=raise.
+        '''
+        writer_class, read = writer
+        self.bad_level_archive(folder)
+        with pytest.raises(XMLParserError):
+            do_task_two(folder, writer=writer_class, workers=1)